@@ -0,0 +1,241 @@
+"""Benchmarks the throughput, latency and memory of every pipeline and checks for regressions.
+
+For each pipeline, sweeps batch sizes and input-length distributions (short, long and mixed
+reviews from the annotated dataset). Each sweep point starts with warmup batches, then
+records per-item latency (the latency of the batch an item ran in) and rows/sec. Every
+pipeline is loaded and run in a fresh spawned process, so that its cold-start load time and
+peak RSS are its own. Every cache a pipeline reaches (the SetFit embedding cache, also inside
+the cascade, the HF and ONNX token caches and the shared dedup predictions) is disabled so
+that the models are measured, tokenization included.
+The OpenAI pipelines are only benchmarked on request (`--category openai`), since they cost
+money and may hit the completion cache.
+
+Example:
+    python scripts/benchmark_pipelines.py --category hf --category setfit --save-baseline
+    python scripts/benchmark_pipelines.py --baseline data/benchmarks/baseline.json
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import resource
+import sys
+import time
+
+import numpy as np
+
+from src.config import DATA_DIR, DATASET_PATH, RANDOM_SEED
+from src.data.make_dataset import load_dataset_from_file
+from src.pipelines import PIPELINE_GENERATORS, PIPELINE_NAMES, get_pipeline, run_pipeline
+from src.pipelines.parallel import available_cores, disable_caches, pinned_executor
+
+BENCHMARKS_DIR = DATA_DIR / "benchmarks"
+BASELINE_PATH = BENCHMARKS_DIR / "baseline.json"
+
+
+def get_inputs(n_rows: int) -> dict[str, list[tuple[str, str]]]:
+    """Sample (title, text) inputs with different length distributions
+
+    Args:
+        n_rows (int): Number of inputs per distribution
+
+    Returns:
+        dict: {"short": [...], "long": [...], "mixed": [...]}, where "short" and "long" are the
+            shortest and longest thirds of the annotated reviews
+    """
+    dataset = load_dataset_from_file(DATASET_PATH)
+    rows = [
+        (title, entry)
+        for split in ("train", "test")
+        for title, entry in zip(dataset[split]["title"], dataset[split]["entry"])
+    ]
+    rows.sort(key=lambda row: len(row[1]))
+    third = len(rows) // 3
+    rng = random.Random(RANDOM_SEED)
+    return {
+        name: [rng.choice(pool) for _ in range(n_rows)]
+        for name, pool in [("short", rows[:third]), ("long", rows[-third:]), ("mixed", rows)]
+    }
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+async def benchmark_pipeline(
+    pipeline, inputs: list[tuple[str, str]], batch_size: int, warmup: int
+) -> dict:
+    """Benchmark a pipeline on one input distribution and batch size
+
+    Args:
+        pipeline (Callable): The pipeline
+        inputs (list[tuple[str, str]]): (title, text) inputs
+        batch_size (int): Number of inputs per pipeline call
+        warmup (int): Number of untimed batches to run first
+
+    Returns:
+        dict: rows/sec and p50/p95/p99 per-item latency in ms
+    """
+    batches = [inputs[i : i + batch_size] for i in range(0, len(inputs), batch_size)]
+    for batch in batches[:warmup]:
+        titles, texts = map(list, zip(*batch))
+        await run_pipeline(pipeline, texts, titles)
+
+    item_latencies = []
+    start_time = time.perf_counter()
+    for batch in batches:
+        titles, texts = map(list, zip(*batch))
+        batch_start = time.perf_counter()
+        await run_pipeline(pipeline, texts, titles)
+        item_latencies += [time.perf_counter() - batch_start] * len(batch)
+    total_time = time.perf_counter() - start_time
+
+    latencies_ms = np.array(item_latencies) * 1000
+    return {
+        "rows": len(inputs),
+        "rows_per_sec": len(inputs) / total_time,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def benchmark_worker(
+    category: str,
+    name: str,
+    inputs: dict[str, list[tuple[str, str]]],
+    batch_sizes: list[int],
+    warmup: int,
+) -> dict:
+    """Load one pipeline and benchmark it (the body of a fresh worker process)
+
+    Returns:
+        dict: {"load_time": ..., "peak_rss_mb": ..., "runs": {"distribution/batch_size": ...}}
+    """
+    start_time = time.perf_counter()
+    pipeline = get_pipeline(category, name)
+    load_time = time.perf_counter() - start_time
+    disable_caches(pipeline)
+
+    key, runs = f"{category}/{name}", {}
+    for distribution, distribution_inputs in inputs.items():
+        for batch_size in batch_sizes:
+            print(f"Benchmarking {key} on {distribution} inputs, batch size {batch_size}...")
+            runs[f"{distribution}/{batch_size}"] = asyncio.run(
+                benchmark_pipeline(pipeline, distribution_inputs, batch_size, warmup)
+            )
+    return {"load_time": load_time, "peak_rss_mb": peak_rss_mb(), "runs": runs}
+
+
+def run_benchmarks(categories: list[str], batch_sizes: list[int], n_rows: int, warmup: int) -> dict:
+    """Benchmark every pipeline of the given categories, each in its own process
+
+    Returns:
+        dict: {"category/name": {"load_time": ..., "peak_rss_mb": ..., "runs": {
+            "distribution/batch_size": {...}}}}
+    """
+    inputs = get_inputs(n_rows)
+    results = {}
+    for category in categories:
+        for name in PIPELINE_NAMES[category]:
+            print(f"Loading {category}/{name}...")
+            executor = pinned_executor(available_cores())
+            try:
+                results[f"{category}/{name}"] = executor.submit(
+                    benchmark_worker, category, name, inputs, batch_sizes, warmup
+                ).result()
+            finally:
+                executor.shutdown()
+    return results
+
+
+def find_regressions(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Compare benchmark results against a baseline
+
+    Args:
+        results (dict): Output of `run_benchmarks`
+        baseline (dict): Output of `run_benchmarks` for the baseline
+        threshold (float): Tolerated relative slowdown, e.g. 0.1 for 10%
+
+    Returns:
+        list[str]: A description of every regression
+    """
+    regressions = []
+    for key, result in results.items():
+        for run, metrics in result["runs"].items():
+            reference = baseline.get(key, {}).get("runs", {}).get(run)
+            if reference is None:
+                continue
+            if metrics["rows_per_sec"] < reference["rows_per_sec"] * (1 - threshold):
+                regressions.append(
+                    f"{key} {run}: {metrics['rows_per_sec']:.1f} rows/sec "
+                    f"(baseline {reference['rows_per_sec']:.1f})"
+                )
+            if metrics["p95_ms"] > reference["p95_ms"] * (1 + threshold):
+                regressions.append(
+                    f"{key} {run}: p95 {metrics['p95_ms']:.1f} ms "
+                    f"(baseline {reference['p95_ms']:.1f})"
+                )
+    return regressions
+
+
+def print_summary(results: dict) -> None:
+    for key, result in results.items():
+        print(f"\n{key} (load {result['load_time']:.2f}s, peak RSS {result['peak_rss_mb']:.0f} MB)")
+        for run, metrics in result["runs"].items():
+            print(
+                f"  {run:>12}: {metrics['rows_per_sec']:8.1f} rows/sec, "
+                f"p50 {metrics['p50_ms']:8.1f} ms, p95 {metrics['p95_ms']:8.1f} ms, "
+                f"p99 {metrics['p99_ms']:8.1f} ms"
+            )
+
+
+def main(args: argparse.Namespace) -> bool:
+    """Main function
+
+    Returns:
+        bool: Whether the results are free of regressions against the baseline
+    """
+    results = run_benchmarks(args.category, args.batch_size, args.rows, args.warmup)
+    print_summary(results)
+
+    os.makedirs(BENCHMARKS_DIR, exist_ok=True)
+    now_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    report = {"date": now_str, "config": vars(args), "results": results}
+    path = args.output or BENCHMARKS_DIR / f"benchmark_{now_str}.json"
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"\nSaved results to {path}")
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Saved baseline to {BASELINE_PATH}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = find_regressions(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return not regressions
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--category", action="append", help="Pipeline category (repeatable)")
+    parser.add_argument("--batch-size", type=int, action="append", help="Batch size (repeatable)")
+    parser.add_argument("--rows", type=int, default=128, help="Inputs per distribution")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed batches per run")
+    parser.add_argument("--output", help="Path of the JSON report")
+    parser.add_argument("--baseline", help="Fail on regressions against this JSON report")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Tolerated slowdown")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Write {BASELINE_PATH}")
+    args = parser.parse_args()
+    args.category = args.category or [c for c in PIPELINE_GENERATORS if c != "openai"]
+    args.batch_size = args.batch_size or [1, 8, 32, 128]
+    sys.exit(0 if main(args) else 1)
@@ -0,0 +1,195 @@
+"""Reports the accuracy versus compute/cost trade-off of the cascade pipeline at each threshold.
+
+SetFit runs on every row; the fallback pipeline only runs on the rows below the highest
+threshold, once, and every threshold is evaluated from those predictions. Fallback time is
+extrapolated per escalated row, and for OpenAI fallbacks the tokens sent are priced with
+`OPENAI_PRICE_PER_1K_TOKENS` (cached completions cost nothing).
+
+Example:
+    python scripts/cascade_report.py --local-test-data --fallback openai/few_shot_batched
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import time
+
+import numpy as np
+
+from src.config import (
+    CASCADE_FALLBACK,
+    CASCADE_MARGIN_THRESHOLD,
+    DATA_DIR,
+    DATASET_PATH,
+    LABEL_MAPPING,
+    OPENAI_PRICE_PER_1K_TOKENS,
+)
+from src.data.make_dataset import load_dataset_from_file, load_latest_test_dataset
+from src.pipelines import get_pipeline, run_pipeline
+from src.pipelines.cascade import parse_pipeline_key, top2_margin
+
+THRESHOLDS = [0.0, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.01]
+
+
+def openai_tokens(category: str) -> int:
+    """Tokens sent to OpenAI so far by this process (0 for other pipelines)"""
+    if category != "openai":
+        return 0
+    from src.pipelines.openai.utils import scheduler
+
+    return scheduler.stats()["tokens"]
+
+
+def threshold_report(
+    labels: np.ndarray,
+    first_preds: np.ndarray,
+    fallback_preds: np.ndarray,
+    margins: np.ndarray,
+    thresholds: list[float],
+    first_time: float,
+    fallback_row_time: float,
+    fallback_row_cost: float,
+) -> list[dict]:
+    """Accuracy, escalated fraction, time and cost of the cascade at each threshold
+
+    Args:
+        labels (np.ndarray): True labels
+        first_preds (np.ndarray): SetFit's labels
+        fallback_preds (np.ndarray): The fallback's labels (None where it did not run)
+        margins (np.ndarray): SetFit's top-2 probability margins
+        thresholds (list[float]): Margin thresholds to evaluate
+        first_time (float): SetFit's time in seconds on all rows
+        fallback_row_time (float): Fallback seconds per escalated row
+        fallback_row_cost (float): Fallback dollars per escalated row
+
+    Returns:
+        list[dict]: One entry per threshold
+    """
+    # where the fallback gave no valid label, the cascade keeps SetFit's
+    answered = np.array([pred in LABEL_MAPPING.values() for pred in fallback_preds], dtype=bool)
+    rows = []
+    for threshold in thresholds:
+        escalated = margins < threshold
+        preds = np.where(escalated & answered, fallback_preds, first_preds)
+        rows.append(
+            {
+                "threshold": threshold,
+                "accuracy": float(np.mean(preds == labels)),
+                "escalated": int(escalated.sum()),
+                "escalated_ratio": float(escalated.mean()),
+                "seconds": first_time + fallback_row_time * escalated.sum(),
+                "cost": fallback_row_cost * escalated.sum(),
+            }
+        )
+    return rows
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Main function"""
+    if args.local_test_data:
+        dataset = load_dataset_from_file(DATASET_PATH)["test"]
+    else:
+        dataset = load_latest_test_dataset()
+    texts, titles = list(dataset["entry"]), list(dataset["title"])
+    labels = np.array(dataset["label_str"], dtype=object)
+    thresholds = sorted(args.thresholds)
+    category, name = parse_pipeline_key(args.fallback)
+
+    setfit = get_pipeline("setfit", "setfit")
+    start_time = time.perf_counter()
+    proba = setfit.predict_proba(texts)
+    first_time = time.perf_counter() - start_time
+    first_preds = np.array([LABEL_MAPPING[int(i)] for i in proba.argmax(axis=1)], dtype=object)
+    margins = top2_margin(proba)
+
+    fallback = get_pipeline(category, name)
+    candidates = np.flatnonzero(margins < thresholds[-1])
+    print(f"Running {args.fallback} on {len(candidates)}/{len(texts)} rows...")
+    tokens_before = openai_tokens(category)
+    start_time = time.perf_counter()
+    candidate_preds = await run_pipeline(
+        fallback, [texts[i] for i in candidates], [titles[i] for i in candidates]
+    )
+    fallback_time = time.perf_counter() - start_time
+    tokens = openai_tokens(category) - tokens_before
+    fallback_preds = np.full(len(texts), None, dtype=object)
+    fallback_preds[candidates] = candidate_preds
+
+    n = max(len(candidates), 1)
+    rows = threshold_report(
+        labels,
+        first_preds,
+        fallback_preds,
+        margins,
+        thresholds,
+        first_time,
+        fallback_row_time=fallback_time / n,
+        fallback_row_cost=tokens / 1000 * OPENAI_PRICE_PER_1K_TOKENS / n,
+    )
+    fallback_accuracy = float(np.mean(fallback_preds[candidates] == labels[candidates]))
+    setfit_accuracy = float(np.mean(first_preds[candidates] == labels[candidates]))
+
+    print(f"\nCascade setfit -> {args.fallback} on {len(texts)} rows")
+    print(
+        f"On the {len(candidates)} rows below {thresholds[-1]}: setfit {setfit_accuracy:.2%}, "
+        f"{args.fallback} {fallback_accuracy:.2%}"
+    )
+    print(f"{'threshold':>9} {'accuracy':>9} {'escalated':>10} {'seconds':>8} {'cost $':>8}")
+    for row in rows:
+        marker = " <- current" if row["threshold"] == CASCADE_MARGIN_THRESHOLD else ""
+        print(
+            f"{row['threshold']:>9.2f} {row['accuracy']:>9.2%} {row['escalated_ratio']:>10.1%} "
+            f"{row['seconds']:>8.2f} {row['cost']:>8.4f}{marker}"
+        )
+    best = max(row["accuracy"] for row in rows)
+    cheapest = min(
+        (row for row in rows if row["accuracy"] >= best - args.tolerance),
+        key=lambda row: row["escalated"],
+    )
+    print(
+        f"Lowest threshold within {args.tolerance:.1%} of the best accuracy: "
+        f"{cheapest['threshold']} ({cheapest['accuracy']:.2%}, "
+        f"{cheapest['escalated_ratio']:.1%} of rows escalated)"
+    )
+
+    now_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    results_dir = os.path.join(DATA_DIR, "results")  # type: ignore
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"cascade_{now_str}.json")
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "fallback": args.fallback,
+                "rows": len(texts),
+                "setfit_seconds": first_time,
+                "fallback_seconds": fallback_time,
+                "fallback_tokens": tokens,
+                "thresholds": rows,
+                "recommended_threshold": cheapest["threshold"],
+            },
+            f,
+            indent=2,
+        )
+    print(f"Saved the report to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--local-test-data", action="store_true", help="Evaluate on the local test split"
+    )
+    parser.add_argument(
+        "--fallback", default=CASCADE_FALLBACK, help="Fallback pipeline, as 'category/name'"
+    )
+    parser.add_argument(
+        "--thresholds", type=float, nargs="+", default=THRESHOLDS, help="Margins to evaluate"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.01,
+        help="Accuracy below the best which the recommended threshold may give up",
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -1,6 +1,16 @@
-"""Compares all models under consideration for the challenge and outputs a table of results."""
+"""Compares all models under consideration for the challenge and outputs a table of results.
 
+Stage timings and counters of the pipelines are printed and written to `METRICS_DIR`; with
+`--profile`, each pipeline's run is also profiled into `PROFILES_DIR`.
+
+Example:
+    python scripts/compare_all_models.py --concurrent
+    python scripts/compare_all_models.py --profile
+"""
+
+import argparse
 import asyncio
+import contextlib
 import datetime
 import os
 import pickle
@@ -11,17 +21,65 @@ import pandas as pd
 from datasets import Dataset  # type: ignore
 from sklearn.metrics import classification_report
 
-from src.config import DATA_DIR, DATASET_PATH
+from src.config import DATA_DIR, DATASET_PATH, METRICS_DIR
 from src.data.make_dataset import load_dataset_from_file, load_latest_test_dataset
-from src.pipelines import get_all_pipelines
+from src.metrics import metrics, print_stage_table
+from src.metrics import profile as profile_block
+from src.pipelines import (
+    IO_BOUND_CATEGORIES,
+    PIPELINE_NAMES,
+    get_all_pipelines,
+    get_pipeline,
+    run_pipeline,
+)
+from src.pipelines.parallel import pinned_executor, score_pipeline, split_cores
+
+
+def evaluate_predictions(dataset: Dataset, preds: list[str], pipeline: str, time_taken: float):
+    """Evaluate a pipeline's predictions against the dataset labels
+
+    Args:
+        dataset (Dataset): The evaluation dataset
+        preds (list[str]): The pipeline's predictions, in dataset order
+        pipeline (str): Description of the pipeline
+        time_taken (float): Inference time in seconds
+
+    Returns:
+        dict: The result entry of the pipeline (see `run_comparison`)
+    """
+    assert len(preds) == len(dataset)
+    df = dataset.to_pandas()
+    assert isinstance(df, pd.DataFrame)  # to get better type hints
+    df["preds"] = preds
+    report_str = classification_report(dataset["label_str"], preds)
+    report = classification_report(dataset["label_str"], preds, output_dict=True)
+    accuracy = np.mean(df["preds"] == df["label_str"])
+
+    # Print the results
+    print(report_str)
 
+    return {
+        "pipeline": pipeline,
+        "report": report,
+        "report_str": report_str,
+        "accuracy": accuracy,
+        "time": time_taken,
+        "df": df,
+    }
 
-async def run_comparison(all_pipelines: dict, dataset: Dataset) -> dict:
+
+def maybe_profile(enabled: bool, category: str, name: str):
+    """Profile a pipeline's run if enabled (see `src.metrics.profile`)"""
+    return profile_block(f"{category}_{name}") if enabled else contextlib.nullcontext()
+
+
+async def run_comparison(all_pipelines: dict, dataset: Dataset, profile: bool = False) -> dict:
     """Compare the performance of multiple sentiment analysis models
 
     Args:
         all_pipelines (dict): A nested dictionary of pipelines to compare
         dataset (Dataset): The dataset to use for model evaluation
+        profile (bool, optional): Profile each pipeline's run. Defaults to False.
 
     Returns:
         dict: A dictionary with model names as keys and a dictionary
@@ -42,50 +100,114 @@ async def run_comparison(all_pipelines: dict, dataset: Dataset) -> dict:
             print(f"Running {category} - {name}...")
             start_time = time.time()
 
-            if getattr(pipeline, "expects_titles", False):
-                # If the pipeline supports titles, pass them in as well
-                pipe_inputs = zip(dataset["title"], dataset["entry"])
-            else:
-                # Otherwise, just pass in the entries
-                pipe_inputs = dataset["entry"]
-
-            if getattr(pipeline, "is_async", False):
-                # If the pipeline is async, run it asynchronously
-                preds = await pipeline(pipe_inputs)
-            else:
-                # Otherwise, run it synchronously
-                preds = pipeline(pipe_inputs)
-
-            assert len(preds) == len(dataset)
-            if isinstance(preds[0], dict):
-                # If the pipeline returns a dictionary, extract the label
-                preds = [pred["label"] for pred in preds]
+            with maybe_profile(profile, category, name):
+                preds = await run_pipeline(pipeline, dataset["entry"], dataset["title"])
 
             end_time = time.time()
             time_taken = end_time - start_time
             print(f"Finished {name} in {time_taken:.2f} seconds.")
 
-            # Evaluate the pipeline
-            df = dataset.to_pandas()
-            assert isinstance(df, pd.DataFrame)  # to get better type hints
-            df["preds"] = preds
-            report_str = classification_report(dataset["label_str"], preds)
-            report = classification_report(dataset["label_str"], preds, output_dict=True)
-            accuracy = np.mean(df["preds"] == df["label_str"])
+            # Evaluate and save the results
+            results[category][name] = evaluate_predictions(
+                dataset, preds, str(pipeline), time_taken
+            )
 
-            # Print the results
-            print(report_str)
+    return results
 
-            # Save the results
-            results[category][name] = {
-                "pipeline": str(pipeline),
-                "report": report,
-                "report_str": report_str,
-                "accuracy": accuracy,
+
+async def run_comparison_concurrent(
+    pipeline_names: dict, dataset: Dataset, profile: bool = False
+) -> dict:
+    """Compare the models with I/O-bound and CPU-bound pipelines running at the same time
+
+    Every CPU-bound pipeline runs in its own worker process, pinned to a disjoint share of
+    the CPU cores (see `src.pipelines.parallel`). Meanwhile, the I/O-bound (OpenAI) pipelines
+    run one after another on this process's event loop; running them side by side would only
+    make them queue for the same rate limits. The time of each pipeline covers its inference
+    only, measured where it runs, so the comparison takes about as long as the slowest model.
+
+    Args:
+        pipeline_names (dict): Names of the pipelines to compare per category
+            (see `PIPELINE_NAMES`)
+        dataset (Dataset): The dataset to use for model evaluation
+        profile (bool, optional): Profile each pipeline's run, where it runs. Defaults to
+            False.
+
+    Returns:
+        dict: Same as `run_comparison`, with each worker's load time ("load_time"),
+            cores ("cores") and peak RSS ("peak_rss_mb") in the CPU-bound results
+    """
+    texts, titles = dataset["entry"], dataset["title"]
+    io_bound = [
+        (category, name)
+        for category, names in pipeline_names.items()
+        if category in IO_BOUND_CATEGORIES
+        for name in names
+    ]
+    cpu_bound = [
+        (category, name)
+        for category, names in pipeline_names.items()
+        if category not in IO_BOUND_CATEGORIES
+        for name in names
+    ]
+    core_sets = split_cores(len(cpu_bound)) if cpu_bound else []
+    executors = [pinned_executor(cores) for cores in core_sets]
+
+    async def run_io_bound() -> dict:
+        outputs = {}
+        for category, name in io_bound:
+            pipeline = get_pipeline(category, name)
+            print(f"Running {category} - {name}...")
+            start_time = time.perf_counter()
+            with maybe_profile(profile, category, name):
+                preds = await run_pipeline(pipeline, texts, titles)
+            time_taken = time.perf_counter() - start_time
+            print(f"Finished {name} in {time_taken:.2f} seconds.")
+            outputs[category, name] = {
+                "preds": preds,
                 "time": time_taken,
-                "df": df,
+                "pipeline": str(pipeline),
             }
+        return outputs
+
+    async def run_cpu_bound(category: str, name: str, executor, cores: list[int]) -> dict:
+        print(f"Running {category} - {name} on cores {cores}...")
+        output = await loop.run_in_executor(
+            executor, score_pipeline, category, name, texts, titles, profile
+        )
+        metrics.merge(output.pop("metrics"))
+        print(
+            f"Finished {name} in {output['time']:.2f} seconds "
+            f"(loaded in {output['load_time']:.2f} seconds)."
+        )
+        return output
+
+    loop = asyncio.get_running_loop()
+    try:
+        io_outputs, *cpu_outputs = await asyncio.gather(
+            run_io_bound(),
+            *[
+                run_cpu_bound(category, name, executor, cores)
+                for (category, name), executor, cores in zip(cpu_bound, executors, core_sets)
+            ],
+        )
+    finally:
+        for executor in executors:
+            executor.shutdown()
+    outputs = {**io_outputs, **dict(zip(cpu_bound, cpu_outputs))}
 
+    results = {}
+    for category, names in pipeline_names.items():
+        results[category] = {}
+        for name in names:
+            output = outputs[category, name]
+            print(f"Results for {category} - {name}:")
+            results[category][name] = {
+                **evaluate_predictions(
+                    dataset, output["preds"], output["pipeline"], output["time"]
+                ),
+                **{k: v for k, v in output.items() if k not in ("preds", "pipeline", "time")},
+            }
     return results
 
 
@@ -123,12 +245,15 @@ def save_readable_results_file(results: dict, now_str: str):
         f.write(f"See data/results/results_{now_str}.pkl for more details.\n")
 
 
-async def main(use_local_test_data: bool = False):
+async def main(use_local_test_data: bool = False, concurrent: bool = False, profile: bool = False):
     """Main function
 
     Args:
         use_local_test_data (bool, optional): Whether to use the test data for evaluation.
             Defaults to False.
+        concurrent (bool, optional): Whether to run the pipelines concurrently (see
+            `run_comparison_concurrent`). Defaults to False.
+        profile (bool, optional): Profile each pipeline's run. Defaults to False.
     """
 
     if use_local_test_data:
@@ -137,13 +262,23 @@ async def main(use_local_test_data: bool = False):
         # Grab the latest dataset from the database
         dataset = load_latest_test_dataset()
 
-    # Get the pipelines
-    print("Loading the pipelines...")
-    pipelines = get_all_pipelines()
-
-    # Run the comparison
-    print("Running the comparison...")
-    results = await run_comparison(pipelines, dataset)
+    start_time = time.perf_counter()
+    if concurrent:
+        # Each pipeline is loaded where it runs
+        print("Running the comparison concurrently...")
+        results = await run_comparison_concurrent(PIPELINE_NAMES, dataset, profile)
+    else:
+        # Get the pipelines
+        print("Loading the pipelines...")
+        pipelines = get_all_pipelines()
+
+        # Run the comparison
+        print("Running the comparison...")
+        results = await run_comparison(pipelines, dataset, profile)
+    print(f"Comparison took {time.perf_counter() - start_time:.2f} seconds in total.")
+    print("Time per pipeline stage:")
+    print_stage_table()
+    metrics.write(METRICS_DIR / "compare_all_models.prom")
 
     # Save the results
     print("Saving the results...")
@@ -159,5 +294,19 @@ async def main(use_local_test_data: bool = False):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--local-test-data", action="store_true", help="Evaluate on the local test split"
+    )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="Overlap the OpenAI pipelines with the local models, each in a pinned process",
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="Save cProfile/torch profiler traces per pipeline"
+    )
+    args = parser.parse_args()
+
     # Run the comparison
-    asyncio.run(main())
+    asyncio.run(main(args.local_test_data, args.concurrent, args.profile))
@@ -0,0 +1,235 @@
+"""Distills roberta_hartmann (optionally with SetFit) into a small, CPU-friendly student.
+
+The teachers soft-label the unlabelled feedback backlog (every row outside the annotated
+dataset, read from the local snapshot if there is one, else streamed from MySQL), and a 4-6
+layer student is trained on those soft labels. Teacher outputs are cached, so re-running with
+other student settings skips the teachers. The student is evaluated against the teacher on the
+annotated test split, timed on CPU (tokenization included), and registered as the
+`hf/roberta_hartmann_student` pipeline if it stays within `--max-accuracy-drop` of the teacher.
+
+Example:
+    python scripts/distill_roberta.py --layers 4 --setfit-weight 0.5
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from src.config import (
+    CACHE_DIR,
+    CUSTOM_MODELS_DIR,
+    DATA_DIR,
+    DATASET_PATH,
+    DISTILLED_MODEL_PATH,
+    RANDOM_SEED,
+)
+from src.data.make_dataset import iter_feedback_batches, load_dataset_from_file
+from src.pipelines.setfit.artifact import update_symlink
+from src.pipelines.setfit.loading import get_setfit_model_version
+from src.pipelines.text import text_hash
+from src.pipelines.transformers import TRANSFORMER_MODELS, load_transformer_pipeline
+from src.pipelines.transformers.distill import (
+    STUDENT_BASE_MODEL,
+    build_student,
+    mix_teachers,
+    predict_logits,
+    softmax,
+    train_student,
+)
+from src.pipelines.transformers.tokens import TokenCache
+
+TEACHER = dict(TRANSFORMER_MODELS)["roberta_hartmann"]
+TEACHER_CACHE_DIR = CACHE_DIR / "distill"
+
+
+def load_backlog(exclude_ids: set, max_rows: int, seed: int = RANDOM_SEED) -> list[str]:
+    """Texts of the feedback rows outside the annotated dataset
+
+    Args:
+        exclude_ids (set): Ids of the annotated rows
+        max_rows (int): Sample at most this many rows (0 for all)
+        seed (int, optional): Seed of the sample. Defaults to RANDOM_SEED.
+
+    Returns:
+        list[str]: Texts
+
+    Raises:
+        ValueError: If every feedback row is annotated
+    """
+    from src.data.snapshot import load_feedback_snapshot, snapshot_exists
+
+    if snapshot_exists():
+        table = load_feedback_snapshot().data
+        batches = table.select(["id", "entry"]).to_batches()
+    else:
+        batches = iter_feedback_batches(columns=["id", "entry"])
+    texts = []
+    for batch in batches:
+        columns = batch.to_pydict()
+        texts.extend(
+            entry
+            for id_, entry in zip(columns["id"], columns["entry"])
+            if entry and id_ not in exclude_ids
+        )
+    if not texts:
+        raise ValueError("No feedback outside the annotated dataset to distill on")
+    if max_rows and len(texts) > max_rows:
+        rng = np.random.default_rng(seed)
+        texts = [texts[i] for i in sorted(rng.choice(len(texts), max_rows, replace=False))]
+    return texts
+
+
+def cached_probabilities(teacher: str, texts: list[str], compute) -> np.ndarray:
+    """Class probabilities of a teacher on the texts, cached on disk"""
+    digest = hashlib.sha256(teacher.encode("utf-8"))
+    for text in texts:
+        digest.update(text_hash(text).encode("ascii"))
+    path = TEACHER_CACHE_DIR / f"{digest.hexdigest()[:16]}.npy"
+    if path.exists():
+        print(f"Using cached outputs of {teacher}")
+        return np.load(path)
+    print(f"Labelling {len(texts)} rows with {teacher}...")
+    probabilities = compute(texts)
+    os.makedirs(TEACHER_CACHE_DIR, exist_ok=True)
+    np.save(path, probabilities)
+    return probabilities
+
+
+def rows_per_second(pipeline, texts: list[str]) -> float:
+    """CPU throughput of a pipeline, tokenization included (no token cache)"""
+    cache = pipeline.token_cache
+    pipeline.token_cache = TokenCache(cache.tokenizer, cache.max_length, capacity=0)
+    start_time = time.perf_counter()
+    pipeline(texts)
+    return len(texts) / (time.perf_counter() - start_time)
+
+
+def accuracy(pipeline, texts: list[str], labels: list[str]) -> tuple[float, list[str]]:
+    preds = [pred["label"] for pred in pipeline(texts)]
+    return float(np.mean([p == l for p, l in zip(preds, labels)])), preds
+
+
+def main(args: argparse.Namespace) -> bool:
+    """Main function
+
+    Returns:
+        bool: Whether the student was registered
+    """
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    from src.config import DEVICE
+
+    annotated = load_dataset_from_file(DATASET_PATH)
+    exclude_ids = set(annotated["train"]["id"]) | set(annotated["test"]["id"])
+    texts = load_backlog(exclude_ids, args.max_rows)
+    print(f"Distilling on {len(texts)} unannotated rows")
+
+    def teacher_probabilities(texts: list[str]) -> np.ndarray:
+        model = AutoModelForSequenceClassification.from_pretrained(TEACHER).to(DEVICE)
+        return softmax(predict_logits(model, AutoTokenizer.from_pretrained(TEACHER), texts))
+
+    def setfit_probabilities(texts: list[str]) -> np.ndarray:
+        from src.pipelines import get_pipeline
+
+        return get_pipeline("setfit", "setfit").predict_proba(texts)
+
+    teachers = [cached_probabilities(TEACHER, texts, teacher_probabilities)]
+    weights = [1.0]
+    if args.setfit_weight > 0:
+        setfit_teacher = f"setfit@{get_setfit_model_version()}"  # retrained models miss the cache
+        teachers.append(cached_probabilities(setfit_teacher, texts, setfit_probabilities))
+        weights.append(args.setfit_weight)
+    soft_labels = mix_teachers(teachers, weights, args.temperature)
+
+    tokenizer = AutoTokenizer.from_pretrained(STUDENT_BASE_MODEL)
+    student = build_student(num_layers=args.layers)
+    start_time = time.perf_counter()
+    train_student(
+        student,
+        tokenizer,
+        texts,
+        soft_labels,
+        temperature=args.temperature,
+        num_epochs=args.epochs,
+        batch_size=args.batch_size,
+        learning_rate=args.learning_rate,
+        on_epoch_end=lambda epoch, loss: print(f"Epoch {epoch + 1}: distillation loss {loss:.4f}"),
+    )
+    train_time = time.perf_counter() - start_time
+
+    now = datetime.datetime.now().strftime("%Y-%m-%d_%H%M%S")
+    student_dir = CUSTOM_MODELS_DIR / f"roberta_hartmann_student_{now}"
+    student.save_pretrained(student_dir)
+    tokenizer.save_pretrained(student_dir)
+
+    # Compare both models on CPU, where the student is meant to run
+    test_texts, test_labels = list(annotated["test"]["entry"]), list(annotated["test"]["label_str"])
+    teacher_pipeline = load_transformer_pipeline(TEACHER, device=-1)
+    student_pipeline = load_transformer_pipeline(str(student_dir), device=-1)
+    teacher_accuracy, teacher_preds = accuracy(teacher_pipeline, test_texts, test_labels)
+    student_accuracy, student_preds = accuracy(student_pipeline, test_texts, test_labels)
+    teacher_speed = rows_per_second(teacher_pipeline, test_texts)
+    student_speed = rows_per_second(student_pipeline, test_texts)
+    report = {
+        "teacher": TEACHER,
+        "setfit_weight": args.setfit_weight,
+        "student_base": STUDENT_BASE_MODEL,
+        "student_layers": student.config.num_hidden_layers,
+        "temperature": args.temperature,
+        "epochs": args.epochs,
+        "backlog_rows": len(texts),
+        "train_seconds": train_time,
+        "test_rows": len(test_texts),
+        "teacher_accuracy": teacher_accuracy,
+        "student_accuracy": student_accuracy,
+        "agreement": float(np.mean([t == s for t, s in zip(teacher_preds, student_preds)])),
+        "teacher_rows_per_second_cpu": teacher_speed,
+        "student_rows_per_second_cpu": student_speed,
+        "speedup": student_speed / teacher_speed,
+    }
+    registered = student_accuracy >= teacher_accuracy - args.max_accuracy_drop
+    report["registered"] = registered
+    with open(student_dir / "distillation.json", "w") as f:
+        json.dump(report, f, indent=2)
+    results_dir = os.path.join(DATA_DIR, "results")  # type: ignore
+    os.makedirs(results_dir, exist_ok=True)
+    with open(os.path.join(results_dir, f"distill_{now}.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Accuracy: teacher {teacher_accuracy:.2%}, student {student_accuracy:.2%}")
+    print(f"Agreement with the teacher: {report['agreement']:.2%}")
+    print(
+        f"CPU throughput: teacher {teacher_speed:.1f} rows/s, student {student_speed:.1f} rows/s "
+        f"({report['speedup']:.1f}x)"
+    )
+    if not registered:
+        print(f"Not registering {student_dir}: accuracy drop above {args.max_accuracy_drop:.0%}")
+        return False
+    update_symlink(DISTILLED_MODEL_PATH, student_dir)
+    print(f"Registered {student_dir} as hf/roberta_hartmann_student")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--layers", type=int, default=6, choices=range(4, 7), help="Student depth")
+    parser.add_argument(
+        "--setfit-weight", type=float, default=0.0, help="Weight of SetFit as a second teacher"
+    )
+    parser.add_argument("--max-rows", type=int, default=50_000, help="Backlog rows (0 for all)")
+    parser.add_argument("--temperature", type=float, default=2.0)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--learning-rate", type=float, default=5e-5)
+    parser.add_argument(
+        "--max-accuracy-drop",
+        type=float,
+        default=0.05,
+        help="Largest accuracy drop against the teacher for the student to be registered",
+    )
+    main(parser.parse_args())
@@ -0,0 +1,38 @@
+"""Exports the ONNX pipelines and checks their accuracy against the fp32 PyTorch pipelines."""
+
+import sys
+
+from src.config import DATASET_PATH
+from src.data.make_dataset import load_dataset_from_file
+from src.pipelines import get_setfit_pipeline, get_transformer_pipelines
+from src.pipelines.onnx import check_parity, get_onnx_pipelines
+
+MIN_AGREEMENT = 0.95  # fraction of predictions which must match the fp32 pipeline
+
+
+def main() -> bool:
+    """Main function
+
+    Returns:
+        bool: Whether every ONNX pipeline reached `MIN_AGREEMENT`
+    """
+    dataset = load_dataset_from_file(DATASET_PATH)["test"]
+    onnx_pipelines = get_onnx_pipelines()  # exports any missing or outdated models
+    reference_pipelines = {**get_transformer_pipelines(), **get_setfit_pipeline()}
+
+    passed = True
+    for name, pipeline in onnx_pipelines.items():
+        report = check_parity(
+            reference_pipelines[name], pipeline, dataset["entry"], dataset["label_str"]
+        )
+        print(
+            f"{name}: agreement {report['agreement']:.2%}, "
+            f"accuracy fp32 {report['reference_accuracy']:.2f} "
+            f"vs int8 {report['candidate_accuracy']:.2f}"
+        )
+        passed = passed and report["agreement"] >= MIN_AGREEMENT
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,76 @@
+"""Converts the trained SetFit model (pickle, saved model or Hub) into a memory-mapped artifact.
+
+Checks that the artifact predicts like the original model, and compares their load times.
+
+Example:
+    python scripts/export_setfit_artifact.py
+"""
+
+import datetime
+import sys
+import time
+
+import numpy as np
+
+from src.config import CUSTOM_MODELS_DIR, DATASET_PATH, SETFIT_ARTIFACT_PATH
+from src.data.make_dataset import load_dataset_from_file
+from src.pipelines.setfit.artifact import (
+    load_setfit_artifact,
+    save_setfit_artifact,
+    update_symlink,
+)
+from src.pipelines.setfit.loading import load_full_setfit_model
+
+MIN_AGREEMENT = 0.99  # fraction of predictions which must match the original model
+
+
+def main() -> bool:
+    """Main function
+
+    Returns:
+        bool: Whether the artifact reached `MIN_AGREEMENT`
+    """
+    import setfit  # noqa: F401, import the frameworks first so that only loading is timed
+
+    start_time = time.perf_counter()
+    model = load_full_setfit_model()
+    full_load_time = time.perf_counter() - start_time
+
+    now = datetime.datetime.now().strftime("%Y-%m-%d")
+    artifact_dir = save_setfit_artifact(
+        model, CUSTOM_MODELS_DIR / f"setfit_artifact_{now}", name=f"setfit_{now}"
+    )
+
+    start_time = time.perf_counter()
+    mapped_model = load_setfit_artifact(artifact_dir, verify=True)
+    verified_load_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    mapped_model = load_setfit_artifact(artifact_dir)
+    mapped_load_time = time.perf_counter() - start_time
+    print(f"Saved {mapped_model.version} to {artifact_dir}")
+    print(
+        f"Load time: {full_load_time:.2f}s for the original model, {mapped_load_time:.2f}s for "
+        f"the artifact ({verified_load_time:.2f}s with hash verification)"
+    )
+
+    texts = load_dataset_from_file(DATASET_PATH)["test"]["entry"]
+    original = model.model_body.encode(
+        texts, normalize_embeddings=getattr(model, "normalize_embeddings", False)
+    )
+    mapped = mapped_model.model_body.encode(texts)
+    agreement = np.mean(
+        model.model_head.predict(original) == mapped_model.model_head.predict(mapped)
+    )
+    print(
+        f"Agreement {agreement:.2%}, max embedding difference {np.abs(original - mapped).max():.2e}"
+    )
+    if agreement < MIN_AGREEMENT:
+        print(f"Not linking {SETFIT_ARTIFACT_PATH}: agreement below {MIN_AGREEMENT:.0%}")
+        return False
+    update_symlink(SETFIT_ARTIFACT_PATH, artifact_dir)
+    print(f"Linked {SETFIT_ARTIFACT_PATH} to {artifact_dir}")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,82 @@
+"""Local stand-in for the OpenAI completions API, for exercising the OpenAI pipelines offline.
+
+Answers with random sentiments after a fixed latency, and rejects a fraction of requests
+with 429 errors to exercise the scheduler's backoff.
+
+Example:
+    python scripts/fake_openai_server.py --latency-ms 200 --error-rate 0.1
+    export OPENAI_API_BASE=http://127.0.0.1:8081/v1 OPENAI_API_KEY=fake
+    python scripts/compare_all_models.py
+"""
+
+import argparse
+import asyncio
+import random
+import re
+import time
+
+from aiohttp import web
+
+SENTIMENTS = ["positive", "neutral", "negative"]
+
+
+def fake_completion(prompt: str) -> str:
+    """A plausible completion: one label, or a numbered list for the batched prompts"""
+    n_reviews = len(re.findall(r"^Review #\d+", prompt, re.MULTILINE))
+    if prompt.rstrip().endswith("6:") and n_reviews > 6:
+        labels = [random.choice(SENTIMENTS) for _ in range(n_reviews - 5)]
+        return f" {labels[0]}" + "".join(f"\n{i}: {label}" for i, label in enumerate(labels[1:], 7))
+    return f" {random.choice(SENTIMENTS)}"
+
+
+async def completions(request: web.Request) -> web.Response:
+    config = request.app["config"]
+    request.app["stats"]["requests"] += 1
+    await asyncio.sleep(config.latency_ms / 1000)
+    if random.random() < config.error_rate:
+        request.app["stats"]["rate_limited"] += 1
+        return web.json_response(
+            {"error": {"message": "Rate limit reached", "type": "requests"}}, status=429
+        )
+
+    body = await request.json()
+    prompts = body["prompt"] if isinstance(body["prompt"], list) else [body["prompt"]]
+    choices = [
+        {"text": fake_completion(prompt), "index": i, "logprobs": None, "finish_reason": "stop"}
+        for i, prompt in enumerate(prompts)
+    ]
+    prompt_tokens = sum(len(prompt.split()) for prompt in prompts)
+    return web.json_response(
+        {
+            "id": f"cmpl-fake-{request.app['stats']['requests']}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": choices,
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(choices),
+                "total_tokens": prompt_tokens + len(choices),
+            },
+        }
+    )
+
+
+async def stats(request: web.Request) -> web.Response:
+    return web.json_response(request.app["stats"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of 429s")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    app = web.Application()
+    app["config"] = args
+    app["stats"] = {"requests": 0, "rate_limited": 0}
+    app.router.add_post("/v1/completions", completions)
+    app.router.add_post("/v1/engines/{engine}/completions", completions)
+    app.router.add_get("/stats", stats)
+    web.run_app(app, host="127.0.0.1", port=args.port)
@@ -1,10 +1,39 @@
-"""Hyperparameter search to find the best SetFit training parameters"""
+"""Hyperparameter search to find the best SetFit training parameters
 
+The study lives in a local SQLite database, so an interrupted search resumes where it stopped
+when started again with the same study name, and the trials of a crashed worker are retried.
+Trials run in parallel worker processes, each pinned to its own CPU cores, until the study
+holds `--trials` finished (complete or pruned) trials. After every epoch a trial fits the
+head and reports its eval accuracy, and trials falling behind the median of earlier trials
+are pruned. Each worker loads the dataset and every base model once. The contrastive pairs
+of a (num_iterations, seed) setting and their token ids come from the on-disk pair cache, so
+they are generated once for the whole search and trials only spend time on gradient steps.
+With `--stratified`, every trial trains on class-balanced pairs. Optuna comes with the optional
+hpsearch group: `poetry install --with hpsearch`.
 
-from setfit import SetFitModel, SetFitTrainer
+Example:
+    python scripts/hpsearch_setfit.py --workers 4 --trials 100
+    python scripts/hpsearch_setfit.py --stratified --study setfit_stratified
+"""
 
-from src.config import DATASET_PATH
+import argparse
+import copy
+import functools
+import json
+import os
+
+import numpy as np
+import optuna
+from setfit import SetFitModel
+
+from src.config import DATA_DIR, DATASET_PATH, RANDOM_SEED
 from src.data.make_dataset import load_dataset_from_file
+from src.pipelines.parallel import available_cores, pinned_executor, split_cores
+from src.pipelines.setfit.pairs import PairSet, get_pair_set
+from src.pipelines.setfit.training import train_body
+
+HPSEARCH_DIR = DATA_DIR / "hpsearch"
+STUDY_NAME = "setfit"
 
 
 def get_model_params(params):
@@ -55,6 +84,33 @@ def get_hp_space(trial) -> dict:
     }
 
 
+@functools.lru_cache(maxsize=None)
+def get_dataset() -> dict:
+    """The search dataset, loaded once per worker"""
+    dataset = load_dataset_from_file(DATASET_PATH)
+    return {
+        split: (list(dataset[split]["entry"]), np.array(dataset[split]["label"]))
+        for split in ("train", "test")
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def load_base_model(model_id: str) -> SetFitModel:
+    """A base model, loaded once per worker (trials train copies of it)"""
+    return SetFitModel.from_pretrained(model_id)
+
+
+def get_train_pairs(
+    model_id: str, num_iterations: int, seed: int, stratified: bool = False
+) -> PairSet:
+    """Contrastive pairs of the train split, shared through the pair cache by all workers"""
+    texts, labels = get_dataset()["train"]
+    body = load_base_model(model_id).model_body
+    return get_pair_set(
+        texts, labels, body.tokenizer, body.max_seq_length, num_iterations, seed, stratified
+    )
+
+
 def create_model(params) -> SetFitModel:
     """Create a SetFit model using the given parameters.
 
@@ -64,29 +120,138 @@ def create_model(params) -> SetFitModel:
     Returns:
         SetFitModel: A SetFit model created from the given parameters.
     """
+    from sklearn.linear_model import LogisticRegression
+
     model_id, model_params = get_model_params(params)
-    return SetFitModel.from_pretrained(model_id, **model_params)
+    base_model = load_base_model(model_id)
+    return SetFitModel(
+        model_body=copy.deepcopy(base_model.model_body),
+        model_head=LogisticRegression(**model_params["head_params"]),
+    )
 
 
-def run_hyperparameter_search():
-    """Run the hyperparameter search.
+def objective(trial: optuna.Trial, stratified: bool = False) -> float:
+    """Train a SetFit model with the trial's parameters and return its eval accuracy"""
+    from transformers import set_seed
 
-    Returns:
-        Trial: An object representing the best run of the hyperparameter search.
-    """
-    dataset = load_dataset_from_file(DATASET_PATH)
-    trainer = SetFitTrainer(
-        train_dataset=dataset["train"],
-        eval_dataset=dataset["test"],
-        model_init=create_model,  # type: ignore
-        column_mapping={"entry": "text", "label": "label"},
+    params = get_hp_space(trial)
+    set_seed(params["seed"])
+    model = create_model(params)
+    (train_texts, train_labels), (eval_texts, eval_labels) = get_dataset().values()
+    scores = []
+
+    def evaluate(epoch: int) -> None:
+        """Fits the head after each epoch, reports its eval accuracy and prunes bad trials"""
+        model.model_head.fit(model.model_body.encode(train_texts), train_labels)
+        predictions = model.model_head.predict(model.model_body.encode(eval_texts))
+        scores.append(float(np.mean(predictions == eval_labels)))
+        trial.report(scores[-1], step=epoch)
+        if trial.should_prune():
+            raise optuna.TrialPruned()
+
+    model_id, _ = get_model_params(params)
+    train_body(
+        model.model_body,
+        get_train_pairs(model_id, params["num_iterations"], params["seed"], stratified),
+        num_epochs=params["num_epochs"],
+        batch_size=params["batch_size"],
+        learning_rate=params["learning_rate"],
+        seed=params["seed"],
+        on_epoch_end=evaluate,
     )
-    best_run = trainer.hyperparameter_search(
-        direction="maximize", hp_space=get_hp_space, n_trials=100
+    return scores[-1]
+
+
+def load_study(study_name: str, storage: str, seed: int = RANDOM_SEED) -> optuna.Study:
+    """Create the study, or load it to resume an earlier search"""
+    return optuna.create_study(
+        study_name=study_name,
+        storage=optuna.storages.RDBStorage(
+            storage,
+            engine_kwargs={"connect_args": {"timeout": 60}},
+            # trials of crashed workers stop sending heartbeats, and are marked failed and retried
+            heartbeat_interval=60,
+            grace_period=180,
+            failed_trial_callback=optuna.storages.RetryFailedTrialCallback(max_retry=1),
+        ),
+        load_if_exists=True,
+        direction="maximize",
+        sampler=optuna.samplers.TPESampler(seed=seed),
+        pruner=optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=1),
     )
 
-    return best_run
+
+def run_worker(
+    study_name: str, storage: str, n_trials: int, worker: int, stratified: bool = False
+) -> None:
+    """Run trials until the study holds `n_trials` finished trials (body of a worker)"""
+    # a seed per worker, or all workers would sample the same parameters
+    study = load_study(study_name, storage, seed=RANDOM_SEED + worker)
+    study.optimize(
+        functools.partial(objective, stratified=stratified),
+        n_trials=n_trials,
+        callbacks=[
+            optuna.study.MaxTrialsCallback(
+                n_trials, states=(optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+            )
+        ],
+        gc_after_trial=True,
+    )
+
+
+def run_hyperparameter_search(
+    n_trials: int = 100, n_workers: int = 1, study_name: str = STUDY_NAME, stratified: bool = False
+) -> optuna.trial.FrozenTrial:
+    """Run (or resume) the hyperparameter search.
+
+    Args:
+        n_trials (int, optional): Finished trials to reach, counting earlier runs.
+            Defaults to 100.
+        n_workers (int, optional): Parallel worker processes. Defaults to 1.
+        study_name (str, optional): Name of the study in the database. Defaults to "setfit".
+        stratified (bool, optional): Train on class-balanced pairs (see `generate_pairs`).
+            Defaults to False.
+
+    Returns:
+        FrozenTrial: An object representing the best run of the hyperparameter search.
+    """
+    os.makedirs(HPSEARCH_DIR, exist_ok=True)
+    storage = f"sqlite:///{HPSEARCH_DIR / 'studies.db'}"
+    study = load_study(study_name, storage)  # create the tables before the workers start
+    print(f"Study {study_name}: {len(study.trials)} trials so far, running up to {n_trials}")
+
+    if n_workers > len(available_cores()):
+        n_workers = len(available_cores())  # workers sharing a core only slow each other down
+        print(f"Using {n_workers} workers, one per core")
+    executors = [pinned_executor(cores) for cores in split_cores(n_workers)]
+    try:
+        futures = [
+            executor.submit(run_worker, study_name, storage, n_trials, worker, stratified)
+            for worker, executor in enumerate(executors)
+        ]
+        for future in futures:
+            future.result()
+    finally:
+        for executor in executors:
+            executor.shutdown()
+
+    study = load_study(study_name, storage)
+    with open(HPSEARCH_DIR / f"{study_name}_best_params.json", "w") as f:
+        json.dump({"value": study.best_value, "params": study.best_params}, f, indent=2)
+    return study.best_trial
 
 
 if __name__ == "__main__":
-    best_run = run_hyperparameter_search()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=100, help="Finished trials to reach")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel worker processes")
+    parser.add_argument("--study", default=STUDY_NAME, help="Study name, to resume or start anew")
+    parser.add_argument(
+        "--stratified",
+        action="store_true",
+        help="Sample the same number of contrastive pairs for every class",
+    )
+    args = parser.parse_args()
+
+    best_run = run_hyperparameter_search(args.trials, args.workers, args.study, args.stratified)
+    print(f"Best accuracy {best_run.value:.4f} with {best_run.params}")
@@ -0,0 +1,128 @@
+"""Measures the cold-start time of the package and the CLIs in fresh interpreters.
+
+Each target runs several times in a new Python process. The script reports the median and
+minimum wall time, the heavy frameworks the target imported, and, with `--imports`, the
+slowest imports from `python -X importtime`. With `--check`, it fails if importing
+`src.config` or `src.pipelines` pulls in a heavy framework, which would make every
+short-lived worker and cron job pay for it.
+
+Example:
+    python scripts/measure_cold_start.py --runs 5 --imports
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from src.config import PARENT_DIR
+
+HEAVY_MODULES = [
+    "torch",
+    "transformers",
+    "sentence_transformers",
+    "setfit",
+    "langchain",
+    "openai",
+    "tiktoken",
+    "onnxruntime",
+    "datasets",
+    "sklearn",
+]
+
+# (name, Python code) run in a fresh interpreter
+TARGETS = [
+    ("import src.config", "import src.config"),
+    ("import src.pipelines", "import src.pipelines"),
+    ("import src.data.make_dataset", "import src.data.make_dataset"),
+    (
+        "score_incremental.py --help",
+        "import runpy, sys; sys.argv = ['score_incremental.py', '--help']\n"
+        "try: runpy.run_path('scripts/score_incremental.py', run_name='__main__')\n"
+        "except SystemExit: pass",
+    ),
+    (
+        "load setfit/setfit",
+        "from src.pipelines import get_pipeline; get_pipeline('setfit', 'setfit')",
+    ),
+]
+LIGHT_TARGETS = ["import src.config", "import src.pipelines"]
+
+REPORT_HEAVY_MODULES = (
+    "\nimport json, sys\n"
+    f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]), file=sys.stderr)"
+)
+
+
+def run_target(code: str, importtime: bool = False) -> tuple[float, str]:
+    """Run code in a fresh interpreter
+
+    Returns:
+        tuple[float, str]: Wall time in seconds and the process's stderr
+    """
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    start_time = time.perf_counter()
+    process = subprocess.run(command, cwd=PARENT_DIR, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start_time
+    if process.returncode != 0:
+        raise RuntimeError(f"{code!r} failed:\n{process.stderr}")
+    return elapsed, process.stderr
+
+
+def slowest_imports(importtime_log: str, n: int) -> list[tuple[str, float]]:
+    """Parse `-X importtime` output into the n imports with the largest cumulative time
+
+    Returns:
+        list[tuple[str, float]]: (module, cumulative seconds)
+    """
+    imports = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:") :].split("|")
+        imports.append((module.rstrip(), int(cumulative) / 1e6))
+    return sorted(imports, key=lambda x: x[1], reverse=True)[:n]
+
+
+def main(args: argparse.Namespace) -> bool:
+    """Main function
+
+    Returns:
+        bool: Whether the light targets import no heavy framework (always True without
+            `--check`)
+    """
+    ok = True
+    for name, code in TARGETS:
+        if args.target and name not in args.target:
+            continue
+        times = []
+        for _ in range(args.runs):
+            elapsed, stderr = run_target(code + REPORT_HEAVY_MODULES)
+            times.append(elapsed)
+        heavy = json.loads(stderr.strip().splitlines()[-1])
+        print(
+            f"{name:>30}: median {statistics.median(times):6.2f}s, min {min(times):6.2f}s, "
+            f"heavy imports: {', '.join(heavy) or '-'}"
+        )
+        if args.check and name in LIGHT_TARGETS and heavy:
+            print(f"  FAIL: {name} should not import {', '.join(heavy)}")
+            ok = False
+        if args.imports:
+            _, log = run_target(code, importtime=True)
+            for module, seconds in slowest_imports(log, args.imports):
+                print(f"{'':>32}{seconds:6.2f}s {module.strip()}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters per target")
+    parser.add_argument("--target", action="append", help="Only measure this target (repeatable)")
+    parser.add_argument(
+        "--imports", type=int, nargs="?", const=10, default=0, help="Show the N slowest imports"
+    )
+    parser.add_argument("--check", action="store_true", help="Fail on heavy imports at startup")
+    args = parser.parse_args()
+    sys.exit(0 if main(args) else 1)
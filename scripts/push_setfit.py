@@ -1,18 +1,18 @@
 """Push trained SetFit model to the HuggingFace Hub."""
 
 import os
-import pickle
 
-from src.config import SETFIT_MODEL_PATH
+from src.config import SETFIT_FULL_MODEL_PATH, SETFIT_MODEL_PATH
+from src.pipelines.setfit.loading import load_full_setfit_model
 
 
 def push_model_to_hub():
     """Push trained SetFit model to the HuggingFace Hub."""
 
-    if not os.path.exists(SETFIT_MODEL_PATH):
+    if not os.path.exists(SETFIT_FULL_MODEL_PATH) and not os.path.exists(SETFIT_MODEL_PATH):
         raise FileNotFoundError("Model not found. Please train the model first.")
 
-    model = pickle.load(open(SETFIT_MODEL_PATH, "rb"))
+    model = load_full_setfit_model()
 
     # Push the model to the HuggingFace Hub
     # change model_path to str
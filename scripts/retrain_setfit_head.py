@@ -0,0 +1,160 @@
+"""Refits only the SetFit head on new annotations, keeping the current sentence-transformer body.
+
+Old and new labelled rows are encoded once through the SetFit pipeline, so embeddings cached
+by earlier runs (or by inference) are reused. The new head is saved as a new artifact which
+shares the body files of the current one. It is promoted (linked as the current artifact)
+unless it does worse on the held-out rows. Every run appends a drift report to
+`SETFIT_DRIFT_LOG`, saying whether a full contrastive retrain (`scripts/train_setfit.py`) is
+warranted.
+
+Example:
+    python scripts/retrain_setfit_head.py
+    python scripts/retrain_setfit_head.py --new-data data/raw/new_annotations.csv --fail-on-drift
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.config import (
+    CUSTOM_MODELS_DIR,
+    DATASET_PATH,
+    SETFIT_ARTIFACT_PATH,
+    SETFIT_DRIFT_LOG,
+)
+from src.data.make_dataset import (
+    add_label_column,
+    iter_feedback_batches,
+    load_dataset_from_file,
+    split_dataset,
+)
+from src.pipelines.setfit import get_setfit_pipeline
+from src.pipelines.setfit.artifact import MappedSetFitModel, save_head_artifact, update_symlink
+from src.pipelines.setfit.retrain import drift_report, fit_head
+
+
+def load_new_rows(path: str, known_ids: set) -> pd.DataFrame:
+    """Load the new labelled rows, from a CSV file or from MySQL
+
+    From MySQL, only the rows after the last annotated id are streamed (see
+    `iter_feedback_batches`), with just the columns the head needs.
+
+    Args:
+        path (str): CSV file with "entry" and "sentiment" columns, or None for MySQL
+        known_ids (set): Ids of the rows already in the annotated dataset
+
+    Returns:
+        pd.DataFrame: Labelled rows which are not in the annotated dataset
+    """
+    if path:
+        df = pd.read_csv(path)
+    else:
+        rows: dict[str, list] = {"id": [], "entry": [], "sentiment": []}
+        last_known_id = int(max(known_ids)) if known_ids else None
+        for batch in iter_feedback_batches(columns=list(rows), start_after_id=last_known_id):
+            columns = batch.to_pydict()
+            for id_, entry, sentiment in zip(*(columns[column] for column in rows)):
+                if entry and sentiment is not None:
+                    rows["id"].append(id_)
+                    rows["entry"].append(entry)
+                    rows["sentiment"].append(sentiment)
+        df = pd.DataFrame(rows)
+    add_label_column(df)
+    if "id" in df.columns:
+        df = df[~df["id"].isin(known_ids)]
+    return df.dropna(subset=["entry", "label"])
+
+
+def main(args: argparse.Namespace) -> int:
+    """Main function
+
+    Returns:
+        int: Exit code, 2 if `--fail-on-drift` and a full retrain is recommended
+    """
+    if not os.path.exists(SETFIT_ARTIFACT_PATH):
+        print("No SetFit artifact found, run `python scripts/export_setfit_artifact.py` first")
+        return 1
+    pipeline = get_setfit_pipeline()["setfit"]
+    model = pipeline.model
+    assert isinstance(model, MappedSetFitModel)
+
+    dataset = load_dataset_from_file(DATASET_PATH)
+    old_train, old_test = dataset["train"].to_pandas(), dataset["test"].to_pandas()
+    new_rows = load_new_rows(args.new_data, set(old_train["id"]) | set(old_test["id"]))
+    if len(new_rows) < args.min_rows:
+        print(f"Only {len(new_rows)} new labelled rows, need at least {args.min_rows}")
+        return 1
+    new_train, new_holdout = split_dataset(new_rows)
+    print(f"Retraining the head with {len(new_train)} new rows ({len(new_holdout)} held out)")
+
+    start_time = time.perf_counter()
+    splits = {}
+    for split, df in [
+        ("old_train", old_train),
+        ("old_test", old_test),
+        ("new_train", new_train),
+        ("new_holdout", new_holdout),
+    ]:
+        splits[split] = (pipeline.encode(df["entry"].tolist()), df["label"].to_numpy(dtype=int))
+    encode_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    head = fit_head(
+        np.concatenate([splits["old_train"][0], splits["new_train"][0]]),
+        np.concatenate([splits["old_train"][1], splits["new_train"][1]]),
+    )
+    fit_time = time.perf_counter() - start_time
+
+    report = drift_report(model.model_head, head, **splits)
+    report["encode_seconds"], report["fit_seconds"] = encode_time, fit_time
+    if pipeline.cache is not None:
+        report["embedding_cache"] = pipeline.cache.stats()
+
+    now = datetime.datetime.now()
+    artifact_dir = save_head_artifact(
+        SETFIT_ARTIFACT_PATH,
+        head,
+        CUSTOM_MODELS_DIR / f"setfit_artifact_{now:%Y-%m-%d_%H%M%S}",
+        name=f"setfit_head_{now:%Y-%m-%d}",
+        extra={"retrain": report},
+    )
+    promoted = report["promote"] and not args.dry_run
+    if promoted:
+        update_symlink(SETFIT_ARTIFACT_PATH, artifact_dir)
+    with open(SETFIT_DRIFT_LOG, "a") as f:
+        entry = {"date": now.isoformat(timespec="seconds"), "parent": model.version}
+        f.write(
+            json.dumps({**entry, "artifact": str(artifact_dir), "promoted": promoted, **report})
+        )
+        f.write("\n")
+
+    before, after = report["accuracy_before"], report["accuracy_after"]
+    print(f"Encoded in {encode_time:.1f}s, fitted the head in {fit_time:.2f}s")
+    for split in ("old_test", "new_holdout"):
+        if before[split] is not None:
+            print(f"Accuracy on {split}: {before[split]:.2%} -> {after[split]:.2%}")
+    print(f"Centroid shift {report['centroid_shift']:.3f}, label shift {report['label_shift']:.3f}")
+    print(f"{'Promoted' if promoted else 'Saved (not promoted)'} {artifact_dir}")
+    if report["full_retrain_recommended"]:
+        print("Full retrain recommended (`python scripts/train_setfit.py`):")
+        for reason in report["reasons"]:
+            print(f"  - {reason}")
+        return 2 if args.fail_on_drift else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--new-data", help="CSV of new annotations (default: labelled MySQL rows)")
+    parser.add_argument("--min-rows", type=int, default=10, help="Minimum new labelled rows")
+    parser.add_argument("--dry-run", action="store_true", help="Save the artifact, don't link it")
+    parser.add_argument(
+        "--fail-on-drift", action="store_true", help="Exit with 2 if a full retrain is recommended"
+    )
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,324 @@
+"""Scores a whole corpus with one pipeline, sharded across pinned worker processes.
+
+The input is split into shards: MySQL id ranges holding about the same number of rows
+(`--source mysql`), or the partitions of the local feedback snapshot (`--source snapshot`).
+Each worker process is pinned to its own cores (see `src.pipelines.parallel`), loads the
+pipeline once, tunes its torch thread count on its first batch, then claims shards until none
+is left. Every batch is committed together with its shard's checkpoint (see `src.data.jobs`),
+so re-running a killed job resumes where it stopped. Predictions are kept in the job store
+and, with `--write-back`, also upserted into MySQL before the checkpoint moves. The workers'
+stage timers and counters (thread tuning left out) are merged into `METRICS_DIR/score.prom`;
+`--profile` saves a trace of the first batches of every worker to `PROFILES_DIR`.
+
+Example:
+    python scripts/score.py setfit/setfit --workers 4
+    python scripts/score.py hf/roberta_hartmann --source snapshot --workers 8 --write-back
+"""
+
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import resource
+import time
+from typing import Iterator, Optional
+
+import pyarrow as pa
+
+from src.config import DATA_DIR, METRICS_DIR, MYSQL_CHUNK_SIZE
+from src.data.jobs import ScoringJobStore
+from src.data.make_dataset import get_id_ranges, iter_feedback_batches
+from src.data.sink import PredictionSink
+from src.data.snapshot import iter_partition_batches, read_manifest, snapshot_exists
+from src.metrics import metrics, print_stage_table, profile
+from src.pipelines import IO_BOUND_CATEGORIES, PIPELINE_NAMES
+from src.pipelines.parallel import (
+    available_cores,
+    pinned_executor,
+    split_cores,
+    tune_candidates,
+    tune_num_threads,
+)
+
+SOURCES = ["mysql", "snapshot"]
+COLUMNS = ["id", "title", "entry"]
+TUNE_REPEATS = 2
+TUNE_MAX_ROWS = 256  # rows per timed call when tuning threads
+PROFILE_BATCHES = 5  # batches profiled per worker with `--profile`
+
+
+def make_shards(source: str, n_shards: int) -> list[dict]:
+    """Shard specifications of the input, in the order workers should claim them
+
+    Snapshot partitions come largest first, so that the smallest ones fill in at the end
+    rather than leave one worker finishing a large partition alone.
+    """
+    if source == "snapshot":
+        if not snapshot_exists():
+            raise FileNotFoundError("No feedback snapshot, run `scripts/snapshot_feedback.py`")
+        partitions = read_manifest()["partitions"]
+        return [
+            {"partition": key, "rows": partitions[key]["rows"]}
+            for key in sorted(partitions, key=lambda key: -partitions[key]["rows"])
+        ]
+    return [
+        {"start_after_id": start_after_id, "end_id": end_id}
+        for start_after_id, end_id in get_id_ranges(n_shards)
+    ]
+
+
+def iter_shard_batches(
+    spec: dict, last_id: Optional[int], chunk_size: int
+) -> Iterator[pa.RecordBatch]:
+    """Stream the rows of a shard after its checkpoint"""
+    if "partition" in spec:
+        return iter_partition_batches(spec["partition"], COLUMNS, chunk_size, last_id)
+    return iter_feedback_batches(
+        columns=COLUMNS,
+        chunk_size=chunk_size,
+        start_after_id=spec["start_after_id"] if last_id is None else last_id,
+        end_id=spec["end_id"],
+    )
+
+
+def tune_threads(pipeline, texts: list[str], titles: list[str], max_threads: int) -> int:
+    """Tune the worker's torch thread count on slices of its first batch"""
+    from src.pipelines import run_pipeline
+
+    n_calls = 1 + TUNE_REPEATS * len(tune_candidates(max_threads))
+    size = min(len(texts) // n_calls, TUNE_MAX_ROWS)
+    if size == 0:
+        return max_threads  # too little to time, keep one thread per core
+
+    def run(call: int) -> None:
+        part = slice(call * size, (call + 1) * size)
+        asyncio.run(run_pipeline(pipeline, texts[part], titles[part]))
+
+    return tune_num_threads(run, max_threads, TUNE_REPEATS)
+
+
+def get_sink(write_back: str) -> PredictionSink:
+    """The sink of `--write-back` ("mysql") or `--write-back-sqlite` (a path)"""
+    return PredictionSink() if write_back == "mysql" else PredictionSink.sqlite(write_back)
+
+
+def run_worker(
+    job: str,
+    pipeline_key: str,
+    worker: int,
+    chunk_size: int,
+    tune: bool = True,
+    write_back: Optional[str] = None,
+    profile_batches: int = 0,
+) -> dict:
+    """Claim and score shards of a job until none is left (the body of a worker process)
+
+    Args:
+        job (str): Job name
+        pipeline_key (str): Pipeline key, e.g. "setfit/setfit"
+        worker (int): Worker number
+        chunk_size (int): Number of rows scored and committed per batch
+        tune (bool, optional): Tune the torch thread count. Defaults to True.
+        write_back (str, optional): "mysql" or the path of an SQLite database to also upsert
+            the predictions into. Defaults to None.
+        profile_batches (int, optional): Profile the worker's first batches after thread
+            tuning (see `src.metrics.profile`). Defaults to 0.
+
+    Returns:
+        dict: The worker's "cores", torch "threads", "shards" and "rows" scored, inference
+            "time" and pipeline "load_time" in seconds, "peak_rss_mb", and a snapshot of its
+            stage timers and counters ("metrics")
+    """
+    import torch
+
+    from src.pipelines import get_model_version, get_pipeline, run_pipeline_with_confidence
+    from src.pipelines.transformers.tokens import set_token_cache_persistence
+
+    set_token_cache_persistence(False)  # every row is scored once
+    category, name = pipeline_key.split("/")
+    start_time = time.perf_counter()
+    pipeline = get_pipeline(category, name)
+    load_time = time.perf_counter() - start_time
+
+    sink = None
+    if write_back is not None:
+        sink = get_sink(write_back)
+        model_version = get_model_version(pipeline_key)
+    cores = available_cores()
+    tune = tune and category not in IO_BOUND_CATEGORIES
+    store = ScoringJobStore()
+    output = {"worker": worker, "cores": cores, "shards": 0, "rows": 0, "time": 0.0}
+    profiling = contextlib.ExitStack()
+    n_batches = 0
+    try:
+        while (claimed := store.claim_shard(job, worker)) is not None:
+            shard, spec, last_id = claimed
+            for batch in iter_shard_batches(spec, last_id, chunk_size):
+                columns = batch.to_pydict()
+                ids, texts, titles = columns["id"], columns["entry"], columns["title"]
+                if tune:
+                    before_tuning = metrics.snapshot()
+                    threads = tune_threads(pipeline, texts, titles, len(cores))
+                    metrics.reset()  # leave the tuning calls out of the stage metrics
+                    metrics.merge(before_tuning)
+                    print(f"Worker {worker}: {threads} threads on cores {cores}")
+                    tune = False
+                if n_batches == 0 and profile_batches > 0:
+                    profiling.enter_context(profile(f"score_{pipeline_key}_worker{worker}"))
+                start_time = time.perf_counter()
+                preds, confidences = asyncio.run(
+                    run_pipeline_with_confidence(pipeline, texts, titles)
+                )
+                output["time"] += time.perf_counter() - start_time
+                if sink is not None:
+                    sink.write(zip(ids, [model_version] * len(ids), preds, confidences))
+                store.commit_batch(job, shard, ids, preds, confidences)
+                output["rows"] += len(ids)
+                n_batches += 1
+                if n_batches == profile_batches:
+                    profiling.close()  # saves the traces
+            store.finish_shard(job, shard)
+            output["shards"] += 1
+    finally:
+        profiling.close()
+        store.close()
+        if sink is not None:
+            sink.pool.close()
+    return {
+        **output,
+        "threads": torch.get_num_threads(),
+        "load_time": load_time,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "metrics": metrics.snapshot(),
+    }
+
+
+def main(args: argparse.Namespace) -> dict:
+    """Main function
+
+    Returns:
+        dict: Summary of the run, also saved to the results directory
+    """
+    category, _, name = args.pipeline.partition("/")
+    if name not in PIPELINE_NAMES.get(category, []):
+        raise ValueError(f"Unknown pipeline: {args.pipeline}")
+    job = args.job or f"{args.pipeline}@{args.source}"
+    n_workers = args.workers or max(1, len(available_cores()) // 4)
+    if category not in IO_BOUND_CATEGORIES and n_workers > len(available_cores()):
+        n_workers = len(available_cores())  # workers sharing a core only slow each other down
+        print(f"Using {n_workers} workers, one per core")
+
+    store = ScoringJobStore()
+    try:
+        if args.restart:
+            store.delete_job(job)
+        specs = [] if store.has_job(job) else make_shards(args.source, args.shards or 4 * n_workers)
+        if store.create_job(job, args.pipeline, args.source, specs):
+            print(f"Created job {job} with {len(specs)} shards")
+        else:
+            progress = store.progress(job)
+            print(
+                f"Resuming job {job}: {progress['done']} shards done ({progress['rows']} rows), "
+                f"{progress['pending']} to go"
+            )
+    finally:
+        store.close()
+
+    write_back = args.write_back_sqlite or ("mysql" if args.write_back else None)
+    if write_back is not None:
+        sink = get_sink(write_back)
+        sink.create_table()
+        sink.pool.close()
+    core_sets = split_cores(n_workers)
+    executors = [pinned_executor(cores) for cores in core_sets]
+    start_time = time.perf_counter()
+    try:
+        futures = [
+            executor.submit(
+                run_worker,
+                job,
+                args.pipeline,
+                worker,
+                args.chunk_size,
+                not args.no_tune,
+                write_back,
+                args.profile_batches if args.profile else 0,
+            )
+            for worker, executor in enumerate(executors)
+        ]
+        outputs = [future.result() for future in futures]
+    finally:
+        for executor in executors:
+            executor.shutdown()
+    wall_time = time.perf_counter() - start_time
+
+    store = ScoringJobStore()
+    progress = store.progress(job)
+    store.close()
+    for output in outputs:
+        metrics.merge(output.pop("metrics"))
+    metrics.write(METRICS_DIR / "score.prom", job=job)
+    rows = sum(output["rows"] for output in outputs)
+    summary = {
+        "job": job,
+        "pipeline": args.pipeline,
+        "source": args.source,
+        "workers": outputs,
+        "rows": rows,
+        "wall_time": wall_time,
+        "rows_per_second": rows / wall_time,
+        "progress": progress,
+    }
+    for output in outputs:
+        rate = output["rows"] / output["time"] if output["time"] else 0.0
+        print(
+            f"Worker {output['worker']}: {output['rows']} rows in {output['shards']} shards, "
+            f"{rate:.1f} rows/s on {len(output['cores'])} cores with {output['threads']} threads"
+        )
+    print(
+        f"Scored {rows} rows in {wall_time:.2f} seconds ({summary['rows_per_second']:.1f} rows/s)"
+    )
+    print(f"Job {job}: {progress['rows']} rows scored in total")
+    print("Time per pipeline stage, summed over the workers:")
+    print_stage_table()
+    if progress["pending"] or progress["running"]:
+        print(f"{progress['pending'] + progress['running']} shards left, re-run to resume")
+
+    now = datetime.datetime.now().strftime("%Y-%m-%d_%H%M%S")
+    results_dir = os.path.join(DATA_DIR, "results")  # type: ignore
+    os.makedirs(results_dir, exist_ok=True)
+    with open(os.path.join(results_dir, f"score_{now}.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pipeline", help='Pipeline to run, e.g. "setfit/setfit"')
+    parser.add_argument("--source", choices=SOURCES, default="mysql", help="Where to read rows")
+    parser.add_argument(
+        "--workers", type=int, default=0, help="Worker processes (default: one per 4 cores)"
+    )
+    parser.add_argument(
+        "--shards", type=int, default=0, help="MySQL id ranges (default: 4 per worker)"
+    )
+    parser.add_argument("--chunk-size", type=int, default=MYSQL_CHUNK_SIZE)
+    parser.add_argument("--job", help="Job name (default: pipeline@source), to resume by")
+    parser.add_argument("--restart", action="store_true", help="Drop the job's progress first")
+    parser.add_argument("--no-tune", action="store_true", help="Use one thread per core")
+    parser.add_argument(
+        "--profile", action="store_true", help="Save cProfile/torch profiler traces per worker"
+    )
+    parser.add_argument(
+        "--profile-batches",
+        type=int,
+        default=PROFILE_BATCHES,
+        help="Batches profiled per worker, after thread tuning",
+    )
+    parser.add_argument(
+        "--write-back", action="store_true", help="Upsert the predictions into MySQL"
+    )
+    parser.add_argument("--write-back-sqlite", help="Upsert the predictions into this SQLite db")
+    main(parser.parse_args())
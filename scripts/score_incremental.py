@@ -0,0 +1,150 @@
+"""Scores only the feedback which arrived since the last run of a pipeline.
+
+With `--write-back`, predictions are also upserted into MySQL's `PREDICTIONS_TABLE` as
+(id, model_version, label, confidence), in the background while the next batch is scored.
+`--write-back-sqlite PATH` writes them to an SQLite database instead, e.g. for testing.
+Stage timers and counters are written to `METRICS_DIR/score_incremental.prom`, and
+`--profile` saves a trace of the run to `PROFILES_DIR`.
+
+Example:
+    python scripts/score_incremental.py setfit/setfit
+    python scripts/score_incremental.py hf/roberta_hartmann --team 881 --team 988
+    python scripts/score_incremental.py setfit/setfit --write-back
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import time
+from typing import Optional
+
+from src.config import METRICS_DIR, MYSQL_CHUNK_SIZE
+from src.data.make_dataset import get_team_ids, iter_feedback_batches
+from src.data.sink import AsyncPredictionWriter, PredictionSink
+from src.data.watermark import WatermarkStore
+from src.metrics import metrics, print_stage_table, profile
+from src.pipelines import get_model_version, get_pipeline, run_pipeline_with_confidence
+
+
+async def score_team(
+    pipeline_key: str,
+    pipeline,
+    store: WatermarkStore,
+    team_id: int,
+    chunk_size: int,
+    writer: Optional[AsyncPredictionWriter] = None,
+    model_version: Optional[str] = None,
+) -> int:
+    """Score the rows of a team above its watermark
+
+    Args:
+        pipeline_key (str): Pipeline key, e.g. "setfit/setfit"
+        pipeline (Callable): The pipeline to run
+        store (WatermarkStore): State store holding the watermarks
+        team_id (int): Team id
+        chunk_size (int): Number of rows scored and written per batch
+        writer (AsyncPredictionWriter, optional): Also write the predictions back with it
+        model_version (str, optional): Model version of the written-back predictions
+
+    Returns:
+        int: Number of rows scored
+    """
+    last_id = store.get(pipeline_key, team_id)
+    print(f"Team {team_id}: scoring rows after id {last_id}...")
+    n_rows = 0
+    for batch in iter_feedback_batches(
+        columns=["id", "team_id", "title", "entry"],
+        chunk_size=chunk_size,
+        start_after_id=last_id,
+        team_id=team_id,
+    ):
+        columns = batch.to_pydict()
+        preds, confidences = await run_pipeline_with_confidence(
+            pipeline, columns["entry"], columns["title"]
+        )
+        commit = functools.partial(store.commit_batch, pipeline_key, team_id, columns["id"], preds)
+        if writer is not None:
+            # the watermark only moves once the write-back of the batch is confirmed
+            rows = zip(columns["id"], [model_version] * len(preds), preds, confidences)
+            await writer.put(rows, on_written=commit)
+        else:
+            commit()
+        n_rows += batch.num_rows
+    return n_rows
+
+
+async def main(
+    pipeline_key: str,
+    team_ids: list[int],
+    chunk_size: int,
+    sink: Optional[PredictionSink] = None,
+    profile_run: bool = False,
+):
+    """Main function
+
+    Args:
+        pipeline_key (str): Pipeline key in the form "category/name"
+        team_ids (list[int]): Teams to score. Defaults to every team in MySQL if empty.
+        chunk_size (int): Number of rows scored and written per batch
+        sink (PredictionSink, optional): Also write the predictions back to this sink
+        profile_run (bool, optional): Profile the scoring (see `src.metrics.profile`).
+            Defaults to False.
+    """
+    from src.pipelines.transformers.tokens import set_token_cache_persistence
+
+    set_token_cache_persistence(False)  # new rows are scored once
+    category, name = pipeline_key.split("/")
+    pipeline = get_pipeline(category, name)
+    store = WatermarkStore()
+    writer = None
+    if sink is not None:
+        sink.create_table()
+        writer = AsyncPredictionWriter(sink)
+        writer.start()
+    model_version = get_model_version(pipeline_key)
+
+    start_time = time.time()
+    total_rows = 0
+    profiling = profile(f"score_incremental_{pipeline_key}") if profile_run else None
+    try:
+        with profiling or contextlib.nullcontext():
+            for team_id in team_ids or get_team_ids():
+                total_rows += await score_team(
+                    pipeline_key, pipeline, store, team_id, chunk_size, writer, model_version
+                )
+    finally:
+        try:
+            if writer is not None:
+                await writer.close()  # advances the watermarks of the batches it writes
+        finally:
+            store.close()
+
+    time_taken = time.time() - start_time
+    print(f"Scored {total_rows} new rows in {time_taken:.2f} seconds.")
+    if sink is not None:
+        print(f"Wrote back {sink.stats()}")
+    print_stage_table()
+    metrics.write(METRICS_DIR / "score_incremental.prom", pipeline_key=pipeline_key)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pipeline", help='Pipeline to run, e.g. "setfit/setfit"')
+    parser.add_argument("--team", type=int, action="append", default=[], help="Team id")
+    parser.add_argument("--chunk-size", type=int, default=MYSQL_CHUNK_SIZE)
+    parser.add_argument(
+        "--write-back", action="store_true", help="Upsert the predictions into MySQL"
+    )
+    parser.add_argument("--write-back-sqlite", help="Upsert the predictions into this SQLite db")
+    parser.add_argument(
+        "--profile", action="store_true", help="Save cProfile/torch profiler traces of the run"
+    )
+    args = parser.parse_args()
+
+    sink = None
+    if args.write_back_sqlite:
+        sink = PredictionSink.sqlite(args.write_back_sqlite)
+    elif args.write_back:
+        sink = PredictionSink()
+    asyncio.run(main(args.pipeline, args.team, args.chunk_size, sink, args.profile))
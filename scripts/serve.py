@@ -0,0 +1,101 @@
+"""Serves warm sentiment analysis pipelines over HTTP with dynamic micro-batching.
+
+Example:
+    python scripts/serve.py --pipeline setfit/setfit --pipeline hf/roberta_hartmann
+    curl -X POST localhost:8080/predict/setfit/setfit -d '{"text": "Love the new update"}'
+    curl localhost:8080/stats
+    curl localhost:8080/metrics
+"""
+
+import argparse
+
+from aiohttp import web
+
+from src.metrics import metrics
+from src.pipelines import get_pipeline
+from src.serving import MicroBatcher
+
+
+async def predict(request: web.Request) -> web.Response:
+    """Classify a single review: {"text": ..., "title": ...} -> {"label": ...}"""
+    key = f"{request.match_info['category']}/{request.match_info['name']}"
+    batcher = request.app["batchers"].get(key)
+    if batcher is None:
+        raise web.HTTPNotFound(text=f"Pipeline {key} is not being served")
+    body = await request.json()
+    if not isinstance(body.get("text"), str):
+        raise web.HTTPBadRequest(text='Expected a JSON body with a "text" string')
+    label = await batcher.predict(body["text"], body.get("title"))
+    return web.json_response({"label": label})
+
+
+async def stats(request: web.Request) -> web.Response:
+    """Latency percentiles and throughput of every served pipeline"""
+    return web.json_response(
+        {key: batcher.stats.summary() for key, batcher in request.app["batchers"].items()}
+    )
+
+
+async def prometheus_metrics(request: web.Request) -> web.Response:
+    """Stage timers and counters of the pipelines, in the Prometheus text format"""
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok", "pipelines": list(request.app["batchers"])})
+
+
+def create_app(
+    pipeline_keys: list[str], max_batch_size: int, max_wait_ms: float
+) -> web.Application:
+    """Load the pipelines once and build the web application around them
+
+    Args:
+        pipeline_keys (list[str]): Pipelines to serve, e.g. ["setfit/setfit"]
+        max_batch_size (int): Maximum number of requests per batch
+        max_wait_ms (float): Maximum time to wait for a batch to fill up
+
+    Returns:
+        web.Application: The application
+    """
+    from src.pipelines.transformers.tokens import set_token_cache_persistence
+
+    set_token_cache_persistence(False)  # keep disk writes off the request path
+    app = web.Application()
+    app["batchers"] = {}
+    for key in pipeline_keys:
+        category, name = key.split("/")
+        app["batchers"][key] = MicroBatcher(
+            get_pipeline(category, name), max_batch_size, max_wait_ms
+        )
+
+    async def start_batchers(app: web.Application):
+        for batcher in app["batchers"].values():
+            await batcher.start()
+
+    async def stop_batchers(app: web.Application):
+        for batcher in app["batchers"].values():
+            await batcher.stop()
+
+    app.on_startup.append(start_batchers)
+    app.on_cleanup.append(stop_batchers)
+    app.router.add_post("/predict/{category}/{name}", predict)
+    app.router.add_get("/stats", stats)
+    app.router.add_get("/metrics", prometheus_metrics)
+    app.router.add_get("/health", health)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--pipeline", action="append", help='Pipeline to serve, e.g. "setfit/setfit"'
+    )
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    app = create_app(args.pipeline or ["setfit/setfit"], args.max_batch_size, args.max_wait_ms)
+    web.run_app(app, host=args.host, port=args.port)
@@ -0,0 +1,44 @@
+"""Creates or refreshes the local columnar snapshot of the MySQL feedback table.
+
+Only the (team_id, data_source) partitions which changed since the last refresh are
+downloaded again (see `src.data.snapshot`). Loaders then read the snapshot instead of MySQL,
+unless `USE_FEEDBACK_SNAPSHOT=0`.
+
+Example:
+    python scripts/snapshot_feedback.py
+    python scripts/snapshot_feedback.py --full
+"""
+
+import argparse
+import time
+
+from src.config import FEEDBACK_SNAPSHOT_DIR
+from src.data.snapshot import load_feedback_snapshot, refresh_snapshot
+
+
+def main(full: bool = False):
+    """Main function
+
+    Args:
+        full (bool, optional): Download every partition again. Defaults to False.
+    """
+    stats = refresh_snapshot(full=full)
+    print(
+        f"Refreshed {stats['refreshed']} partitions ({stats['rows']} rows), "
+        f"{stats['unchanged']} unchanged, {stats['removed']} removed "
+        f"in {stats['seconds']:.2f} seconds."
+    )
+
+    start_time = time.perf_counter()
+    dataset = load_feedback_snapshot()
+    print(
+        f"Snapshot {FEEDBACK_SNAPSHOT_DIR} holds {dataset.num_rows} rows, "
+        f"loaded in {(time.perf_counter() - start_time) * 1000:.1f} ms."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--full", action="store_true", help="Download every partition again")
+    args = parser.parse_args()
+    main(args.full)
@@ -1,39 +1,44 @@
+import argparse
 import datetime
 import os
-import pickle
 import time
 
-from src.config import CUSTOM_MODELS_DIR, SETFIT_MODEL_PATH
-from src.data.make_dataset import load_latest_test_dataset
+from src.config import CUSTOM_MODELS_DIR, DATASET_PATH, SETFIT_ARTIFACT_PATH, SETFIT_FULL_MODEL_PATH
+from src.data.make_dataset import load_dataset_from_file
+from src.pipelines.setfit.artifact import save_setfit_artifact, update_symlink
 from src.pipelines.setfit.training import train_setfit_model
 
-SETFIT_TRAINER_PATH = CUSTOM_MODELS_DIR / "setfit_trainer.pkl"
 
-
-def main():
+def main(stratified: bool = False):
     # Check if the model has already been trained
-    if not os.path.exists(SETFIT_MODEL_PATH):
+    if not os.path.exists(SETFIT_ARTIFACT_PATH):
 
         # Train the model
-        print(f"Training model and saving to {SETFIT_MODEL_PATH}")
-        model, trainer = load_latest_test_dataset()
-
-        # Save the model and trainer
-        # Use today's date for versioning
-        now = datetime.datetime.now().strftime("%Y-%m-%d")
-        with open(CUSTOM_MODELS_DIR / f"setfit_model_{now}.pkl", "wb") as f:
-            pickle.dump(model, f)
-            os.symlink(f.name, SETFIT_MODEL_PATH)
-        with open(CUSTOM_MODELS_DIR / f"setfit_trainer_{now}.pkl", "wb") as f:
-            pickle.dump(trainer, f)
-            os.symlink(f.name, SETFIT_TRAINER_PATH)
+        print(f"Training model and saving to {SETFIT_ARTIFACT_PATH}")
+        model, trainer = train_setfit_model(
+            load_dataset_from_file(DATASET_PATH), stratified=stratified
+        )
 
         # Print accuracy on test set
         metric = trainer.evaluate()  # type: ignore
         if metric and "accuracy" in metric:
             print(f"Accuracy: {metric['accuracy']:0.4f}")
+
+        # Save the trainable model, and the artifact which the pipelines load
+        # Use today's date for versioning
+        now = datetime.datetime.now().strftime("%Y-%m-%d")
+        model_dir = CUSTOM_MODELS_DIR / f"setfit_model_{now}"
+        model.save_pretrained(str(model_dir))
+        update_symlink(SETFIT_FULL_MODEL_PATH, model_dir)
+        artifact_dir = save_setfit_artifact(
+            model,
+            CUSTOM_MODELS_DIR / f"setfit_artifact_{now}",
+            name=f"setfit_{now}",
+            extra={"metrics": metric or {}},
+        )
+        update_symlink(SETFIT_ARTIFACT_PATH, artifact_dir)
     else:
-        print(f"Model already exists at {SETFIT_MODEL_PATH}")
+        print(f"Model already exists at {SETFIT_ARTIFACT_PATH}")
 
 
 if __name__ == "__main__":
@@ -51,6 +56,14 @@ if __name__ == "__main__":
     # |                               |                      |                  N/A |
     # +-------------------------------+----------------------+----------------------+
     # Can also be easily trained on Google Colab
+    parser = argparse.ArgumentParser(description="Trains the SetFit model and saves its artifact")
+    parser.add_argument(
+        "--stratified",
+        action="store_true",
+        help="Sample the same number of contrastive pairs for every class",
+    )
+    args = parser.parse_args()
+
     start_time = time.time()
-    main()
+    main(args.stratified)
     print(f"Total time: {datetime.timedelta(seconds=time.time() - start_time)}")
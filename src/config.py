@@ -1,21 +1,48 @@
-"""Configuration file for the application."""
+"""Configuration file for the application.
+
+Kept free of heavy imports, since every entry point imports it: `DEVICE` needs torch and is
+only resolved on first access.
+"""
 
 import os
 from pathlib import Path
 
-import torch
 from dotenv import load_dotenv
-from transformers import logging
 
 load_dotenv()  # Load environment variables from .env file
-logging.set_verbosity_error()  # Disable transformers warnings
+os.environ.setdefault("TRANSFORMERS_VERBOSITY", "error")  # Disable transformers warnings
 
 # Training Parameters
 RANDOM_SEED = 42
-DEVICE = "cuda:0" if torch.cuda.is_available() else "cpu"
 VALID_SENTIMENTS = ["NEGATIVE", "NEUTRAL", "POSITIVE"]
 LABEL_MAPPING = {0: "NEGATIVE", 1: "NEUTRAL", 2: "POSITIVE"}
+SETFIT_DRIFT_MAX_ACCURACY_DROP = 0.05  # head-only retrain accuracy drop calling for a full retrain
+SETFIT_DRIFT_MAX_CENTROID_SHIFT = 0.1  # embedding drift (cosine distance) calling for one too
 OPENAI_MODEL_NAME = "text-davinci-003"  # Most expensive OpenAI model
+OPENAI_BATCH_SIZE = 10  # max reviews packed into one prompt by the batched pipelines
+OPENAI_BATCH_MAX_PROMPT_TOKENS = 3000  # leaves room for the completion in the 4097 context
+OPENAI_REQUESTS_PER_MINUTE = int(os.environ.get("OPENAI_REQUESTS_PER_MINUTE", 3_000))
+OPENAI_TOKENS_PER_MINUTE = int(os.environ.get("OPENAI_TOKENS_PER_MINUTE", 250_000))
+OPENAI_MAX_IN_FLIGHT = int(os.environ.get("OPENAI_MAX_IN_FLIGHT", 32))
+OPENAI_CACHE_MAX_ENTRIES = 1_000_000
+OPENAI_CACHE_MAX_AGE_DAYS = float(os.environ.get("OPENAI_CACHE_MAX_AGE_DAYS", 365))
+
+# Inference Parameters
+HF_BATCH_SIZE = 16  # max texts per forward pass of the HuggingFace pipelines
+HF_MAX_BATCH_TOKENS = 8192  # max padded tokens per forward pass (i.e. 16 x 512 tokens)
+USE_ONNX_BACKEND = os.environ.get("USE_ONNX_BACKEND", "0") == "1"  # also load int8 ONNX pipelines
+USE_EMBEDDING_CACHE = os.environ.get("USE_EMBEDDING_CACHE", "1") == "1"  # SetFit embedding cache
+EMBEDDING_CACHE_CAPACITY = 200_000  # embeddings (~150MB for 384-dim float16)
+USE_TOKEN_CACHE = os.environ.get("USE_TOKEN_CACHE", "1") == "1"  # persist HF token ids
+TOKEN_CACHE_CAPACITY = 200_000  # texts per tokenizer family, in memory and on disk
+USE_DEDUP = os.environ.get("USE_DEDUP", "0") == "1"  # only run pipelines on unique texts
+DEDUP_SHARED_RESULTS = os.environ.get("DEDUP_SHARED_RESULTS", "1") == "1"  # across processes
+DEDUP_RESULTS_MAX_ENTRIES = 1_000_000
+DEDUP_NEAR_DUPLICATES = os.environ.get("DEDUP_NEAR_DUPLICATES", "0") == "1"  # MinHash/LSH
+DEDUP_THRESHOLD = 0.9  # min estimated Jaccard similarity of near-duplicates
+CASCADE_FALLBACK = os.environ.get("CASCADE_FALLBACK", "hf/roberta_hartmann")  # "category/name"
+CASCADE_MARGIN_THRESHOLD = float(os.environ.get("CASCADE_MARGIN_THRESHOLD", 0.3))  # top-2 margin
+OPENAI_PRICE_PER_1K_TOKENS = 0.02  # text-davinci-003, for cost estimates
 
 # MySQL Configuration
 HOST = os.environ.get("MYSQL_HOST", None)
@@ -29,13 +56,55 @@ else:
     CONNECTION_STRING = None
     print("No MySQL database configuration found. Add environment variables to .env file.")
 
+# MySQL Streaming
+FEEDBACK_TABLE = "feedback_entries"
+FEEDBACK_COLUMNS = ["id", "team_id", "title", "entry", "data_source", "sentiment"]
+MYSQL_CHUNK_SIZE = int(os.environ.get("MYSQL_CHUNK_SIZE", 10_000))  # rows per query and batch
+USE_FEEDBACK_SNAPSHOT = os.environ.get("USE_FEEDBACK_SNAPSHOT", "1") == "1"  # use the local copy
+
+# MySQL Write-back
+PREDICTIONS_TABLE = "sentiment_predictions"
+MYSQL_POOL_SIZE = int(os.environ.get("MYSQL_POOL_SIZE", 4))  # max open connections per process
+MYSQL_WRITE_CHUNK_SIZE = int(os.environ.get("MYSQL_WRITE_CHUNK_SIZE", 1_000))  # rows per upsert
+
 # Paths
 PARENT_DIR = Path(__file__).parent.parent
 DATA_DIR = PARENT_DIR / "data"
 CUSTOM_MODELS_DIR = DATA_DIR / "models"
 SENTIMENT_ANNOTATIONS_CSV = DATA_DIR / "raw" / "sentiment_annotations.csv"
 DATASET_PATH = SENTIMENT_ANNOTATIONS_CSV
-SETFIT_MODEL_PATH = CUSTOM_MODELS_DIR / "setfit_model.pkl"
+SETFIT_MODEL_PATH = CUSTOM_MODELS_DIR / "setfit_model.pkl"  # legacy pickle
+SETFIT_FULL_MODEL_PATH = CUSTOM_MODELS_DIR / "setfit_model"  # latest trainable model
+SETFIT_ARTIFACT_PATH = CUSTOM_MODELS_DIR / "setfit_artifact"  # latest inference artifact
+ONNX_MODELS_DIR = CUSTOM_MODELS_DIR / "onnx"
+DISTILLED_MODEL_PATH = CUSTOM_MODELS_DIR / "roberta_hartmann_student"  # latest student
+CACHE_DIR = DATA_DIR / "cache"
+EMBEDDING_CACHE_DIR = CACHE_DIR / "embeddings"
+TOKEN_CACHE_DIR = CACHE_DIR / "tokens"  # token ids per tokenizer family
+SETFIT_PAIRS_CACHE_DIR = CACHE_DIR / "setfit_pairs"  # contrastive pairs and their token ids
+OPENAI_CACHE_PATH = CACHE_DIR / "openai_completions.db"
+DEDUP_RESULTS_PATH = CACHE_DIR / "dedup_results.db"  # labels of deduplicated texts
+LEGACY_OPENAI_CACHE_PATH = PARENT_DIR / ".openai.db"  # langchain SQLiteCache of earlier runs
+STATE_DIR = DATA_DIR / "state"
+FEEDBACK_SNAPSHOT_DIR = DATA_DIR / "snapshot" / FEEDBACK_TABLE  # partitioned Arrow files
+SCORING_STATE_DB = STATE_DIR / "scoring.db"  # watermarks and predictions of incremental runs
+SCORING_JOBS_DB = STATE_DIR / "score_jobs.db"  # shards and checkpoints of `scripts/score.py`
+SETFIT_DRIFT_LOG = STATE_DIR / "setfit_drift.jsonl"  # reports of head-only retrains
+METRICS_DIR = STATE_DIR / "metrics"  # Prometheus text files of batch runs
+PROFILES_DIR = DATA_DIR / "profiles"  # cProfile and torch profiler traces of `--profile` runs
+
+
+def __getattr__(name: str):
+    # Lazily resolved settings (PEP 562), cached as module attributes on first access
+    if name == "DEVICE":
+        import torch
+
+        globals()["DEVICE"] = "cuda:0" if torch.cuda.is_available() else "cpu"
+        return globals()["DEVICE"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # Create directories if they don't exist
 CUSTOM_MODELS_DIR.mkdir(parents=True, exist_ok=True)
+STATE_DIR.mkdir(parents=True, exist_ok=True)
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
@@ -1,9 +1,16 @@
 """Module for connecting to the MySQL database."""
 
+import contextlib
+import os
+import queue
+import sqlite3
+import threading
+from typing import Callable, Iterator
+
 import pymysql
 import pymysql.cursors
 
-from src.config import DB, HOST, PASSWORD, USER
+from src.config import DB, HOST, MYSQL_POOL_SIZE, PASSWORD, USER
 
 
 def get_mysql_connection():
@@ -24,3 +31,81 @@ def get_mysql_connection():
         charset="utf8mb4",
         cursorclass=pymysql.cursors.DictCursor,
     )
+
+
+def get_sqlite_connection(path: os.PathLike) -> sqlite3.Connection:
+    """Return a connection to an SQLite database, usable from any thread of a pool.
+
+    SQLite stands in for MySQL when testing the write path without a server.
+    """
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of database connections, opened on demand and reused.
+
+    At most `max_size` connections are checked out at once; callers beyond that wait up to
+    `timeout` seconds. Idle MySQL connections are pinged (and reconnected) before reuse, and
+    a connection is closed instead of returned if its user raised an error.
+    """
+
+    def __init__(
+        self,
+        connect: Callable = get_mysql_connection,
+        max_size: int = MYSQL_POOL_SIZE,
+        timeout: float = 30.0,
+    ):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator:
+        """Check out a connection for the duration of a `with` block"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No database connection free after {self.timeout} seconds")
+        conn = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self.connect()
+            else:
+                if hasattr(conn, "ping"):
+                    conn.ping(reconnect=True)
+            yield conn
+        except BaseException:
+            if conn is not None:
+                with contextlib.suppress(Exception):
+                    conn.close()
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._idle.put(conn)
+            self._slots.release()
+
+    def close(self) -> None:
+        """Close the idle connections"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            with contextlib.suppress(Exception):
+                conn.close()
+
+
+_mysql_pool = None
+
+
+def get_mysql_pool() -> ConnectionPool:
+    """Return the process-wide MySQL connection pool"""
+    global _mysql_pool
+    if _mysql_pool is None:
+        _mysql_pool = ConnectionPool()
+    return _mysql_pool
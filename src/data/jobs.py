@@ -0,0 +1,199 @@
+"""Module for persisting the shards and progress of sharded scoring jobs.
+
+A job splits its input into shards (MySQL id ranges or snapshot partitions). Worker processes
+claim pending shards one at a time, and commit every scored batch together with the shard's
+checkpoint (the largest `id` scored so far), so a killed job resumes each shard from its last
+committed batch. The store is an SQLite database in WAL mode, shared by all the workers.
+"""
+
+import contextlib
+import datetime
+import json
+import os
+import sqlite3
+from typing import Iterable, Iterator, Optional
+
+from src.config import SCORING_JOBS_DB
+from src.connections import get_sqlite_connection
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job TEXT PRIMARY KEY,
+    pipeline TEXT NOT NULL,
+    source TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shards (
+    job TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    spec TEXT NOT NULL,
+    status TEXT NOT NULL,
+    last_id INTEGER,
+    rows INTEGER NOT NULL DEFAULT 0,
+    worker INTEGER,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (job, shard)
+);
+CREATE TABLE IF NOT EXISTS job_predictions (
+    job TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    confidence REAL,
+    PRIMARY KEY (job, id)
+);
+"""
+
+PENDING, RUNNING, DONE = "pending", "running", "done"
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class ScoringJobStore:
+    """Local SQLite store for the shards, checkpoints and predictions of scoring jobs."""
+
+    def __init__(self, path: os.PathLike = SCORING_JOBS_DB):
+        self.path = path
+        self.conn = get_sqlite_connection(path)
+        self.conn.isolation_level = None  # transactions are explicit, see `_write`
+        self.conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        """A write transaction which takes the database lock up front
+
+        Workers claiming shards at the same time would otherwise both read a shard as
+        pending before either marks it as running.
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def has_job(self, job: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM jobs WHERE job = ?", (job,)).fetchone() is not None
+
+    def create_job(self, job: str, pipeline: str, source: str, specs: list[dict]) -> bool:
+        """Create a job with its shards, or prepare an existing job for resuming
+
+        Shards which were running when the job was killed go back to pending, and resume
+        from their checkpoint.
+
+        Args:
+            job (str): Job name
+            pipeline (str): Pipeline key, e.g. "setfit/setfit"
+            source (str): Input source, "mysql" or "snapshot"
+            specs (list[dict]): Shard specifications, in the order they should be claimed.
+                Ignored when resuming.
+
+        Raises:
+            ValueError: If the job exists with another pipeline or source
+
+        Returns:
+            bool: Whether the job was created (False when resuming)
+        """
+        with self._write() as conn:
+            row = conn.execute("SELECT pipeline, source FROM jobs WHERE job = ?", (job,)).fetchone()
+            if row is not None:
+                if tuple(row) != (pipeline, source):
+                    raise ValueError(f"Job {job} scores {row[0]} from {row[1]}, not {pipeline}")
+                conn.execute(
+                    "UPDATE shards SET status = ?, worker = NULL WHERE job = ? AND status = ?",
+                    (PENDING, job, RUNNING),
+                )
+                return False
+            now = _now()
+            conn.execute(
+                "INSERT INTO jobs (job, pipeline, source, created_at) VALUES (?, ?, ?, ?)",
+                (job, pipeline, source, now),
+            )
+            conn.executemany(
+                "INSERT INTO shards (job, shard, spec, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(job, i, json.dumps(spec), PENDING, now) for i, spec in enumerate(specs)],
+            )
+        return True
+
+    def claim_shard(self, job: str, worker: int) -> Optional[tuple[int, dict, Optional[int]]]:
+        """Claim the next pending shard of a job for a worker
+
+        Returns:
+            Optional[tuple[int, dict, Optional[int]]]: The shard number, its specification and
+                its checkpoint, or None when no shard is left
+        """
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT shard, spec, last_id FROM shards WHERE job = ? AND status = ? "
+                "ORDER BY shard LIMIT 1",
+                (job, PENDING),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE shards SET status = ?, worker = ?, updated_at = ? "
+                "WHERE job = ? AND shard = ?",
+                (RUNNING, worker, _now(), job, row[0]),
+            )
+        return row[0], json.loads(row[1]), row[2]
+
+    def commit_batch(
+        self,
+        job: str,
+        shard: int,
+        ids: list[int],
+        labels: Iterable[str],
+        confidences: Optional[Iterable[Optional[float]]] = None,
+    ) -> None:
+        """Write a batch of predictions and advance the shard's checkpoint in one transaction
+
+        Args:
+            job (str): Job name
+            shard (int): Shard number
+            ids (list[int]): Feedback ids of the batch, in ascending order
+            labels (Iterable[str]): Predicted labels, aligned with `ids`
+            confidences (Iterable[float], optional): Confidence of each label, if known
+        """
+        if not ids:
+            return
+        confidences = confidences if confidences is not None else [None] * len(ids)
+        with self._write() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO job_predictions (job, id, label, confidence) "
+                "VALUES (?, ?, ?, ?)",
+                [(job, id_, label, c) for id_, label, c in zip(ids, labels, confidences)],
+            )
+            conn.execute(
+                "UPDATE shards SET last_id = ?, rows = rows + ?, updated_at = ? "
+                "WHERE job = ? AND shard = ?",
+                (max(ids), len(ids), _now(), job, shard),
+            )
+
+    def finish_shard(self, job: str, shard: int) -> None:
+        with self._write() as conn:
+            conn.execute(
+                "UPDATE shards SET status = ?, updated_at = ? WHERE job = ? AND shard = ?",
+                (DONE, _now(), job, shard),
+            )
+
+    def progress(self, job: str) -> dict:
+        """Number of shards per status, and of rows scored, of a job"""
+        progress = {PENDING: 0, RUNNING: 0, DONE: 0, "rows": 0}
+        for status, n_shards, n_rows in self.conn.execute(
+            "SELECT status, COUNT(*), SUM(rows) FROM shards WHERE job = ? GROUP BY status",
+            (job,),
+        ):
+            progress[status] = n_shards
+            progress["rows"] += n_rows or 0
+        return progress
+
+    def delete_job(self, job: str) -> None:
+        """Forget a job, its shards and its predictions so that it can start over"""
+        with self._write() as conn:
+            for table in ("jobs", "shards", "job_predictions"):
+                conn.execute(f"DELETE FROM {table} WHERE job = ?", (job,))
+
+    def close(self) -> None:
+        self.conn.close()
@@ -2,14 +2,39 @@
 
 
 import os
+from typing import TYPE_CHECKING, Iterator, Optional
 
 import pandas as pd
-from datasets import Dataset, DatasetDict  # type: ignore
-from sklearn.model_selection import train_test_split
+import pyarrow as pa
+import pyarrow.compute as pc
+import pymysql.cursors
 
-from src.config import DATASET_PATH, LABEL_MAPPING, RANDOM_SEED
+from src.config import (
+    DATASET_PATH,
+    FEEDBACK_COLUMNS,
+    FEEDBACK_TABLE,
+    LABEL_MAPPING,
+    MYSQL_CHUNK_SIZE,
+    RANDOM_SEED,
+    USE_FEEDBACK_SNAPSHOT,
+)
 from src.connections import get_mysql_connection
 
+if TYPE_CHECKING:
+    from datasets import Dataset  # type: ignore
+
+# Fixed Arrow types for the known feedback columns so that every streamed batch shares
+# the same schema (inference would give `null` for a chunk where e.g. every title is NULL)
+FEEDBACK_ARROW_TYPES = {
+    "id": pa.int64(),
+    "team_id": pa.int64(),
+    "title": pa.string(),
+    "entry": pa.string(),
+    "data_source": pa.string(),
+    "sentiment": pa.string(),
+    "sentiment_output": pa.string(),
+}
+
 
 def split_dataset(df: pd.DataFrame) -> tuple:
     """Split the dataset into train and test sets
@@ -20,6 +45,8 @@ def split_dataset(df: pd.DataFrame) -> tuple:
     Returns:
         tuple: Train and test datasets as pandas DataFrames
     """
+    from sklearn.model_selection import train_test_split
+
     train, test = train_test_split(df, test_size=0.2, random_state=RANDOM_SEED)
     return train, test
 
@@ -36,12 +63,22 @@ def add_label_column(df: pd.DataFrame) -> None:
     df["label"] = df[label_key].map(INVERSE_LABEL_MAPPING)
 
 
+def add_label_columns(table: pa.Table) -> pa.Table:
+    """Add "label_str" and integer "label" columns, like `add_label_column` does in pandas"""
+    sentiments = table["sentiment"]
+    labels = pc.index_in(sentiments, value_set=pa.array(list(LABEL_MAPPING.values())))
+    labels = pc.take(pa.array(list(LABEL_MAPPING.keys()), pa.int64()), labels)
+    return table.append_column("label_str", sentiments).append_column("label", labels)
+
+
 def load_dataset_from_file(dataset_path: os.PathLike) -> dict:
     """Load the dataset as a HuggingFace dataset
 
     Returns:
         dict: HuggingFace dataset
     """
+    from datasets import Dataset, DatasetDict  # type: ignore
+
     df = pd.read_csv(dataset_path)
     add_label_column(df)
     train, test = split_dataset(df)
@@ -51,19 +88,173 @@ def load_dataset_from_file(dataset_path: os.PathLike) -> dict:
 def load_dataset_from_mysql() -> dict:
     """Load the dataset as a HuggingFace dataset from MySQL
 
+    The `FEEDBACK_COLUMNS` are streamed in batches (see `iter_feedback_batches`) straight
+    into an Arrow table, so no row objects or DataFrame copy of the table are built.
+
     Returns:
         dict: HuggingFace dataset
     """
+    from datasets import Dataset, DatasetDict  # type: ignore
+
     print("Loading dataset from MySQL...")
-    conn = get_mysql_connection()
-    with conn.cursor() as cursor:
-        cursor.execute("SELECT * FROM feedback_entries")
-        result = cursor.fetchall()
-    df = pd.DataFrame(result)
-    df.columns = [i[0] for i in cursor.description]
-    add_label_column(df)
+    schema = pa.schema([(column, FEEDBACK_ARROW_TYPES[column]) for column in FEEDBACK_COLUMNS])
+    batches = list(iter_feedback_batches(columns=FEEDBACK_COLUMNS))
+    table = add_label_columns(pa.Table.from_batches(batches, schema=schema))
     # No need to split since we consider the whole dataset as the test set
-    return DatasetDict({"test": Dataset.from_pandas(df)})
+    return DatasetDict({"test": Dataset(table)})
+
+
+def _rows_to_record_batch(rows: list[tuple], columns: list[str]) -> pa.RecordBatch:
+    """Convert rows fetched by a tuple cursor into an Arrow record batch
+
+    Args:
+        rows (list[tuple]): Rows as returned by `cursor.fetchall()`
+        columns (list[str]): Column names, in the same order as the selected columns
+
+    Returns:
+        pa.RecordBatch: The rows as a columnar record batch
+    """
+    arrays = [
+        pa.array(values, type=FEEDBACK_ARROW_TYPES.get(column))
+        for column, values in zip(columns, zip(*rows))
+    ]
+    return pa.RecordBatch.from_arrays(arrays, names=columns)
+
+
+def iter_feedback_batches(
+    columns: Optional[list[str]] = None,
+    chunk_size: int = MYSQL_CHUNK_SIZE,
+    start_after_id: Optional[int] = None,
+    end_id: Optional[int] = None,
+    team_id: Optional[int] = None,
+    data_source: Optional[str] = None,
+    any_data_source: bool = True,
+) -> Iterator[pa.RecordBatch]:
+    """Lazily stream the feedback table from MySQL as Arrow record batches
+
+    The table is walked in keyset pages (`WHERE id > last_id ORDER BY id LIMIT chunk_size`),
+    one query per batch, so at most `chunk_size` rows are held in memory at once and a caller
+    can resume from the last `id` it has seen. Each page is fully read and its cursor closed
+    before the batch is yielded: callers run inference between batches, for longer than the
+    server would keep an unread result set open (`net_write_timeout`).
+
+    Args:
+        columns (list[str], optional): Columns to select. Defaults to `FEEDBACK_COLUMNS`.
+            `id` is always selected since it is used for pagination.
+        chunk_size (int, optional): Number of rows per yielded batch (i.e. per query).
+        start_after_id (int, optional): Only return rows with an `id` above this value.
+        end_id (int, optional): Only return rows with an `id` up to (and including) this value.
+        team_id (int, optional): Only return rows belonging to this team.
+        data_source (str, optional): With `any_data_source=False`, only return rows from this
+            data source (None for rows without one).
+
+    Yields:
+        pa.RecordBatch: Batches of at most `chunk_size` rows, ordered by `id`
+    """
+    columns = list(columns or FEEDBACK_COLUMNS)
+    if "id" not in columns:
+        columns.insert(0, "id")
+    id_index = columns.index("id")
+    select = ", ".join(f"`{column}`" for column in columns)
+
+    conditions, params = ["`id` > %s"], []
+    if end_id is not None:
+        conditions.append("`id` <= %s")
+        params.append(end_id)
+    if team_id is not None:
+        conditions.append("`team_id` = %s")
+        params.append(team_id)
+    if not any_data_source:
+        conditions.append("`data_source` <=> %s")  # NULL-safe, so None matches NULL
+        params.append(data_source)
+    query = (
+        f"SELECT {select} FROM `{FEEDBACK_TABLE}` WHERE {' AND '.join(conditions)} "
+        "ORDER BY `id` LIMIT %s"
+    )
+
+    last_id = start_after_id if start_after_id is not None else -1
+    conn = get_mysql_connection()
+    try:
+        while True:
+            conn.ping(reconnect=True)  # the consumer may have kept us idle for a long time
+            with conn.cursor(pymysql.cursors.Cursor) as cursor:  # tuples, fully buffered
+                cursor.execute(query, [last_id, *params, chunk_size])
+                rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][id_index]
+            yield _rows_to_record_batch(list(rows), columns)
+            if len(rows) < chunk_size:
+                break  # last page
+    finally:
+        conn.close()
+
+
+def iter_feedback_dataset_shards(**kwargs) -> Iterator["Dataset"]:
+    """Lazily stream the feedback table from MySQL as HuggingFace dataset shards
+
+    Args:
+        **kwargs: Passed to `iter_feedback_batches`
+
+    Yields:
+        Dataset: One HuggingFace dataset per streamed record batch
+    """
+    from datasets import Dataset  # type: ignore
+
+    for batch in iter_feedback_batches(**kwargs):
+        yield Dataset(pa.Table.from_batches([batch]))
+
+
+def get_team_ids() -> list[int]:
+    """Get the ids of every team with feedback in MySQL
+
+    Returns:
+        list[int]: Sorted team ids
+    """
+    conn = get_mysql_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT DISTINCT `team_id` FROM `{FEEDBACK_TABLE}` ORDER BY `team_id`")
+            return [row["team_id"] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def get_id_ranges(n_ranges: int) -> list[tuple[int, int]]:
+    """Split the feedback table into id ranges holding about the same number of rows
+
+    Boundaries are read from the primary key index at row offsets, so ranges stay balanced
+    however sparse the ids are.
+
+    Args:
+        n_ranges (int): Number of ranges (fewer if the table has fewer rows)
+
+    Returns:
+        list[tuple[int, int]]: (start_after_id, end_id) of each range, for
+            `iter_feedback_batches`, in id order
+    """
+    conn = get_mysql_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT COUNT(*) AS `rows`, MIN(`id`) AS `min_id` FROM `{FEEDBACK_TABLE}`"
+            )
+            row = cursor.fetchone()
+            n_rows, min_id = int(row["rows"]), row["min_id"]
+            if n_rows == 0:
+                return []
+            bounds = [min_id - 1]
+            for i in range(1, min(n_ranges, n_rows)):
+                cursor.execute(
+                    f"SELECT `id` FROM `{FEEDBACK_TABLE}` ORDER BY `id` LIMIT 1 OFFSET %s",
+                    (n_rows * i // n_ranges - 1,),
+                )
+                bounds.append(cursor.fetchone()["id"])
+            cursor.execute(f"SELECT MAX(`id`) AS `max_id` FROM `{FEEDBACK_TABLE}`")
+            bounds.append(cursor.fetchone()["max_id"])
+    finally:
+        conn.close()
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
 
 
 def load_datasets() -> tuple[dict, dict]:
@@ -75,23 +266,63 @@ def load_datasets() -> tuple[dict, dict]:
     return load_dataset_from_file(DATASET_PATH), load_dataset_from_mysql()
 
 
-def load_latest_test_dataset() -> Dataset:
-    """Load the latest test data from MySQL
+def load_dataset_from_snapshot() -> dict:
+    """Load the dataset as a HuggingFace dataset from the local snapshot of the MySQL table
+
+    The snapshot files are memory-mapped, so this takes milliseconds and no database access
+    (see `src.data.snapshot`; refresh it with `python scripts/snapshot_feedback.py`).
+
+    Returns:
+        dict: HuggingFace dataset
+    """
+    from datasets import DatasetDict  # type: ignore
+
+    from .snapshot import load_feedback_snapshot, read_manifest
+
+    manifest = read_manifest()
+    print(f"Loading dataset from the snapshot of {manifest.get('checked_at')}...")
+    # No need to split since we consider the whole dataset as the test set
+    return DatasetDict({"test": load_feedback_snapshot()})
+
+
+def load_latest_test_dataset(use_snapshot: Optional[bool] = None) -> "Dataset":
+    """Load the latest test data from MySQL, or from its local snapshot
 
     NOTE: Removes any examples which appear in file's training data
 
+    Args:
+        use_snapshot (bool, optional): Read the local snapshot of the MySQL table instead of
+            querying MySQL. Defaults to USE_FEEDBACK_SNAPSHOT, if a snapshot exists.
+
     Returns:
         dict: Test dataset as a HuggingFace dataset
     """
-    file_dataset, mysql_dataset = load_datasets()
-    file_train_df = file_dataset["train"].to_pandas()
-    mysql_test_df = mysql_dataset["test"].to_pandas()
-    # Remove any examples which appear in file's training data
-    mysql_test_df = mysql_test_df[~mysql_test_df["id"].isin(file_train_df["id"])]
-    return Dataset.from_pandas(mysql_test_df)
+    import numpy as np
+    from datasets import Dataset  # type: ignore
+
+    from .snapshot import snapshot_exists
+
+    if use_snapshot is None:
+        use_snapshot = USE_FEEDBACK_SNAPSHOT and snapshot_exists()
+    if not use_snapshot:
+        file_dataset, mysql_dataset = load_datasets()
+        file_train_df = file_dataset["train"].to_pandas()
+        mysql_test_df = mysql_dataset["test"].to_pandas()
+        # Remove any examples which appear in file's training data
+        mysql_test_df = mysql_test_df[~mysql_test_df["id"].isin(file_train_df["id"])]
+        return Dataset.from_pandas(mysql_test_df)
+
+    test_dataset = load_dataset_from_snapshot()["test"]
+    # Only the ids of the file's training split are needed, no dataset conversion
+    file_train_df, _ = split_dataset(pd.read_csv(DATASET_PATH, usecols=["id"]))
+    in_train = pc.is_in(
+        test_dataset.data.column("id"), value_set=pa.array(file_train_df["id"], pa.int64())
+    )
+    # `select` only records the kept indices, the rows stay in the mapped files
+    return test_dataset.select(np.flatnonzero(~in_train.to_numpy()))
 
 
-def load_latest_train_dataset() -> Dataset:
+def load_latest_train_dataset() -> "Dataset":
     """Load the latest training data from file
 
     Returns:
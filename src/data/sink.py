@@ -0,0 +1,247 @@
+"""Module for writing predictions back to MySQL.
+
+Rows of `(id, model_version, label, confidence)` are upserted in chunks through a bounded
+connection pool, so re-scoring a row replaces its earlier prediction for the same model
+version. Each chunk is its own transaction and is retried on transient errors (deadlocks,
+lock timeouts, lost connections); upserts are idempotent, so a retried chunk is harmless.
+`AsyncPredictionWriter` puts a bounded queue in front of the sink, so that inference keeps
+running while earlier batches are written.
+"""
+
+import asyncio
+import contextlib
+import datetime
+import os
+import random
+import sqlite3
+import time
+from typing import Callable, Iterable, Optional
+
+from src.config import MYSQL_WRITE_CHUNK_SIZE, PREDICTIONS_TABLE
+from src.connections import ConnectionPool, get_mysql_pool, get_sqlite_connection
+
+# Lock wait timeout, deadlock, can't connect, server gone away, lost connection
+MYSQL_TRANSIENT_ERRORS = {1205, 1213, 2003, 2006, 2013}
+
+PredictionRow = tuple[int, str, str, Optional[float]]  # (id, model_version, label, confidence)
+
+MYSQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS `{table}` (
+    `feedback_id` BIGINT NOT NULL,
+    `model_version` VARCHAR(64) NOT NULL,
+    `label` VARCHAR(16) NOT NULL,
+    `confidence` FLOAT NULL,
+    `scored_at` DATETIME NOT NULL,
+    PRIMARY KEY (`feedback_id`, `model_version`)
+)
+"""
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    feedback_id INTEGER NOT NULL,
+    model_version TEXT NOT NULL,
+    label TEXT NOT NULL,
+    confidence REAL,
+    scored_at TEXT NOT NULL,
+    PRIMARY KEY (feedback_id, model_version)
+)
+"""
+MYSQL_UPSERT = (
+    "INSERT INTO `{table}` (`feedback_id`, `model_version`, `label`, `confidence`, `scored_at`) "
+    "VALUES (%s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE `label` = VALUES(`label`), `confidence` = VALUES(`confidence`), "
+    "`scored_at` = VALUES(`scored_at`)"
+)
+SQLITE_UPSERT = (
+    "INSERT INTO {table} (feedback_id, model_version, label, confidence, scored_at) "
+    "VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (feedback_id, model_version) DO UPDATE SET label = excluded.label, "
+    "confidence = excluded.confidence, scored_at = excluded.scored_at"
+)
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether a failed write is worth retrying"""
+    if isinstance(error, sqlite3.OperationalError):
+        return "locked" in str(error) or "busy" in str(error)
+    import pymysql
+
+    if isinstance(error, (pymysql.err.OperationalError, pymysql.err.InterfaceError)):
+        return not error.args or error.args[0] in MYSQL_TRANSIENT_ERRORS
+    return False
+
+
+class PredictionSink:
+    """Upserts predictions into the predictions table, in chunks, through a connection pool."""
+
+    def __init__(
+        self,
+        pool: Optional[ConnectionPool] = None,
+        dialect: str = "mysql",
+        table: str = PREDICTIONS_TABLE,
+        chunk_size: int = MYSQL_WRITE_CHUNK_SIZE,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+    ):
+        if dialect not in ("mysql", "sqlite"):
+            raise ValueError(f"Unknown dialect: {dialect}")
+        self.pool = pool or get_mysql_pool()
+        self.dialect = dialect
+        self.table = table
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.metrics = {"rows": 0, "chunks": 0, "retries": 0}
+
+    @classmethod
+    def sqlite(cls, path: os.PathLike, **kwargs) -> "PredictionSink":
+        """A sink writing to an SQLite database instead of MySQL (for local testing)"""
+        pool = ConnectionPool(lambda: get_sqlite_connection(path), max_size=1)
+        return cls(pool, dialect="sqlite", **kwargs)
+
+    def create_table(self) -> None:
+        """Create the predictions table if it does not exist"""
+        schema = MYSQL_SCHEMA if self.dialect == "mysql" else SQLITE_SCHEMA
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(schema.format(table=self.table))
+            cursor.close()
+            conn.commit()
+
+    def _write_chunk(self, rows: list[tuple]) -> None:
+        upsert = MYSQL_UPSERT if self.dialect == "mysql" else SQLITE_UPSERT
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    try:
+                        # pymysql sends the rows as one multi-row INSERT
+                        cursor.executemany(upsert.format(table=self.table), rows)
+                        conn.commit()
+                    except Exception:
+                        with contextlib.suppress(Exception):
+                            conn.rollback()
+                        raise
+                    finally:
+                        cursor.close()
+                return
+            except Exception as e:
+                if not is_transient(e) or attempt == self.max_retries:
+                    raise
+                self.metrics["retries"] += 1
+                time.sleep(random.uniform(0, self.base_delay * 2**attempt))
+
+    def write(self, rows: Iterable[PredictionRow]) -> int:
+        """Upsert predictions
+
+        Args:
+            rows (Iterable[PredictionRow]): (feedback id, model version, label, confidence)
+
+        Returns:
+            int: Number of rows written
+        """
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        n_rows = 0
+        chunk: list[tuple] = []
+        for id_, model_version, label, confidence in rows:
+            confidence = None if confidence is None else float(confidence)
+            chunk.append((int(id_), model_version, label, confidence, now))
+            if len(chunk) == self.chunk_size:
+                self._write_chunk(chunk)
+                n_rows, chunk = n_rows + len(chunk), []
+                self.metrics["chunks"] += 1
+        if chunk:
+            self._write_chunk(chunk)
+            n_rows += len(chunk)
+            self.metrics["chunks"] += 1
+        self.metrics["rows"] += n_rows
+        return n_rows
+
+    def stats(self) -> dict:
+        """Row, chunk and retry counts since the sink was created"""
+        return dict(self.metrics)
+
+
+class AsyncPredictionWriter:
+    """Writes predictions in the background, through a bounded queue in front of a sink.
+
+    `put` returns as soon as the rows are queued, and only waits while `max_pending` rows
+    are already queued, which bounds memory if the database is slower than inference.
+    Writes run in a worker thread, one chunk at a time; `on_written` callbacks passed to
+    `put` run on the event loop once their rows are written. Use as an async context manager, or
+    call `start` and `close`; `close` writes what is left and raises the first write error.
+    """
+
+    def __init__(self, sink: PredictionSink, max_pending: Optional[int] = None):
+        self.sink = sink
+        self.max_pending = max_pending or 10 * sink.chunk_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "AsyncPredictionWriter":
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue(self.max_pending)
+        self._task = asyncio.create_task(self._run())
+
+    async def put(
+        self, rows: Iterable[PredictionRow], on_written: Optional[Callable[[], None]] = None
+    ) -> None:
+        """Queue predictions for writing (see `PredictionSink.write`)
+
+        Args:
+            rows (Iterable[PredictionRow]): (feedback id, model version, label, confidence)
+            on_written (Callable, optional): Called once all of `rows` are written, e.g. to
+                advance a checkpoint. Never called if the write fails.
+        """
+        rows = list(rows)
+        for row in rows[:-1]:
+            await self._enqueue((row, None))
+        # the last item carries the callback (with no row if `rows` is empty), and chunks
+        # are written in order, so it runs once every row before it is written
+        await self._enqueue((rows[-1] if rows else None, on_written))
+
+    async def _enqueue(self, item: tuple) -> None:
+        assert self._queue is not None and self._task is not None, "writer not started"
+        if not self._task.done():
+            with contextlib.suppress(asyncio.QueueFull):
+                self._queue.put_nowait(item)
+                return
+            # wait for room, unless the writer fails while the queue is full
+            put = asyncio.ensure_future(self._queue.put(item))
+            done, _ = await asyncio.wait({put, self._task}, return_when=asyncio.FIRST_COMPLETED)
+            if put in done:
+                return
+            put.cancel()
+        self._task.result()  # raise the write error instead of queueing forever
+        raise RuntimeError("writer is closed")
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        loop = asyncio.get_running_loop()
+        while True:
+            chunk = [await self._queue.get()]
+            while len(chunk) < self.sink.chunk_size and not self._queue.empty():
+                chunk.append(self._queue.get_nowait())
+            items = [item for item in chunk if item is not None]
+            rows = [row for row, _ in items if row is not None]
+            if rows:
+                await loop.run_in_executor(None, self.sink.write, rows)
+            for _, on_written in items:
+                if on_written is not None:
+                    on_written()
+            if len(items) < len(chunk):
+                return  # reached the end marker queued by `close`
+
+    async def close(self) -> None:
+        """Write the queued predictions and stop the writer"""
+        if self._task is None:
+            return
+        if not self._task.done():
+            await self._queue.put(None)  # type: ignore
+        task, self._task = self._task, None
+        await task
@@ -0,0 +1,103 @@
+"""Module for persisting the state of incremental scoring runs.
+
+Each (pipeline, team) pair has a high-water mark: the largest feedback `id` that has been
+scored. Since `id` is auto-incremented on ingestion, every row above the mark is new.
+"""
+
+import datetime
+import os
+import sqlite3
+from typing import Iterable, Optional
+
+from src.config import SCORING_STATE_DB
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    pipeline TEXT NOT NULL,
+    team_id INTEGER NOT NULL,
+    last_id INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (pipeline, team_id)
+);
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER NOT NULL,
+    pipeline TEXT NOT NULL,
+    team_id INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    scored_at TEXT NOT NULL,
+    PRIMARY KEY (id, pipeline)
+);
+"""
+
+
+class WatermarkStore:
+    """Local SQLite store for per-team watermarks and the predictions written with them."""
+
+    def __init__(self, path: os.PathLike = SCORING_STATE_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def get(self, pipeline: str, team_id: int) -> Optional[int]:
+        """Get the high-water mark for a pipeline and team
+
+        Args:
+            pipeline (str): Pipeline key, e.g. "setfit/setfit"
+            team_id (int): Team id
+
+        Returns:
+            Optional[int]: The largest scored `id`, or None if the team was never scored
+        """
+        row = self.conn.execute(
+            "SELECT last_id FROM watermarks WHERE pipeline = ? AND team_id = ?",
+            (pipeline, team_id),
+        ).fetchone()
+        return row[0] if row else None
+
+    def commit_batch(
+        self, pipeline: str, team_id: int, ids: list[int], labels: Iterable[str]
+    ) -> None:
+        """Write a batch of predictions and advance the watermark in a single transaction
+
+        The watermark only moves once the predictions are stored, so an interrupted run
+        resumes from the last fully written batch.
+
+        Args:
+            pipeline (str): Pipeline key, e.g. "setfit/setfit"
+            team_id (int): Team id
+            ids (list[int]): Feedback ids of the batch, in ascending order
+            labels (Iterable[str]): Predicted labels, aligned with `ids`
+        """
+        if not ids:
+            return
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        with self.conn:  # one transaction
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO predictions (id, pipeline, team_id, label, scored_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(id_, pipeline, team_id, label, now) for id_, label in zip(ids, labels)],
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO watermarks (pipeline, team_id, last_id, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (pipeline, team_id, max(ids), now),
+            )
+
+    def reset(self, pipeline: str, team_id: Optional[int] = None) -> None:
+        """Forget the watermark of a pipeline so that the next run re-scores everything
+
+        Args:
+            pipeline (str): Pipeline key, e.g. "setfit/setfit"
+            team_id (int, optional): Only reset this team. Defaults to all teams.
+        """
+        with self.conn:
+            if team_id is None:
+                self.conn.execute("DELETE FROM watermarks WHERE pipeline = ?", (pipeline,))
+            else:
+                self.conn.execute(
+                    "DELETE FROM watermarks WHERE pipeline = ? AND team_id = ?",
+                    (pipeline, team_id),
+                )
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,236 @@
+"""Module for hot-path metrics of the pipelines, and on-demand profiling.
+
+Pipelines time each stage of a call (tokenization, forward pass, cache lookups, network,
+parsing, ...) and count events such as cache hits, fuzzy-match fallbacks or truncated texts
+in the process-wide `metrics` registry. Recording is a dict update under a lock, once per
+batch rather than per text, so it is always on. `metrics.render()` formats everything in the
+Prometheus text format: `scripts/serve.py` serves it at `/metrics`, and the batch scripts
+write it to `METRICS_DIR` (e.g. for node_exporter's textfile collector).
+
+`profile` captures cProfile traces of a block, plus torch profiler traces when torch is
+loaded, for the `--profile` switch of the scripts.
+"""
+
+import contextlib
+import copy
+import cProfile
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+from src.config import PROFILES_DIR
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)  # seconds
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)  # rows
+STAGE_SECONDS = "pipeline_stage_seconds"
+HELP = {
+    STAGE_SECONDS: "Time spent in each stage of the pipeline calls",
+    "pipeline_batch_size": "Rows per model batch, or reviews per prompt for OpenAI",
+    "cache_lookups_total": "Cache lookups by cache and result",
+    "truncated_texts_total": "Texts truncated to the token limit of the pipeline",
+    "openai_fuzzy_matches_total": "Completions parsed by fuzzy matching",
+    "openai_retried_reviews_total": "Reviews of batched prompts retried one by one",
+    "dedup_rows_total": "Rows seen by the deduplication stage, unique or duplicate",
+    "cascade_rows_total": "Rows answered by each stage of the cascade",
+}
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class Metrics:
+    """Counters and histograms, keyed by metric name and labels, safe to use from threads.
+
+    A histogram keeps its (non-cumulative) bucket counts followed by its sum and count.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[str, dict[Labels, float]] = {}
+        self.histograms: dict[str, dict[Labels, list[float]]] = {}
+        self.buckets: dict[str, tuple] = {}
+        self.record_functions = False  # also label torch profiler traces, see `profile`
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Add to a counter"""
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels) -> None:
+        """Record a value in a histogram (the buckets of its first observation stay)"""
+        key = _labels(labels)
+        with self._lock:
+            buckets = self.buckets.setdefault(name, buckets)
+            values = self.histograms.setdefault(name, {}).setdefault(
+                key, [0.0] * (len(buckets) + 3)  # buckets, +Inf, sum, count
+            )
+            values[next((i for i, le in enumerate(buckets) if value <= le), len(buckets))] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    @contextlib.contextmanager
+    def stage(self, pipeline: str, stage: str) -> Iterator[None]:
+        """Time a stage of a pipeline call
+
+        Example:
+            >>> with metrics.stage("roberta_hartmann", "forward"):
+            ...     logits = model(**inputs).logits
+        """
+        with contextlib.ExitStack() as stack:
+            if self.record_functions:
+                import torch
+
+                stack.enter_context(torch.profiler.record_function(f"{pipeline}:{stage}"))
+            start_time = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.observe(
+                    STAGE_SECONDS, time.perf_counter() - start_time, pipeline=pipeline, stage=stage
+                )
+
+    def snapshot(self) -> dict:
+        """A picklable copy of every series, e.g. to send from a worker process"""
+        with self._lock:
+            return copy.deepcopy(
+                {"counters": self.counters, "histograms": self.histograms, "buckets": self.buckets}
+            )
+
+    def merge(self, snapshot: dict) -> None:
+        """Add the series of another process's `snapshot` to these"""
+        with self._lock:
+            for name, series in snapshot["counters"].items():
+                own = self.counters.setdefault(name, {})
+                for key, value in series.items():
+                    own[key] = own.get(key, 0) + value
+            for name, series in snapshot["histograms"].items():
+                self.buckets.setdefault(name, snapshot["buckets"][name])
+                own = self.histograms.setdefault(name, {})
+                for key, values in series.items():
+                    if key in own:
+                        own[key] = [a + b for a, b in zip(own[key], values)]
+                    else:
+                        own[key] = list(values)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters, self.histograms, self.buckets = {}, {}, {}
+
+    def stage_seconds(self) -> dict[str, dict[str, float]]:
+        """Total seconds per pipeline and stage"""
+        totals: dict[str, dict[str, float]] = {}
+        with self._lock:
+            for key, values in self.histograms.get(STAGE_SECONDS, {}).items():
+                labels = dict(key)
+                totals.setdefault(labels["pipeline"], {})[labels["stage"]] = values[-2]
+        return totals
+
+    def render(self, **const_labels) -> str:
+        """Every series in the Prometheus text exposition format
+
+        Args:
+            **const_labels: Labels added to every series, e.g. worker="0"
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} counter"]
+                for key, value in sorted(series.items()):
+                    labels = _format_labels(_labels({**dict(key), **const_labels}))
+                    lines.append(f"{name}{labels} {value:g}")
+            for name, series in sorted(self.histograms.items()):
+                lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} histogram"]
+                for key, values in sorted(series.items()):
+                    labels = {**dict(key), **const_labels}
+                    cumulative = 0.0
+                    for le, count in zip([*self.buckets[name], "+Inf"], values[:-2]):
+                        cumulative += count
+                        bucket_labels = _format_labels(_labels({**labels, "le": le}))
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative:g}")
+                    lines.append(f"{name}_sum{_format_labels(_labels(labels))} {values[-2]:g}")
+                    lines.append(f"{name}_count{_format_labels(_labels(labels))} {values[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: os.PathLike, **const_labels) -> None:
+        """Write `render()` to a file, atomically so that a collector never reads half of it"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(self.render(**const_labels))
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
+
+
+def print_stage_table(stage_seconds: Optional[dict[str, dict[str, float]]] = None) -> None:
+    """Print where the time of each pipeline went, stage by stage"""
+    stage_seconds = stage_seconds if stage_seconds is not None else metrics.stage_seconds()
+    for pipeline, stages in sorted(stage_seconds.items()):
+        total = sum(stages.values()) or 1.0
+        breakdown = ", ".join(
+            f"{stage} {seconds:.2f}s ({seconds / total:.0%})"
+            for stage, seconds in sorted(stages.items(), key=lambda item: -item[1])
+        )
+        print(f"{pipeline}: {breakdown}")
+
+
+@contextlib.contextmanager
+def profile(name: str, output_dir: os.PathLike = PROFILES_DIR) -> Iterator[None]:
+    """Profile a block with cProfile, and with the torch profiler if torch is loaded
+
+    Writes `<name>.prof` (for `python -m pstats` or snakeviz) and, with torch, a Chrome trace
+    `<name>.trace.json` (for chrome://tracing or Perfetto) in which the pipeline stages show
+    up as labelled ranges. Prints the functions with the most cumulative time.
+
+    Args:
+        name (str): Name of the trace files, e.g. "hf_roberta_hartmann"
+        output_dir (os.PathLike, optional): Defaults to PROFILES_DIR.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    stem = output_dir / re.sub(r"[^\w.-]+", "_", name)
+    with contextlib.ExitStack() as stack:
+        torch_profiler = None
+        if "torch" in sys.modules:
+            import torch
+
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            torch_profiler = stack.enter_context(torch.profiler.profile(activities=activities))
+            metrics.record_functions = True
+            stack.callback(setattr, metrics, "record_functions", False)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+    profiler.dump_stats(f"{stem}.prof")
+    print(f"Profile of {name} saved to {stem}.prof")
+    if torch_profiler is not None:
+        torch_profiler.export_chrome_trace(f"{stem}.trace.json")
+        print(f"Torch trace of {name} saved to {stem}.trace.json")
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
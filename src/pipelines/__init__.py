@@ -1,17 +1,104 @@
 """Module for retrieving all sentiment analysis pipelines under consideration.
 
 A pipeline is a callable that takes a list of texts and returns a list of sentiment labels.
+
+Pipelines are built on demand: importing this package only imports the pipeline registry,
+and each backend imports its framework (torch, transformers, setfit, langchain, ...) when
+its first pipeline is built.
 """
 
-from typing import Callable
+import asyncio
+import os
+from collections.abc import Mapping
+from concurrent.futures import Executor
+from typing import Callable, Iterator, Optional
+
+from src.config import (
+    CASCADE_FALLBACK,
+    CASCADE_MARGIN_THRESHOLD,
+    DEDUP_NEAR_DUPLICATES,
+    DEDUP_RESULTS_MAX_ENTRIES,
+    DEDUP_RESULTS_PATH,
+    DEDUP_SHARED_RESULTS,
+    DEDUP_THRESHOLD,
+    DISTILLED_MODEL_PATH,
+    LABEL_MAPPING,
+    USE_DEDUP,
+    USE_ONNX_BACKEND,
+)
 
-from .openai import get_openai_pipelines
+from .cascade import get_cascade_pipelines
+from .dedup import DedupPipeline, SharedResults
+from .onnx import get_onnx_pipelines
+from .openai import OPENAI_PIPELINES, get_openai_pipelines
 from .setfit import get_setfit_pipeline
-from .transformers import get_transformer_pipelines
+from .text import text_hash
+from .transformers import TRANSFORMER_MODELS, get_transformer_pipelines
+
+PIPELINE_GENERATORS = {
+    "hf": get_transformer_pipelines,
+    "openai": get_openai_pipelines,
+    "setfit": get_setfit_pipeline,
+    "cascade": get_cascade_pipelines,
+}
+PIPELINE_NAMES = {
+    "hf": [name for name, _ in TRANSFORMER_MODELS],
+    "openai": list(OPENAI_PIPELINES),
+    "setfit": ["setfit"],
+    "cascade": ["cascade"],
+}
+if USE_ONNX_BACKEND:
+    PIPELINE_GENERATORS["onnx"] = get_onnx_pipelines
+    PIPELINE_NAMES["onnx"] = PIPELINE_NAMES["hf"] + ["setfit"]
+
+# Categories whose pipelines wait on the network rather than compute locally
+IO_BOUND_CATEGORIES = ["openai"]
+MODEL_VERSION_MAX_LENGTH = 64  # `model_version` column of the predictions table
+
+
+def with_dedup(pipeline: Callable, pipeline_key: str) -> Callable:
+    """Put the deduplication stage in front of a pipeline, if enabled in the config
+
+    Args:
+        pipeline (Callable): The pipeline
+        pipeline_key (str): Its key, e.g. "setfit/setfit". Its model version (see
+            `get_model_version`) namespaces the predictions shared with other processes, so
+            a retrained model or a changed cascade never reuses older predictions.
+    """
+    if not USE_DEDUP:
+        return pipeline
+    results = None
+    if DEDUP_SHARED_RESULTS:
+        namespace = f"{get_model_version(pipeline_key)}:near={DEDUP_NEAR_DUPLICATES}"
+        results = SharedResults(DEDUP_RESULTS_PATH, namespace, DEDUP_RESULTS_MAX_ENTRIES)
+    return DedupPipeline(
+        pipeline,
+        near_duplicates=DEDUP_NEAR_DUPLICATES,
+        threshold=DEDUP_THRESHOLD,
+        results=results,
+    )
+
+
+class LazyPipelines(Mapping):
+    """The pipelines of one category, each built on first access (see `get_pipeline`)."""
+
+    def __init__(self, category: str):
+        self.category = category
 
+    def __getitem__(self, name: str) -> Callable:
+        if name not in PIPELINE_NAMES[self.category]:
+            raise KeyError(name)
+        return get_pipeline(self.category, name)
 
-def get_all_pipelines() -> dict[str, Callable]:
-    """Get all pipelines for sentiment analysis
+    def __iter__(self) -> Iterator[str]:
+        return iter(PIPELINE_NAMES[self.category])
+
+    def __len__(self) -> int:
+        return len(PIPELINE_NAMES[self.category])
+
+
+def get_all_pipelines() -> dict[str, Mapping[str, Callable]]:
+    """Get all pipelines for sentiment analysis, each built on first access
 
     Returns:
         dict: Nested dictionary of pipelines with the following structure:
@@ -28,15 +115,123 @@ def get_all_pipelines() -> dict[str, Callable]:
                 },
                 "setfit": {
                     "setfit": setfit_pipeline,
+                },
+                "cascade": {
+                    "cascade": cascade_pipeline,
                 }
     """
-    pipelines = {}
-    for name, pipelines_generator in [
-        ("hf", get_transformer_pipelines),
-        ("openai", get_openai_pipelines),
-        ("setfit", get_setfit_pipeline),
-    ]:
-        pipelines[name] = {}
-        for pipeline_name, pipeline in pipelines_generator().items():
-            pipelines[name][pipeline_name] = pipeline
-    return pipelines
+    return {category: LazyPipelines(category) for category in PIPELINE_GENERATORS}
+
+
+_loaded_pipelines: dict[tuple[str, str], Callable] = {}
+
+
+def get_pipeline(category: str, name: str) -> Callable:
+    """Get a single pipeline by its category and name, building it on first use
+
+    Example:
+        >>> get_pipeline("setfit", "setfit")
+
+    Args:
+        category (str): Pipeline category (see `PIPELINE_GENERATORS`)
+        name (str): Pipeline name within the category
+
+    Returns:
+        Callable: The pipeline
+    """
+    if category not in PIPELINE_GENERATORS:
+        raise ValueError(f"Unknown pipeline category: {category}")
+    if name not in PIPELINE_NAMES[category]:
+        raise ValueError(f"Unknown {category} pipeline: {name}")
+    if (category, name) not in _loaded_pipelines:
+        pipelines = PIPELINE_GENERATORS[category](names=[name])
+        _loaded_pipelines[category, name] = with_dedup(pipelines[name], f"{category}/{name}")
+    return _loaded_pipelines[category, name]
+
+
+async def run_pipeline(
+    pipeline: Callable,
+    texts: list[str],
+    titles: Optional[list[str]] = None,
+    executor: Optional[Executor] = None,
+) -> list[str]:
+    """Run any pipeline on a list of texts and return plain sentiment labels
+
+    Takes care of the differences between pipelines: some expect (title, text) pairs,
+    some are async, and the HuggingFace pipelines return dicts instead of labels.
+
+    Args:
+        pipeline (Callable): The pipeline to run
+        texts (list[str]): The texts to classify
+        titles (list[str], optional): The titles of the texts, for pipelines which expect them
+        executor (Executor, optional): Run synchronous pipelines in this executor instead of
+            blocking the event loop. Defaults to None (run inline).
+
+    Returns:
+        list[str]: The predicted sentiment labels
+    """
+    if getattr(pipeline, "expects_titles", False):
+        # If the pipeline supports titles, pass them in as well
+        pipe_inputs = list(zip(titles or [None] * len(texts), texts))
+    else:
+        # Otherwise, just pass in the entries
+        pipe_inputs = texts
+
+    if getattr(pipeline, "is_async", False):
+        preds = await pipeline(pipe_inputs)
+    elif executor is not None:
+        preds = await asyncio.get_running_loop().run_in_executor(executor, pipeline, pipe_inputs)
+    else:
+        preds = pipeline(pipe_inputs)
+
+    if preds and isinstance(preds[0], dict):
+        # If the pipeline returns a dictionary, extract the label
+        preds = [pred["label"] for pred in preds]
+    return list(preds)
+
+
+async def run_pipeline_with_confidence(
+    pipeline: Callable, texts: list[str], titles: Optional[list[str]] = None
+) -> tuple[list[str], list[Optional[float]]]:
+    """Run a pipeline, also returning the confidence of each label when it has one
+
+    Pipelines with class probabilities (`predict_proba`) report the probability of the
+    predicted label; the others report None.
+
+    Returns:
+        tuple[list[str], list[Optional[float]]]: The predicted labels and their confidence
+    """
+    if hasattr(pipeline, "predict_proba"):
+        proba = pipeline.predict_proba(texts)
+        return [LABEL_MAPPING[int(i)] for i in proba.argmax(axis=1)], proba.max(axis=1).tolist()
+    return await run_pipeline(pipeline, texts, titles), [None] * len(texts)
+
+
+def get_model_version(pipeline_key: str) -> str:
+    """Version recorded with written-back predictions, and namespacing shared dedup results
+
+    SetFit pipelines (also on ONNX) carry the SetFit artifact version, the distilled student
+    the directory its symlink points to, and the cascade its margin threshold and the
+    versions of both its stages. The other pipelines run fixed Hub models, so their key is
+    their version. Versions longer than the `model_version` column keep their key and a hash
+    of the rest.
+    """
+    category, _, name = pipeline_key.partition("/")
+    if name == "setfit":
+        from src.pipelines.setfit.loading import get_setfit_model_version
+
+        version = get_setfit_model_version()
+    elif name == "roberta_hartmann_student":
+        student_dir = os.path.basename(os.path.realpath(DISTILLED_MODEL_PATH))
+        version = student_dir.removeprefix(f"{name}_")  # its creation time
+    elif category == "cascade":
+        version = (
+            f"margin={CASCADE_MARGIN_THRESHOLD},{get_model_version('setfit/setfit')},"
+            f"{get_model_version(CASCADE_FALLBACK)}"
+        )
+    else:
+        return pipeline_key
+    model_version = f"{pipeline_key}@{version}"
+    if len(model_version) > MODEL_VERSION_MAX_LENGTH:
+        model_version = f"{pipeline_key}@{text_hash(version)}"
+    return model_version
@@ -0,0 +1,118 @@
+"""Confidence-gated cascade: SetFit on every row, a more expensive pipeline on uncertain rows.
+
+SetFit's head gives class probabilities; rows whose margin between the two most likely
+classes falls below a threshold are sent to the fallback pipeline (a larger HuggingFace model
+or an OpenAI pipeline), whose labels replace SetFit's for those rows. A threshold of 0 never
+escalates, and any threshold above 1 escalates every row.
+"""
+
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+from src.config import CASCADE_FALLBACK, CASCADE_MARGIN_THRESHOLD, LABEL_MAPPING
+from src.metrics import metrics
+
+
+def top2_margin(proba: np.ndarray) -> np.ndarray:
+    """Difference between the two highest class probabilities of each row"""
+    top2 = np.sort(proba, axis=1)[:, -2:]
+    return top2[:, 1] - top2[:, 0]
+
+
+def parse_pipeline_key(key: str) -> tuple[str, str]:
+    """Split a "category/name" pipeline key, e.g. "hf/roberta_hartmann" """
+    category, _, name = key.partition("/")
+    if not name:
+        raise ValueError(f"Expected a pipeline key like 'hf/roberta_hartmann', got {key!r}")
+    return category, name
+
+
+class CascadePipeline:
+    """Runs a confident pipeline first and a fallback pipeline on its low-margin rows.
+
+    `first` must have a `predict_proba(texts)` method (see `SetFitPipeline`); the fallback
+    can be any pipeline. `last_stats` holds the row count, the escalated count and fraction,
+    and the time spent in each stage of the latest call.
+    """
+
+    expects_titles = True  # passed on to the fallback, if it expects them
+    is_async = True
+
+    def __init__(
+        self,
+        first,
+        fallback: Callable,
+        threshold: float = CASCADE_MARGIN_THRESHOLD,
+        fallback_name: str = CASCADE_FALLBACK,
+    ):
+        self.first = first
+        self.fallback = fallback
+        self.threshold = threshold
+        self.fallback_name = fallback_name
+        self.last_stats: dict = {}
+
+    def __repr__(self) -> str:
+        return f"CascadePipeline(setfit -> {self.fallback_name} below margin {self.threshold})"
+
+    async def __call__(self, title_text_pairs: list[tuple[Optional[str], str]]) -> list[str]:
+        from . import run_pipeline
+
+        titles = [title for title, _ in title_text_pairs]
+        texts = [text for _, text in title_text_pairs]
+        if not texts:
+            return []
+
+        start_time = time.perf_counter()
+        proba = self.first.predict_proba(texts)
+        preds = [LABEL_MAPPING[int(i)] for i in proba.argmax(axis=1)]
+        escalated = np.flatnonzero(top2_margin(proba) < self.threshold)
+        first_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        if len(escalated):
+            fallback_preds = await run_pipeline(
+                self.fallback, [texts[i] for i in escalated], [titles[i] for i in escalated]
+            )
+            for i, pred in zip(escalated, fallback_preds):
+                if pred in LABEL_MAPPING.values():  # keep SetFit's label if the fallback failed
+                    preds[i] = pred
+        fallback_time = time.perf_counter() - start_time
+
+        metrics.inc("cascade_rows_total", len(texts) - len(escalated), stage="first")
+        metrics.inc("cascade_rows_total", len(escalated), stage="fallback")
+        self.last_stats = {
+            "rows": len(texts),
+            "escalated": len(escalated),
+            "escalated_ratio": len(escalated) / len(texts),
+            "first_seconds": first_time,
+            "fallback_seconds": fallback_time,
+        }
+        print(
+            f"Cascade sent {len(escalated)}/{len(texts)} rows "
+            f"({self.last_stats['escalated_ratio']:.1%}) to {self.fallback_name}"
+        )
+        return preds
+
+
+def get_cascade_pipelines(names: Optional[list[str]] = None) -> dict[str, Callable]:
+    """Get the cascade pipeline (SetFit, then `CASCADE_FALLBACK` on uncertain rows)
+
+    Both stages are shared with the registry, so they are only loaded once.
+
+    Args:
+        names (list[str], optional): Only load these pipelines. Defaults to None (all).
+
+    Returns:
+        dict: {"cascade": cascade pipeline}
+    """
+    if names is not None and "cascade" not in names:
+        return {}
+    from . import get_pipeline
+
+    return {
+        "cascade": CascadePipeline(
+            get_pipeline("setfit", "setfit"), get_pipeline(*parse_pipeline_key(CASCADE_FALLBACK))
+        )
+    }
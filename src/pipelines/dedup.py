@@ -0,0 +1,342 @@
+"""Deduplication stage which can sit in front of any pipeline.
+
+Inputs are collapsed to unique representatives (exact duplicates after `normalize_text`,
+and optionally near-duplicates via MinHash/LSH on `canonicalize_text`), the wrapped pipeline
+only runs on those, and its predictions are scattered back to every original row. Keys are
+built from stable hashes, so the same text gets the same key in every process: with a
+`SharedResults` store, a text labelled by one process is not sent to the model again by
+another one (e.g. the workers of `scripts/score.py`).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+from src.config import RANDOM_SEED
+from src.metrics import metrics
+
+from .text import canonicalize_text, normalize_text, text_hash
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    pred TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+"""
+
+SQLITE_MAX_VARIABLES = 500  # per query, well below SQLite's limit
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def shingles(text: str, n: int = 3) -> set[str]:
+    """Word n-grams of a text (the text itself if it has fewer than n words)"""
+    words = text.split()
+    if len(words) <= n:
+        return {" ".join(words)}
+    return {" ".join(words[i : i + n]) for i in range(len(words) - n + 1)}
+
+
+class MinHasher:
+    """MinHash signatures of word shingles, whose agreement estimates Jaccard similarity."""
+
+    def __init__(self, num_perm: int = 128, seed: int = RANDOM_SEED):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.array(
+            [
+                int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+                for s in shingles(text)
+            ],
+            dtype=np.uint64,
+        )
+        # universal hashing (a * x + b) mod p; uint64 overflow is fine for hashing purposes
+        with np.errstate(over="ignore"):
+            permuted = ((hashes[:, None] * self.a + self.b) % MERSENNE_PRIME) & MAX_HASH
+        return permuted.min(axis=0)
+
+
+def lsh_params(num_perm: int, threshold: float) -> tuple[int, int]:
+    """Pick (bands, rows) such that pairs above the threshold likely share a band
+
+    Two signatures with Jaccard similarity s collide in some band with probability
+    1 - (1 - s^rows)^bands, whose steepest point is near (1 / bands)^(1 / rows).
+
+    Returns:
+        tuple[int, int]: Number of bands and rows per band
+    """
+    candidates = [
+        (num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0
+    ]
+    return min(candidates, key=lambda p: abs((1 / p[0]) ** (1 / p[1]) - threshold))
+
+
+def find_near_duplicates(texts: list[str], minhasher: MinHasher, threshold: float) -> list[int]:
+    """Cluster texts whose estimated Jaccard similarity reaches the threshold
+
+    Args:
+        texts (list[str]): Canonicalised texts
+        minhasher (MinHasher): Signature generator
+        threshold (float): Minimum estimated Jaccard similarity of duplicates
+
+    Returns:
+        list[int]: For each text, the index of the first text in its cluster
+    """
+    parents = list(range(len(texts)))
+
+    def find(i: int) -> int:
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    signatures = np.stack([minhasher.signature(text) for text in texts])
+    bands, rows = lsh_params(minhasher.num_perm, threshold)
+    for band in range(bands):
+        buckets: dict[bytes, list[int]] = {}
+        for i, signature in enumerate(signatures[:, band * rows : (band + 1) * rows]):
+            bucket = buckets.setdefault(signature.tobytes(), [])
+            # verify LSH candidates against the full signature, every member of the bucket
+            # since similarity is not transitive
+            for j in bucket:
+                if find(i) != find(j) and np.mean(signatures[i] == signatures[j]) >= threshold:
+                    root_i, root_j = find(i), find(j)
+                    parents[max(root_i, root_j)] = min(root_i, root_j)
+            bucket.append(i)
+    return [find(i) for i in range(len(texts))]
+
+
+class SharedResults:
+    """Predictions of deduplicated texts, shared by every process using the same database.
+
+    Entries are keyed by the dedup key of a text within a namespace (the pipeline and its
+    model version), and the least recently used ones beyond `max_entries` are evicted. The
+    database runs in WAL mode, so readers never wait on a writer.
+    """
+
+    def __init__(self, path: os.PathLike, namespace: str, max_entries: int = 1_000_000):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.lock = threading.Lock()  # the inference server calls pipelines from threads
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")  # durable enough for a cache
+        self.conn.executescript(SCHEMA)
+
+    def __getstate__(self) -> dict:
+        # connections cannot be pickled, e.g. into spawned workers
+        return {key: self.__dict__[key] for key in ("path", "namespace", "max_entries")}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def _key(self, key: str) -> str:
+        return text_hash(key, self.namespace)
+
+    def get_many(self, keys: list[str]) -> dict:
+        """Predictions of the dedup keys labelled before, by any process"""
+        stored = {self._key(key): key for key in keys}
+        found = {}
+        with self.lock:
+            hashed = list(stored)
+            for start in range(0, len(hashed), SQLITE_MAX_VARIABLES):
+                chunk = hashed[start : start + SQLITE_MAX_VARIABLES]
+                placeholders = ", ".join("?" * len(chunk))
+                found.update(
+                    self.conn.execute(
+                        f"SELECT key, pred FROM results WHERE key IN ({placeholders})", chunk
+                    ).fetchall()
+                )
+            if found:
+                with self.conn:
+                    self.conn.executemany(
+                        "UPDATE results SET last_used = ? WHERE key = ?",
+                        [(time.time(), key) for key in found],
+                    )
+        return {stored[key]: json.loads(pred) for key, pred in found.items()}
+
+    def put_many(self, preds: dict) -> None:
+        """Store the predictions of dedup keys, evicting the least recently used ones"""
+        if not preds:
+            return
+        now = time.time()
+        rows = [(self._key(key), json.dumps(pred), now) for key, pred in preds.items()]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results (key, pred, last_used) VALUES (?, ?, ?)", rows
+            )
+            (size,) = self.conn.execute("SELECT COUNT(*) FROM results").fetchone()
+            if size > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM results WHERE key IN "
+                    "(SELECT key FROM results ORDER BY last_used LIMIT ?)",
+                    (size - self.max_entries,),
+                )
+
+
+class DedupPipeline:
+    """Wraps a pipeline so that it only runs on unique inputs.
+
+    Behaves like the wrapped pipeline (it is async and/or expects titles if that one does).
+    Exact duplicates are only collapsed when their `normalize_text` forms match, which the
+    models cannot tell apart; the near-duplicate mode also ignores case and URLs. With
+    `results`, representatives labelled by another process (or an earlier call) are looked
+    up instead of run. `predict_proba` is deduplicated the same way, if the wrapped pipeline
+    has one. `last_stats` holds the row count, unique count, dedup ratio and shared hits of
+    the latest call.
+    """
+
+    def __init__(
+        self,
+        pipeline: Callable,
+        near_duplicates: bool = False,
+        threshold: float = 0.9,
+        num_perm: int = 128,
+        results: Optional[SharedResults] = None,
+    ):
+        self.pipeline = pipeline
+        self.expects_titles = getattr(pipeline, "expects_titles", False)
+        self.is_async = getattr(pipeline, "is_async", False)
+        self.threshold = threshold
+        self.minhasher = MinHasher(num_perm) if near_duplicates else None
+        self.results = results
+        self.last_stats: dict = {}
+
+    def __getattr__(self, name: str):
+        if name == "pipeline":  # not set yet, e.g. while unpickling
+            raise AttributeError(name)
+        return getattr(self.pipeline, name)
+
+    def __repr__(self) -> str:
+        return f"DedupPipeline({self.pipeline!r})"
+
+    @property
+    def predict_proba(self) -> Callable[[list[str]], np.ndarray]:
+        """Class probabilities of texts, computed once per unique text"""
+        if not hasattr(self.pipeline, "predict_proba"):
+            raise AttributeError("predict_proba")  # `hasattr` is False, as for the wrapped one
+        return self._predict_proba
+
+    def _canonical(self, item) -> str:
+        normalize = canonicalize_text if self.minhasher is not None else normalize_text
+        if isinstance(item, tuple):  # (title, text), `predict_proba` only gets texts
+            title, text = item
+            return f"{normalize(title or '')}\n{normalize(text)}"
+        return normalize(item)
+
+    def group(self, inputs: list) -> tuple[list, list[int], list[str]]:
+        """Collapse the inputs to unique representatives
+
+        Args:
+            inputs (list): Pipeline inputs (texts, or (title, text) pairs)
+
+        Returns:
+            tuple[list, list[int], list[str]]: The representatives, for each input the index
+                of its representative, and the key of each representative
+        """
+        canonical = [self._canonical(item) for item in inputs]
+        groups: dict[str, int] = {}
+        representatives, assignment = [], []
+        for item, text in zip(inputs, canonical):
+            key = text_hash(text)
+            if key not in groups:
+                groups[key] = len(representatives)
+                representatives.append((item, text, key))
+            assignment.append(groups[key])
+
+        if self.minhasher is not None and len(representatives) > 1:
+            roots = find_near_duplicates(
+                [text for _, text, _ in representatives], self.minhasher, self.threshold
+            )
+            kept = sorted(set(roots))
+            position = {root: i for i, root in enumerate(kept)}
+            assignment = [position[roots[group]] for group in assignment]
+            representatives = [representatives[root] for root in kept]
+
+        n_rows, n_unique = len(inputs), len(representatives)
+        self.last_stats = {
+            "rows": n_rows,
+            "unique": n_unique,
+            "dedup_ratio": 1 - n_unique / n_rows if n_rows else 0.0,
+        }
+        if n_unique < n_rows:
+            print(
+                f"Deduplicated {n_rows} rows to {n_unique} "
+                f"({self.last_stats['dedup_ratio']:.1%} fewer)"
+            )
+        return (
+            [item for item, _, _ in representatives],
+            assignment,
+            [key for _, _, key in representatives],
+        )
+
+    def _prepare(self, inputs, kind: str = "label") -> tuple[list, list[int], list[str], dict]:
+        """Group the inputs and look up the representatives labelled before
+
+        Args:
+            inputs: Pipeline inputs
+            kind (str, optional): What is looked up, "label" or "proba", which are shared
+                under distinct keys. Defaults to "label".
+        """
+        inputs = list(inputs)
+        with metrics.stage("dedup", "group"):
+            representatives, assignment, keys = self.group(inputs)
+        if kind != "label":
+            keys = [f"{kind}:{key}" for key in keys]
+        metrics.inc("dedup_rows_total", len(representatives), result="unique")
+        metrics.inc("dedup_rows_total", len(inputs) - len(representatives), result="duplicate")
+        known = {}
+        if self.results is not None and keys:
+            with metrics.stage("dedup", "shared_lookup"):
+                known = self.results.get_many(keys)
+            metrics.inc("cache_lookups_total", len(known), cache="dedup", result="hits")
+            metrics.inc(
+                "cache_lookups_total", len(keys) - len(known), cache="dedup", result="misses"
+            )
+            self.last_stats["shared_hits"] = len(known)
+        return representatives, assignment, keys, known
+
+    def _scatter(
+        self, keys: list[str], known: dict, todo: list[int], preds: list, assignment: list[int]
+    ) -> list:
+        """Merge the new predictions with the known ones and copy them to every input"""
+        new = {keys[i]: pred for i, pred in zip(todo, preds)}
+        if self.results is not None:
+            self.results.put_many(new)
+        by_key = {**known, **new}
+        return [by_key[keys[i]] for i in assignment]
+
+    def __call__(self, inputs):
+        representatives, assignment, keys, known = self._prepare(inputs)
+        todo = [i for i, key in enumerate(keys) if key not in known]
+        if self.is_async:
+            return self._acall(representatives, assignment, keys, known, todo)
+        preds = self.pipeline([representatives[i] for i in todo]) if todo else []
+        return self._scatter(keys, known, todo, list(preds), assignment)
+
+    async def _acall(self, representatives, assignment, keys, known, todo) -> list:
+        preds = await self.pipeline([representatives[i] for i in todo]) if todo else []
+        return self._scatter(keys, known, todo, list(preds), assignment)
+
+    def _predict_proba(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return self.pipeline.predict_proba(texts)
+        representatives, assignment, keys, known = self._prepare(texts, kind="proba")
+        todo = [i for i, key in enumerate(keys) if key not in known]
+        proba = self.pipeline.predict_proba([representatives[i] for i in todo]) if todo else []
+        rows = self._scatter(keys, known, todo, [row.tolist() for row in proba], assignment)
+        return np.array(rows)
@@ -0,0 +1,92 @@
+"""ONNX Runtime pipelines: int8-quantized CPU versions of the transformer and SetFit pipelines.
+
+Requires the optional `onnx` and `onnxruntime` packages. Exported graphs are cached under
+`ONNX_MODELS_DIR` with the version of the model they were exported from, and exported again
+once that model changes (e.g. a new SetFit artifact or distilled student is promoted).
+"""
+
+from pathlib import Path
+from typing import Callable, Optional
+
+from src.config import ONNX_MODELS_DIR
+
+SOURCE_VERSION_NAME = "source_version.txt"  # written last, so it also marks a complete export
+
+
+def _is_current(model_dir: Path, version: str) -> bool:
+    """Whether the export in the directory is complete and of this model version"""
+    path = model_dir / SOURCE_VERSION_NAME
+    return path.exists() and path.read_text() == version
+
+
+def get_onnx_pipelines(names: Optional[list[str]] = None) -> dict[str, Callable]:
+    """Get the ONNX pipelines, exporting any model which is not cached yet
+
+    Args:
+        names (list[str], optional): Only load these pipelines. Defaults to None (all).
+
+    Returns:
+        dict: dictionary of pipelines, named like their PyTorch counterparts
+    """
+    try:
+        from .export import export_setfit, export_transformer
+        from .runtime import OnnxSetFitPipeline, OnnxTextClassificationPipeline
+    except ImportError as e:
+        raise ImportError(
+            "The ONNX backend requires the onnx group: `poetry install --with onnx`"
+        ) from e
+    from src.pipelines import get_model_version
+    from src.pipelines.setfit.loading import load_setfit_model
+    from src.pipelines.transformers import TRANSFORMER_MODELS
+
+    pipelines = {}
+    for name, model in TRANSFORMER_MODELS:
+        if names is not None and name not in names:
+            continue
+        model_dir = ONNX_MODELS_DIR / name
+        version = get_model_version(f"hf/{name}")
+        if not _is_current(model_dir, version):
+            export_transformer(model, model_dir)
+            (model_dir / SOURCE_VERSION_NAME).write_text(version)
+        print(f"Loading ONNX pipeline for {name}...")
+        pipelines[name] = OnnxTextClassificationPipeline(model_dir)
+
+    if names is not None and "setfit" not in names:
+        return pipelines
+    model_dir = ONNX_MODELS_DIR / "setfit"
+    version = get_model_version("setfit/setfit")
+    if not _is_current(model_dir, version):
+        export_setfit(load_setfit_model(), model_dir)
+        (model_dir / SOURCE_VERSION_NAME).write_text(version)
+    print("Loading ONNX pipeline for setfit...")
+    pipelines["setfit"] = OnnxSetFitPipeline(model_dir)
+    return pipelines
+
+
+def check_parity(
+    reference: Callable, candidate: Callable, texts: list[str], labels: Optional[list[str]] = None
+) -> dict:
+    """Compare a quantized pipeline against its fp32 reference
+
+    Args:
+        reference (Callable): The fp32 pipeline
+        candidate (Callable): The quantized pipeline
+        texts (list[str]): Texts to classify
+        labels (list[str], optional): True labels, to also compare accuracy
+
+    Returns:
+        dict: "agreement" (fraction of identical predictions) and, given labels,
+            "reference_accuracy" and "candidate_accuracy"
+    """
+
+    def to_labels(preds):
+        return [pred["label"] if isinstance(pred, dict) else pred for pred in preds]
+
+    reference_preds = to_labels(reference(texts))
+    candidate_preds = to_labels(candidate(texts))
+    n = len(texts)
+    report = {"agreement": sum(r == c for r, c in zip(reference_preds, candidate_preds)) / n}
+    if labels is not None:
+        report["reference_accuracy"] = sum(p == l for p, l in zip(reference_preds, labels)) / n
+        report["candidate_accuracy"] = sum(p == l for p, l in zip(candidate_preds, labels)) / n
+    return report
@@ -0,0 +1,135 @@
+"""Export the transformer and SetFit models to dynamically quantized int8 ONNX graphs."""
+
+import json
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import torch
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from sentence_transformers.models import Normalize, Pooling
+from setfit import SetFitModel
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from src.pipelines.setfit.artifact import MappedSetFitModel
+from src.pipelines.setfit.head import LinearHead
+
+FP32_MODEL_NAME = "model_fp32.onnx"
+INT8_MODEL_NAME = "model_int8.onnx"
+SETFIT_CONFIG_NAME = "setfit_config.json"
+SETFIT_HEAD_NAME = "head.npz"
+OPSET_VERSION = 14
+
+
+class _KeywordInputs(torch.nn.Module):
+    """Calls the wrapped model with named inputs, so that positional ONNX inputs map correctly
+    whatever order the tokenizer returns them in (e.g. BERT's token_type_ids)."""
+
+    def __init__(self, model: torch.nn.Module, input_names: list[str], output: str):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+        self.output = output
+
+    def forward(self, *inputs):
+        return getattr(self.model(**dict(zip(self.input_names, inputs))), self.output)
+
+
+def _export(model: torch.nn.Module, tokenizer, output: str, output_dir: Path) -> Path:
+    """Export a model to ONNX with dynamic batch/sequence axes and quantize it to int8
+
+    Args:
+        model (torch.nn.Module): HuggingFace model
+        tokenizer (PreTrainedTokenizer): The model's tokenizer
+        output (str): Name of the model output to export, e.g. "logits"
+        output_dir (Path): Directory for the exported graphs
+
+    Returns:
+        Path: Path to the quantized model
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    dummy = tokenizer(["A dummy review used for tracing."], return_tensors="pt")
+    input_names = list(dummy.keys())
+    wrapper = _KeywordInputs(model.eval().cpu(), input_names, output)
+    inputs = tuple(dummy[name] for name in input_names)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    # per-token outputs (e.g. last_hidden_state) also vary in length, pooled ones do not
+    dynamic_axes[output] = (
+        {0: "batch", 1: "sequence"} if wrapper(*inputs).dim() == 3 else {0: "batch"}
+    )
+
+    torch.onnx.export(
+        wrapper,
+        inputs,
+        str(output_dir / FP32_MODEL_NAME),
+        input_names=input_names,
+        output_names=[output],
+        dynamic_axes=dynamic_axes,
+        opset_version=OPSET_VERSION,
+        do_constant_folding=True,
+    )
+    quantize_dynamic(
+        str(output_dir / FP32_MODEL_NAME),
+        str(output_dir / INT8_MODEL_NAME),
+        weight_type=QuantType.QInt8,
+    )
+    tokenizer.save_pretrained(output_dir)
+    return output_dir / INT8_MODEL_NAME
+
+
+def export_transformer(model_id: str, output_dir: Path) -> Path:
+    """Export a HuggingFace sequence classification model
+
+    Args:
+        model_id (str): HuggingFace Hub model id
+        output_dir (Path): Directory for the exported graphs and tokenizer
+
+    Returns:
+        Path: Path to the quantized model
+    """
+    print(f"Exporting {model_id} to ONNX...")
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModelForSequenceClassification.from_pretrained(model_id)
+    with torch.no_grad():
+        return _export(model, tokenizer, "logits", output_dir)
+
+
+def export_setfit(model: Union[SetFitModel, MappedSetFitModel], output_dir: Path) -> Path:
+    """Export the sentence-transformer body of a SetFit model, plus its head as arrays
+
+    Only the transformer is exported; pooling and normalisation are cheap and are applied
+    in numpy at inference time according to `setfit_config.json`.
+
+    Args:
+        model (SetFitModel | MappedSetFitModel): Trained SetFit model, or a loaded artifact
+        output_dir (Path): Directory for the exported graphs, tokenizer and head
+
+    Returns:
+        Path: Path to the quantized body
+    """
+    print("Exporting SetFit body to ONNX...")
+    body = model.model_body
+    if isinstance(model, MappedSetFitModel):
+        transformer, head = body.model, model.model_head
+        pooling_mode, normalize = body.pooling, body.normalize
+    else:
+        transformer, head = body[0].auto_model, LinearHead.from_sklearn(model.model_head)
+        pooling_mode = next(m for m in body if isinstance(m, Pooling)).get_pooling_mode_str()
+        normalize = any(isinstance(module, Normalize) for module in body)
+    if pooling_mode not in ("mean", "cls"):
+        raise ValueError(f"Unsupported pooling mode: {pooling_mode}")
+
+    with torch.no_grad():
+        path = _export(transformer, body.tokenizer, "last_hidden_state", output_dir)
+
+    with open(output_dir / SETFIT_CONFIG_NAME, "w") as f:
+        json.dump(
+            {
+                "pooling": pooling_mode,
+                "normalize": normalize,
+                "max_seq_length": body.get_max_seq_length(),
+            },
+            f,
+        )
+    np.savez(output_dir / SETFIT_HEAD_NAME, **head.to_arrays())
+    return path
@@ -0,0 +1,141 @@
+"""ONNX Runtime pipelines with the same callable interface as the PyTorch ones."""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+from transformers import AutoTokenizer
+
+from src.config import HF_BATCH_SIZE, HF_MAX_BATCH_TOKENS, LABEL_MAPPING
+from src.metrics import SIZE_BUCKETS, metrics
+from src.pipelines.parallel import pinned_threads
+from src.pipelines.setfit.head import LinearHead
+from src.pipelines.transformers.batching import make_buckets
+from src.pipelines.transformers.tokens import get_token_cache, pad_batch
+
+from .export import INT8_MODEL_NAME, SETFIT_CONFIG_NAME, SETFIT_HEAD_NAME
+
+
+class OnnxEncoder:
+    """Runs an exported ONNX graph over length-bucketed, padded batches of texts."""
+
+    def __init__(self, model_dir: Path, max_length: int = 512):
+        self.model_dir = model_dir
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = ort.SessionOptions()
+        # 0 lets ONNX Runtime use every physical core, pinned workers use their own cores
+        options.intra_op_num_threads = pinned_threads()
+        self.session = ort.InferenceSession(
+            str(model_dir / INT8_MODEL_NAME), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        self.token_cache = get_token_cache(self.tokenizer, max_length)
+        self.metrics_name = f"onnx/{model_dir.name}"
+
+    def run(self, texts: list[str], reduce) -> np.ndarray:
+        """Run the graph and reduce each batch's output to one row per text
+
+        Args:
+            texts (list[str]): list of texts
+            reduce (Callable): Maps (graph output, attention mask) to one row per text
+
+        Returns:
+            np.ndarray: The reduced outputs, in input order
+        """
+        with metrics.stage(self.metrics_name, "tokenize"):
+            token_ids = self.token_cache.encode(list(texts))
+        outputs: list = [None] * len(token_ids)
+        for bucket in make_buckets(
+            [len(ids) for ids in token_ids], HF_BATCH_SIZE, HF_MAX_BATCH_TOKENS
+        ):
+            metrics.observe(
+                "pipeline_batch_size", len(bucket), SIZE_BUCKETS, pipeline=self.metrics_name
+            )
+            with metrics.stage(self.metrics_name, "forward"):
+                input_ids, attention_mask = pad_batch(
+                    [token_ids[i] for i in bucket], self.tokenizer.pad_token_id
+                )
+                inputs = {
+                    "input_ids": input_ids,
+                    "attention_mask": attention_mask,
+                    "token_type_ids": np.zeros_like(input_ids),  # single-sequence inputs
+                }
+                (output,) = self.session.run(
+                    None, {name: inputs[name] for name in self.input_names}
+                )
+            with metrics.stage(self.metrics_name, "postprocess"):
+                for i, row in zip(bucket, reduce(output, attention_mask)):
+                    outputs[i] = row
+        return np.stack(outputs)
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class OnnxTextClassificationPipeline:
+    """Quantized ONNX version of a HuggingFace sentiment analysis pipeline."""
+
+    def __init__(self, model_dir: Path):
+        self.encoder = OnnxEncoder(model_dir)
+
+    def __call__(self, texts: list[str]) -> list[dict]:
+        """Classify the texts
+
+        Args:
+            texts (list[str]): list of texts
+
+        Returns:
+            list[dict]: {"label": ..., "score": ...} per text, like the HuggingFace pipelines
+        """
+        if not texts:
+            return []
+        probs = softmax(self.encoder.run(texts, lambda logits, mask: logits))
+        return [
+            {"label": LABEL_MAPPING[int(row.argmax())], "score": float(row.max())} for row in probs
+        ]
+
+
+class OnnxSetFitPipeline:
+    """Quantized ONNX version of the SetFit pipeline."""
+
+    def __init__(self, model_dir: Path):
+        with open(model_dir / SETFIT_CONFIG_NAME) as f:
+            self.config = json.load(f)
+        self.encoder = OnnxEncoder(model_dir, max_length=self.config["max_seq_length"])
+        with np.load(model_dir / SETFIT_HEAD_NAME) as arrays:
+            self.head = LinearHead.from_arrays(arrays)
+
+    def _pool(self, hidden_states: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.config["pooling"] == "cls":
+            embeddings = hidden_states[:, 0]
+        else:  # mean over the non-padding tokens
+            mask = attention_mask[..., None].astype(hidden_states.dtype)
+            embeddings = (hidden_states * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config["normalize"]:
+            embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Sentence embeddings of shape (len(texts), dim)"""
+        return self.encoder.run(texts, self._pool)
+
+    def predict_proba(self, texts: list[str]) -> np.ndarray:
+        """Class probabilities of shape (len(texts), len(LABEL_MAPPING))"""
+        return self.head.predict_proba(self.encode(texts))
+
+    def __call__(self, texts: list[str]) -> list[str]:
+        """Classify the texts
+
+        Args:
+            texts (list[str]): list of texts
+
+        Returns:
+            list[str]: list of labels
+        """
+        if not texts:
+            return []
+        return [LABEL_MAPPING[int(pred)] for pred in self.head.predict(self.encode(texts))]
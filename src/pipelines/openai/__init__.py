@@ -1,18 +1,49 @@
-"""OpenAI pipelines."""
+"""OpenAI pipelines.
 
+The pipeline classes are imported on first use, since importing them loads langchain, sets
+up the completion cache and imports the legacy cache.
+"""
 
-from .pipelines import FewShotPipeline, ZeroShotPipeline, ZeroShotPipelineWithTitle
+import importlib
+from typing import Optional
 
+PIPELINE_CLASSES = [
+    "BatchedFewShotPipeline",
+    "BatchedZeroShotPipeline",
+    "FewShotPipeline",
+    "ZeroShotPipeline",
+    "ZeroShotPipelineWithTitle",
+]
 
-def get_openai_pipelines() -> dict:
+OPENAI_PIPELINES = {
+    "zero_shot": "ZeroShotPipeline",
+    "zero_shot_batched": "BatchedZeroShotPipeline",
+    # "zero_shot_with_title": "ZeroShotPipelineWithTitle", # TODO: Test this (didn't have time)
+    "few_shot": "FewShotPipeline",
+    "few_shot_batched": "BatchedFewShotPipeline",
+}
+
+
+def __getattr__(name: str):
+    if name in PIPELINE_CLASSES:
+        return getattr(importlib.import_module(".pipelines", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_openai_pipelines(names: Optional[list[str]] = None) -> dict:
     """Gets the OpenAI pipelines
 
+    Args:
+        names (list[str], optional): Only create these pipelines. Defaults to None (all).
+
     Returns:
         dict: The OpenAI pipelines
     """
     print("Loading OpenAI pipelines...")
+    from . import pipelines
+
     return {
-        "zero_shot": ZeroShotPipeline(),
-        # "zero_shot_with_title": ZeroShotPipelineWithTitle(), # TODO: Test this (didn't have time)
-        "few_shot": FewShotPipeline(),
+        name: getattr(pipelines, class_name)()
+        for name, class_name in OPENAI_PIPELINES.items()
+        if names is None or name in names
     }
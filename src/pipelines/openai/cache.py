@@ -0,0 +1,253 @@
+"""Cache of LLM completions with bulk lookups, replacing langchain's global SQLiteCache.
+
+Completions are keyed by the hash of the model settings (model name, temperature and
+max tokens), the template version (hash of the prompt template) and the prompt itself.
+Lookups go through an in-process LRU first and then a single SQLite query per batch of
+prompts. The database runs in WAL mode, so readers never wait on a writer.
+"""
+
+import ast
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from langchain.chains import LLMChain
+
+from src.metrics import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    model_name TEXT NOT NULL,
+    template_version TEXT NOT NULL,
+    temperature REAL NOT NULL,
+    max_tokens INTEGER NOT NULL,
+    prompt TEXT NOT NULL,
+    completion TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used);
+CREATE INDEX IF NOT EXISTS completions_created_at ON completions (created_at);
+"""
+
+SQLITE_MAX_VARIABLES = 500  # per query, well below SQLite's limit
+
+
+def template_version(template: str) -> str:
+    """Short hash identifying a prompt template"""
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
+
+
+def completion_key(
+    model_name: str, temperature: float, max_tokens: int, version: str, prompt: str
+) -> str:
+    """Cache key of a prompt for the given model settings and template version"""
+    digest = hashlib.sha256()
+    for part in (model_name, repr(float(temperature)), str(max_tokens), version, prompt):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CompletionCache:
+    """SQLite (WAL) completion cache with an in-process LRU, size/age eviction and statistics.
+
+    Writes are buffered and flushed in bulk every `flush_every` completions (and on `flush`).
+    """
+
+    def __init__(
+        self,
+        path: os.PathLike,
+        max_entries: int = 1_000_000,
+        max_age_days: Optional[float] = None,
+        memory_entries: int = 10_000,
+        flush_every: int = 100,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.memory_entries = memory_entries
+        self.flush_every = flush_every
+        self.memory: OrderedDict[str, str] = OrderedDict()
+        self.pending: list[tuple] = []
+        self.counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self.lock = threading.Lock()  # the inference server calls pipelines from threads
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")  # durable enough for a cache
+        self.conn.executescript(SCHEMA)
+        self.evict()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def _remember(self, key: str, completion: str) -> None:
+        self.memory[key] = completion
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys: list[str]) -> dict[str, str]:
+        """Look up many keys at once
+
+        Args:
+            keys (list[str]): Cache keys (see `completion_key`)
+
+        Returns:
+            dict[str, str]: Completion per key found in the cache
+        """
+        with self.lock:
+            found = {}
+            for key in dict.fromkeys(keys):
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+            counts = {"memory_hits": sum(key in found for key in keys)}
+
+            remaining = [key for key in dict.fromkeys(keys) if key not in found]
+            from_disk = {}
+            for start in range(0, len(remaining), SQLITE_MAX_VARIABLES):
+                chunk = remaining[start : start + SQLITE_MAX_VARIABLES]
+                from_disk.update(
+                    self.conn.execute(
+                        "SELECT key, completion FROM completions "
+                        f"WHERE key IN ({', '.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                )
+            if from_disk:
+                with self.conn:
+                    self.conn.executemany(
+                        "UPDATE completions SET last_used = ? WHERE key = ?",
+                        [(time.time(), key) for key in from_disk],
+                    )
+                for key, completion in from_disk.items():
+                    self._remember(key, completion)
+            found.update(from_disk)
+            counts["disk_hits"] = sum(key in from_disk for key in keys)
+            counts["misses"] = sum(key not in found for key in keys)
+            for result, count in counts.items():
+                self.counts[result] += count
+                metrics.inc("cache_lookups_total", count, cache="openai", result=result)
+            return found
+
+    def add(
+        self,
+        key: str,
+        completion: str,
+        model_name: str,
+        version: str,
+        temperature: float,
+        max_tokens: int,
+        prompt: str,
+    ) -> None:
+        """Buffer a new completion, flushing the buffer to disk once it is large enough"""
+        with self.lock:
+            self._remember(key, completion)
+            now = time.time()
+            self.pending.append(
+                (key, model_name, version, temperature, max_tokens, prompt, completion, now, now)
+            )
+            flush = len(self.pending) >= self.flush_every
+        if flush:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write all buffered completions in one transaction"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if not pending:
+                return
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO completions (key, model_name, template_version, "
+                    "temperature, max_tokens, prompt, completion, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    pending,
+                )
+        self.evict()
+
+    def evict(self) -> int:
+        """Drop entries older than `max_age_days`, then the least recently used ones beyond
+        `max_entries`
+
+        Returns:
+            int: Number of evicted entries
+        """
+        with self.lock, self.conn:
+            evicted = 0
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                evicted += self.conn.execute(
+                    "DELETE FROM completions WHERE created_at < ?", (cutoff,)
+                ).rowcount
+            (size,) = self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()
+            if size > self.max_entries:
+                evicted += self.conn.execute(
+                    "DELETE FROM completions WHERE key IN "
+                    "(SELECT key FROM completions ORDER BY last_used LIMIT ?)",
+                    (size - self.max_entries,),
+                ).rowcount
+            return evicted
+
+    def stats(self) -> dict:
+        """Hit counts of this process, hit rate and the number of cached completions"""
+        lookups = sum(self.counts.values())
+        hits = self.counts["memory_hits"] + self.counts["disk_hits"]
+        return {
+            **self.counts,
+            "hit_rate": hits / lookups if lookups else None,
+            "size": len(self),
+        }
+
+    def import_langchain_cache(self, path: os.PathLike, chains: Iterable[LLMChain]) -> int:
+        """Import the completions of a langchain `SQLiteCache` database (e.g. `.openai.db`)
+
+        langchain keys entries by prompt and LLM parameters only, so each prompt is matched
+        against the templates of `chains` to recover its template version. Prompts which
+        match none of them are skipped.
+
+        Args:
+            path (os.PathLike): Path to the langchain cache database
+            chains (Iterable[LLMChain]): Chains whose prompts may be in the cache
+
+        Returns:
+            int: Number of imported completions
+        """
+        patterns = []
+        for chain in chains:
+            template = chain.prompt.template  # type: ignore
+            pattern = re.escape(template)
+            for variable in chain.prompt.input_variables:
+                pattern = pattern.replace(re.escape("{" + variable + "}"), "(?:.*)")
+            patterns.append((re.compile(pattern, re.DOTALL), template_version(template)))
+
+        source = sqlite3.connect(path)
+        try:
+            rows = source.execute(
+                "SELECT prompt, llm, response FROM full_llm_cache WHERE idx = 0"
+            ).fetchall()
+        finally:
+            source.close()
+
+        imported = 0
+        for prompt, llm_string, response in rows:
+            version = next((v for pattern, v in patterns if pattern.fullmatch(prompt)), None)
+            if version is None or response is None:
+                continue
+            params = dict(ast.literal_eval(llm_string))
+            model_name, temperature = params["model_name"], params["temperature"]
+            max_tokens = params["max_tokens"]
+            key = completion_key(model_name, temperature, max_tokens, version, prompt)
+            self.add(key, response, model_name, version, temperature, max_tokens, prompt)
+            imported += 1
+        self.flush()
+        return imported
@@ -1,13 +1,27 @@
 """Module defines callable OpenAI pipelines."""
 
-import asyncio
+import functools
+import os
+import re
+from typing import Optional
 
-import tiktoken
+from langchain.chains import LLMChain
 
-from src.config import VALID_SENTIMENTS
+from src.config import OPENAI_BATCH_MAX_PROMPT_TOKENS, OPENAI_BATCH_SIZE, VALID_SENTIMENTS
+from src.metrics import SIZE_BUCKETS, metrics
 
-from .prompts import few_shot_chain, zero_shot_chain, zero_shot_chain_with_title
-from .utils import get_best_match, llm
+from .prompts import (
+    batched_few_shot_chain,
+    batched_zero_shot_chain,
+    few_shot_chain,
+    zero_shot_chain,
+    zero_shot_chain_with_title,
+)
+from .cache import completion_key, template_version
+from .templates import batched_review_template, batched_zero_shot_review_template
+from .utils import completion_cache, get_best_match, get_encoder, llm, scheduler
+
+NUMBERED_LABEL_PATTERN = re.compile(r"^\s*#?(\d+)\s*[:.)-]\s*([A-Za-z]+)", re.MULTILINE)
 
 
 def parse_completion(completion: str, fuzzy: bool = True) -> str:
@@ -30,11 +44,43 @@ def parse_completion(completion: str, fuzzy: bool = True) -> str:
     if parsed not in VALID_SENTIMENTS:
         if fuzzy:
             parsed = get_best_match(parsed)
+            metrics.inc("openai_fuzzy_matches_total")
         else:
             raise ValueError(f"Unexpected sentiment: {parsed}")
     return parsed
 
 
+def parse_batched_completion(completion: str, first_number: int, n: int) -> list[Optional[str]]:
+    """Parses the numbered sentiments from a batched pipeline completion.
+
+    Labels may be abbreviated as long as the prefix is unambiguous ("neg", "pos", "neu").
+    Anything else - a missing number, an unknown label, or a number which appears twice with
+    different labels - yields None for that item, so that it can be retried on its own.
+
+    Example:
+        >>> parse_batched_completion("6: positive\n7: neg\n9: neutral", 6, 3)
+        ["POSITIVE", "NEGATIVE", None]
+
+    Args:
+        completion (str): The completion, including the leading "6:" of the prompt
+        first_number (int): The number of the first review in the batch
+        n (int): The number of reviews in the batch
+
+    Returns:
+        list[Optional[str]]: The predicted sentiment of each review, or None
+    """
+    labels: dict[int, Optional[str]] = {}
+    for number, word in NUMBERED_LABEL_PATTERN.findall(completion):
+        word = word.upper()
+        matches = [s for s in VALID_SENTIMENTS if s.startswith(word)] if len(word) >= 3 else []
+        label = matches[0] if len(matches) == 1 else None
+        index = int(number) - first_number
+        if index in labels and labels[index] != label:
+            label = None  # contradictory answers
+        labels[index] = label
+    return [labels.get(i) for i in range(n)]
+
+
 class OpenAIPipeline:
     """Base class for OpenAI pipelines."""
 
@@ -44,6 +90,60 @@ class OpenAIPipeline:
     async def __call__(self, *args, **kwargs) -> str:
         raise NotImplementedError
 
+    async def run_chain(self, chain: LLMChain, inputs: list[dict]) -> list[str]:
+        """Runs a chain on many inputs, using cached completions where possible.
+
+        All prompts are looked up in the completion cache at once, and only the misses are
+        sent to OpenAI, through the shared rate-limited scheduler.
+
+        Args:
+            chain (LLMChain): The chain to run
+            inputs (list[dict]): The prompt variables of each request
+
+        Returns:
+            list[str]: The completion of each request
+        """
+        llm = chain.llm
+        settings = {
+            "model_name": llm.model_name,  # type: ignore
+            "temperature": llm.temperature,  # type: ignore
+            "max_tokens": llm.max_tokens,  # type: ignore
+            "version": template_version(chain.prompt.template),  # type: ignore
+        }
+        name = type(self).__name__
+        with metrics.stage(name, "cache_lookup"):
+            prompts = [chain.prompt.format(**kwargs) for kwargs in inputs]
+            keys = [completion_key(prompt=prompt, **settings) for prompt in prompts]
+            completions = completion_cache.get_many(keys)
+
+        misses = {
+            key: (kwargs, prompt)
+            for key, kwargs, prompt in zip(keys, inputs, prompts)
+            if key not in completions
+        }
+        if misses:
+
+            async def request(key: str, kwargs: dict, prompt: str) -> str:
+                completion = await chain.arun(**kwargs)
+                completion_cache.add(key, completion, prompt=prompt, **settings)
+                return completion
+
+            with metrics.stage(name, "count_tokens"):
+                tokenized_prompts = get_encoder().encode_batch(
+                    [prompt for _, prompt in misses.values()], num_threads=os.cpu_count() or 1
+                )
+            tokens = [len(ids) + settings["max_tokens"] for ids in tokenized_prompts]
+            requests = [
+                functools.partial(request, key, kwargs, prompt)
+                for key, (kwargs, prompt) in misses.items()
+            ]
+            try:
+                with metrics.stage(name, "network"):
+                    completions.update(zip(misses, await scheduler.map(requests, tokens)))
+            finally:
+                completion_cache.flush()  # keep whatever finished, even if a request failed
+        return [completions[key] for key in keys]
+
     def truncate_text(self, text: str) -> str:
         """Truncates the text to the maximum number of tokens allowed by the pipeline.
 
@@ -53,19 +153,51 @@ class OpenAIPipeline:
         Returns:
             text (str): The truncated text
         """
-        encoder = "p50k_base"
-        # create a GPT-3 encoder instance
-        enc = tiktoken.get_encoding(encoder)
+        return self.truncate_texts([text])[0]
+
+    def truncate_texts(self, texts: list[str]) -> list[str]:
+        """Truncates many texts to the maximum number of tokens allowed by the pipeline.
 
-        # encode the text using the GPT-3 encoder
-        tokenized_text = enc.encode(text)
+        A token always covers at least one byte, so texts of at most `max_text_tokens` UTF-8
+        bytes are returned as they are without encoding them. The rest are encoded together
+        on multiple threads, and only the texts that are too long are decoded again.
 
-        # truncate the text if it is too long
-        if len(tokenized_text) > self.max_text_tokens:
-            tokenized_text = tokenized_text[: self.max_text_tokens]
+        Args:
+            texts (list[str]): The texts to tokenize
+
+        Returns:
+            list[str]: The truncated texts
+        """
+        with metrics.stage(type(self).__name__, "truncate"):
+            texts = list(texts)
+            # UTF-8 uses at most 4 bytes per character, so this check avoids encoding to bytes
+            candidates = [
+                i
+                for i, text in enumerate(texts)
+                if len(text) * 4 > self.max_text_tokens
+                and len(text.encode("utf-8")) > self.max_text_tokens
+            ]
+            if not candidates:
+                return texts
 
-        # decode the tokenized text
-        return enc.decode(tokenized_text)
+            enc = get_encoder()
+            tokenized_texts = enc.encode_batch(
+                [texts[i] for i in candidates], num_threads=os.cpu_count() or 1
+            )
+            truncated = 0
+            for i, tokenized_text in zip(candidates, tokenized_texts):
+                if len(tokenized_text) > self.max_text_tokens:
+                    texts[i] = enc.decode(tokenized_text[: self.max_text_tokens])
+                    truncated += 1
+        metrics.inc("truncated_texts_total", truncated, pipeline=type(self).__name__)
+        return texts
+
+    def truncate_pairs(self, title_text_pairs: list[tuple[str, str]]) -> list[tuple[str, str]]:
+        """Truncates the texts of (title, text) pairs, see `truncate_texts`."""
+        title_text_pairs = list(title_text_pairs)
+        titles = [title for title, _ in title_text_pairs]
+        texts = self.truncate_texts([text for _, text in title_text_pairs])
+        return list(zip(titles, texts))
 
 
 class ZeroShotPipeline(OpenAIPipeline):
@@ -74,10 +206,11 @@ class ZeroShotPipeline(OpenAIPipeline):
     expects_titles = False
 
     async def __call__(self, texts: list[str]) -> list[str]:
-        texts = [self.truncate_text(text) for text in texts]  # preprocess
-        tasks = [zero_shot_chain.arun(text=text) for text in texts]
-        completions = await asyncio.gather(*tasks)  # run in parallel
-        return [parse_completion(completion) for completion in completions]  # postprocess
+        texts = self.truncate_texts(texts)  # preprocess
+        inputs = [{"text": text} for text in texts]
+        completions = await self.run_chain(zero_shot_chain, inputs)  # run in parallel
+        with metrics.stage(type(self).__name__, "parse"):  # postprocess
+            return [parse_completion(completion) for completion in completions]
 
 
 class ZeroShotPipelineWithTitle(OpenAIPipeline):
@@ -86,13 +219,13 @@ class ZeroShotPipelineWithTitle(OpenAIPipeline):
     expects_titles = True
 
     async def __call__(self, title_text_pairs: list[tuple[str, str]]) -> list[str]:
-        title_text_pairs = [(title, self.truncate_text(text)) for title, text in title_text_pairs]
-        tasks = [
-            zero_shot_chain_with_title.arun(title=title, text=text)
-            for title, text in title_text_pairs
-        ]
-        completions = await asyncio.gather(*tasks)
-        return [parse_completion(completion) for completion in completions]
+        title_text_pairs = self.truncate_pairs(title_text_pairs)
+        completions = await self.run_chain(
+            zero_shot_chain_with_title,
+            [{"title": title, "text": text} for title, text in title_text_pairs],
+        )
+        with metrics.stage(type(self).__name__, "parse"):
+            return [parse_completion(completion) for completion in completions]
 
 
 class FewShotPipeline(OpenAIPipeline):
@@ -101,7 +234,135 @@ class FewShotPipeline(OpenAIPipeline):
     expects_titles = True
 
     async def __call__(self, title_text_pairs: list[tuple[str, str]]) -> list[str]:
-        title_text_pairs = [(title, self.truncate_text(text)) for title, text in title_text_pairs]
-        tasks = [few_shot_chain.arun(title=title, text=text) for title, text in title_text_pairs]
-        completions = await asyncio.gather(*tasks)
-        return [parse_completion(completion) for completion in completions]
+        title_text_pairs = self.truncate_pairs(title_text_pairs)
+        completions = await self.run_chain(
+            few_shot_chain, [{"title": title, "text": text} for title, text in title_text_pairs]
+        )
+        with metrics.stage(type(self).__name__, "parse"):
+            return [parse_completion(completion) for completion in completions]
+
+
+class BatchedPipeline(OpenAIPipeline):
+    """Base class for pipelines which classify several reviews per prompt.
+
+    Reviews are packed into prompts of at most `batch_size` reviews and `max_prompt_tokens`
+    tokens, numbered from `first_number`, so the instructions (and examples) are sent once
+    per batch instead of once per review. Reviews whose label is missing from the completion
+    fall back to the single-review `fallback` pipeline.
+    """
+
+    batch_size = OPENAI_BATCH_SIZE
+    max_prompt_tokens = OPENAI_BATCH_MAX_PROMPT_TOKENS
+    first_number = 1
+    chain: LLMChain
+    fallback: type[OpenAIPipeline]
+
+    def format_review(self, number: int, item) -> str:
+        """Formats one (already truncated) review as a numbered entry of the prompt"""
+        raise NotImplementedError
+
+    def pack(self, reviews: list[str]) -> list[list[int]]:
+        """Greedily pack formatted reviews into batches under the size and token budgets
+
+        Args:
+            reviews (list[str]): Reviews formatted with `format_review`
+
+        Returns:
+            list[list[int]]: Batches of review indices
+        """
+        enc = get_encoder()
+        template = self.chain.prompt.template  # type: ignore
+        budget = self.max_prompt_tokens - len(enc.encode(template))
+        batches, batch, batch_tokens = [], [], 0
+        for i, review in enumerate(reviews):
+            # numbers in the final prompt differ from the ones used to count, by a token at most
+            tokens = len(enc.encode(review)) + 1
+            if batch and (len(batch) == self.batch_size or batch_tokens + tokens > budget):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def classify(self, items: list) -> list[str]:
+        """Classifies truncated reviews in batches, retrying unclear ones one by one
+
+        Args:
+            items (list): The truncated reviews, in the format taken by `format_review`
+
+        Returns:
+            list[str]: The predicted sentiment of each review
+        """
+        name = type(self).__name__
+        with metrics.stage(name, "pack"):
+            batches = self.pack([self.format_review(self.first_number, item) for item in items])
+        for batch in batches:
+            metrics.observe("pipeline_batch_size", len(batch), SIZE_BUCKETS, pipeline=name)
+        inputs = [
+            {
+                "reviews": "".join(
+                    self.format_review(self.first_number + position, items[i])
+                    for position, i in enumerate(batch)
+                )
+            }
+            for batch in batches
+        ]
+        completions = await self.run_chain(self.chain, inputs)
+
+        labels: list[Optional[str]] = [None] * len(items)
+        with metrics.stage(name, "parse"):
+            for batch, completion in zip(batches, completions):
+                parsed = parse_batched_completion(
+                    f"{self.first_number}:{completion}", self.first_number, len(batch)
+                )
+                for i, label in zip(batch, parsed):
+                    labels[i] = label
+
+        missing = [i for i, label in enumerate(labels) if label is None]
+        if missing:
+            print(f"Retrying {len(missing)} reviews without a clear label one by one...")
+            metrics.inc("openai_retried_reviews_total", len(missing))
+            retried = await self.fallback()([items[i] for i in missing])
+            for i, label in zip(missing, retried):
+                labels[i] = label
+        return labels  # type: ignore
+
+
+class BatchedZeroShotPipeline(BatchedPipeline):
+    """Zero-shot sentiment analysis pipeline which classifies several reviews per prompt.
+
+    Reviews with a missing or unclear label are retried through `ZeroShotPipeline`.
+    """
+
+    expects_titles = False
+    chain = batched_zero_shot_chain
+    fallback = ZeroShotPipeline
+
+    def format_review(self, number: int, item: str) -> str:
+        return batched_zero_shot_review_template.format(number=number, text=item)
+
+    async def __call__(self, texts: list[str]) -> list[str]:
+        return await self.classify(self.truncate_texts(texts))
+
+
+class BatchedFewShotPipeline(BatchedPipeline):
+    """Few-shot sentiment analysis pipeline which classifies several reviews per prompt.
+
+    The reviews are numbered after the five examples, so the examples are sent once per batch
+    instead of once per review. Reviews with a missing or unclear label are retried through
+    `FewShotPipeline`.
+    """
+
+    expects_titles = True
+    chain = batched_few_shot_chain
+    fallback = FewShotPipeline
+    first_number = 6  # the examples are numbered 1 to 5
+
+    def format_review(self, number: int, item: tuple[str, str]) -> str:
+        title, text = item
+        return batched_review_template.format(number=number, title=title, text=text)
+
+    async def __call__(self, title_text_pairs: list[tuple[str, str]]) -> list[str]:
+        return await self.classify(self.truncate_pairs(title_text_pairs))
@@ -4,8 +4,16 @@
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
 
-from .templates import few_shot_template, zero_shot_template, zero_shot_template_with_title
-from .utils import llm
+from src.config import LEGACY_OPENAI_CACHE_PATH
+
+from .templates import (
+    batched_few_shot_template,
+    batched_zero_shot_template,
+    few_shot_template,
+    zero_shot_template,
+    zero_shot_template_with_title,
+)
+from .utils import batch_llm, completion_cache, llm
 
 zero_shot_chain = LLMChain(
     llm=llm,
@@ -30,3 +38,33 @@ few_shot_chain = LLMChain(
         input_variables=["title", "text"],
     ),
 )
+
+batched_few_shot_chain = LLMChain(
+    llm=batch_llm,
+    prompt=PromptTemplate(
+        template=batched_few_shot_template,
+        input_variables=["reviews"],
+    ),
+)
+
+batched_zero_shot_chain = LLMChain(
+    llm=batch_llm,
+    prompt=PromptTemplate(
+        template=batched_zero_shot_template,
+        input_variables=["reviews"],
+    ),
+)
+
+# Seed a new completion cache with the responses cached by langchain in earlier runs
+if len(completion_cache) == 0 and LEGACY_OPENAI_CACHE_PATH.exists():
+    n_imported = completion_cache.import_langchain_cache(
+        LEGACY_OPENAI_CACHE_PATH,
+        [
+            zero_shot_chain,
+            zero_shot_chain_with_title,
+            few_shot_chain,
+            batched_few_shot_chain,
+            batched_zero_shot_chain,
+        ],
+    )
+    print(f"Imported {n_imported} completions from {LEGACY_OPENAI_CACHE_PATH}")
@@ -0,0 +1,153 @@
+"""Rate-limit-aware scheduling of concurrent OpenAI requests.
+
+Every request first takes one token from a requests/min bucket and its estimated token
+count from a tokens/min bucket, then runs under a bounded in-flight semaphore. Rate limit
+(429) and server (5xx) errors are retried with exponential backoff and jitter.
+
+To exercise the scheduler without the real API, point the `openai` client at a local fake
+server (see `scripts/fake_openai_server.py`) with `OPENAI_API_BASE=http://127.0.0.1:8081/v1`.
+"""
+
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import openai
+
+T = TypeVar("T")
+
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failed request is worth retrying (rate limited, 5xx or connection errors)"""
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    status = getattr(error, "http_status", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `per_minute` tokens per minute."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float) -> None:
+        """Wait until `amount` tokens are available and take them"""
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:  # no await between check and take, so this is atomic
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class OpenAIScheduler:
+    """Runs OpenAI requests within request/token rate limits and an in-flight bound."""
+
+    def __init__(
+        self,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        max_in_flight: int,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = {"requests": 0, "failures": 0, "retries": 0, "tokens": 0}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # asyncio primitives are bound to one event loop, and each `asyncio.run` makes a new one
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore, self._loop = asyncio.Semaphore(self.max_in_flight), loop
+        return self._semaphore
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def run(self, make_request: Callable[[], Awaitable[T]], tokens: int) -> T:
+        """Run one request within the limits, retrying transient errors
+
+        Args:
+            make_request (Callable): Creates the request coroutine (called again on retry)
+            tokens (int): Estimated prompt + completion tokens of the request
+
+        Returns:
+            The result of the request
+        """
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self.request_bucket.acquire(1)
+                await self.token_bucket.acquire(tokens)
+                try:
+                    result = await make_request()
+                except Exception as e:
+                    if not is_retryable(e) or attempt == self.max_retries:
+                        self.metrics["failures"] += 1
+                        raise
+                    self.metrics["retries"] += 1
+                    await asyncio.sleep(self.backoff(attempt))
+                else:
+                    self.metrics["requests"] += 1
+                    self.metrics["tokens"] += tokens
+                    return result
+        raise AssertionError("unreachable")
+
+    async def map(
+        self, make_requests: list[Callable[[], Awaitable[T]]], tokens: list[int]
+    ) -> list[T]:
+        """Run many requests concurrently within the limits, reporting progress
+
+        Args:
+            make_requests (list[Callable]): Request factories (see `OpenAIScheduler.run`)
+            tokens (list[int]): Estimated tokens of each request
+
+        Returns:
+            list: The results, in the order of the requests
+        """
+        n, done = len(make_requests), 0
+        start_time = last_report = time.monotonic()
+
+        async def tracked(make_request, n_tokens):
+            nonlocal done, last_report
+            result = await self.run(make_request, n_tokens)
+            done += 1
+            now = time.monotonic()
+            if n > 1 and (now - last_report > 5 or done == n):
+                last_report = now
+                print(f"OpenAI requests: {done}/{n} done, {done / (now - start_time):.1f} req/s")
+            return result
+
+        return await asyncio.gather(*[tracked(f, t) for f, t in zip(make_requests, tokens)])
+
+    def stats(self) -> dict:
+        """Request, failure, retry and token counts since the scheduler was created"""
+        return dict(self.metrics)
@@ -17,7 +17,7 @@ Review: {text}
 Sentiment:
 """
 
-few_shot_template = """
+few_shot_examples = """
 Classify the following reviews as expressing positive, neutral, or negative sentiment.
 
 Reviews:
@@ -41,15 +41,47 @@ Review #5
 Title: "Secret to getting more hours"
 Text: "Start going to college. With this one simple trick you will watch your scheduled hours jump and still have your ETL calling."
 
-Review #6
-Title: {title}
-Text: {text}
+"""
 
-Sentiments (positive, negative, neutral):
+few_shot_sentiments = """Sentiments (positive, negative, neutral):
 1: neutral
 2: positive
 3: negative
 4: negative
 5: neutral
-6:
 """
+
+few_shot_template = (
+    few_shot_examples
+    + """Review #6
+Title: {title}
+Text: {text}
+
+"""
+    + few_shot_sentiments
+    + """6:
+"""
+)
+
+# Several reviews per prompt, numbered from 6 onwards, so the examples are only sent once.
+# The prompt ends in "6:" so that the completion continues the numbered list.
+batched_review_template = """Review #{number}
+Title: {title}
+Text: {text}
+
+"""
+
+batched_few_shot_template = few_shot_examples + "{reviews}" + few_shot_sentiments + "6:"
+
+# Several reviews per zero-shot prompt, numbered from 1, in the same numbered output format.
+batched_zero_shot_review_template = """Review #{number}
+Text: {text}
+
+"""
+
+batched_zero_shot_template = """
+Decide whether each of the following product reviews' sentiment is positive, neutral, or negative. Output the sentiment of each review as a single word after its number.
+
+Reviews:
+{reviews}Sentiments (positive, negative, neutral):
+1:"""
@@ -1,15 +1,33 @@
 """Shared OpenAI resources such as the LLM object and util funcs."""
 
 
-import langchain
-from langchain.cache import SQLiteCache
+import functools
+
+import tiktoken
 from langchain.llms import OpenAI
 from thefuzz import process
 
-from src.config import OPENAI_MODEL_NAME, VALID_SENTIMENTS
+from src.config import (
+    OPENAI_BATCH_SIZE,
+    OPENAI_CACHE_MAX_AGE_DAYS,
+    OPENAI_CACHE_MAX_ENTRIES,
+    OPENAI_CACHE_PATH,
+    OPENAI_MAX_IN_FLIGHT,
+    OPENAI_MODEL_NAME,
+    OPENAI_REQUESTS_PER_MINUTE,
+    OPENAI_TOKENS_PER_MINUTE,
+    VALID_SENTIMENTS,
+)
+
+from .cache import CompletionCache
+from .scheduler import OpenAIScheduler
 
-# Enable caching of LLM responses
-langchain.llm_cache = SQLiteCache(database_path=".openai.db")
+# Enable caching of LLM responses (looked up in bulk by the pipelines, see `run_chain`)
+completion_cache = CompletionCache(
+    OPENAI_CACHE_PATH,
+    max_entries=OPENAI_CACHE_MAX_ENTRIES,
+    max_age_days=OPENAI_CACHE_MAX_AGE_DAYS,
+)
 
 
 llm = OpenAI(
@@ -18,6 +36,32 @@ llm = OpenAI(
     temperature=0,  # deterministic
 )  # type: ignore
 
+batch_llm = OpenAI(
+    model_name=OPENAI_MODEL_NAME,
+    max_tokens=5 * OPENAI_BATCH_SIZE,  # "\n7: negative" per review
+    temperature=0,
+)  # type: ignore
+
+# Shared by all pipelines, so that the rate limits hold across concurrent pipeline calls
+scheduler = OpenAIScheduler(
+    requests_per_minute=OPENAI_REQUESTS_PER_MINUTE,
+    tokens_per_minute=OPENAI_TOKENS_PER_MINUTE,
+    max_in_flight=OPENAI_MAX_IN_FLIGHT,
+)
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoder(encoding_name: str = "p50k_base") -> tiktoken.Encoding:
+    """Returns the (process-wide cached) tiktoken encoder used by GPT-3 models
+
+    Args:
+        encoding_name (str, optional): The tiktoken encoding. Defaults to "p50k_base".
+
+    Returns:
+        tiktoken.Encoding: The encoder
+    """
+    return tiktoken.get_encoding(encoding_name)
+
 
 def get_best_match(completion: str) -> str:
     """Returns the best match for the completion
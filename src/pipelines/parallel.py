@@ -0,0 +1,219 @@
+"""Runs CPU-bound pipelines in worker processes, each pinned to its own CPU cores.
+
+A worker builds its pipeline by name instead of receiving it from the parent, so models are
+loaded once, in the process that uses them. Before loading, the worker restricts itself to a
+disjoint set of cores and sizes its thread pools to match, so that models running side by
+side do not oversubscribe the CPU. Timings are taken inside the worker, around the pipeline
+call only, with the pipeline's caches disabled.
+"""
+
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+
+_pinned_cores: Optional[list[int]] = None  # set by `pin_to_cores`
+
+
+def available_cores() -> list[int]:
+    """The CPU cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cores(n_workers: int, cores: Optional[list[int]] = None) -> list[list[int]]:
+    """Split the cores into one disjoint set per worker, as evenly as possible
+
+    With fewer cores than workers, each worker gets a single core, shared round-robin (with
+    a warning, since the workers then compete for those cores).
+
+    Args:
+        n_workers (int): Number of workers
+        cores (list[int], optional): Cores to split. Defaults to the available cores.
+
+    Returns:
+        list[list[int]]: The cores of each worker
+    """
+    cores = cores or available_cores()
+    if n_workers > len(cores):
+        print(f"Warning: {n_workers} workers share {len(cores)} cores, some run on the same core")
+    if n_workers >= len(cores):
+        return [[cores[i % len(cores)]] for i in range(n_workers)]
+    size, extra = divmod(len(cores), n_workers)
+    core_sets, start = [], 0
+    for i in range(n_workers):
+        end = start + size + (i < extra)
+        core_sets.append(cores[start:end])
+        start = end
+    return core_sets
+
+
+def pin_to_cores(cores: list[int]) -> None:
+    """Restrict the current process to the given cores, with one compute thread per core
+
+    The thread pools are sized through torch (and `pinned_threads` for ONNX Runtime) rather
+    than OMP_NUM_THREADS and the like, which are only read when torch is first imported: a
+    spawned worker re-imports the parent's main module, which may import torch, before this
+    initializer runs.
+    """
+    global _pinned_cores
+
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"  # read on use, not on import
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    _pinned_cores = list(cores)
+
+    import torch
+
+    torch.set_num_threads(len(cores))
+    with contextlib.suppress(RuntimeError):  # only allowed before any inter-op work
+        torch.set_num_interop_threads(len(cores))
+
+
+def pinned_threads() -> int:
+    """Threads per compute pool: the process's cores if pinned by `pin_to_cores`, else 0"""
+    return len(_pinned_cores) if _pinned_cores is not None else 0
+
+
+def tune_num_threads(run: Callable[[int], object], max_threads: int, repeats: int = 2) -> int:
+    """Pick the torch thread count at which `run` is fastest, and keep it
+
+    Candidates are the powers of two up to `max_threads`, and `max_threads` itself. One
+    thread per core is not always best: small batches spend more on synchronising threads
+    than they gain, and hyper-threads share execution units. `run` is called once to warm
+    up, then `repeats` times per candidate.
+
+    Args:
+        run (Callable[[int], object]): A representative unit of work, called with the
+            number of the call. Each call should process other inputs (e.g. another slice of
+            a batch), since the embedding and token caches would flatter repeated ones.
+        max_threads (int): Most threads to try, usually the worker's number of cores
+        repeats (int, optional): Timed runs per candidate. Defaults to 2.
+
+    Returns:
+        int: The chosen number of threads
+    """
+    import torch
+
+    candidates = tune_candidates(max_threads)
+    run(0)
+    timings, call = {}, 1
+    for n_threads in candidates:
+        torch.set_num_threads(n_threads)
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            run(call)
+            call += 1
+        timings[n_threads] = time.perf_counter() - start_time
+    best = min(timings, key=timings.__getitem__)
+    torch.set_num_threads(best)
+    return best
+
+
+def tune_candidates(max_threads: int) -> list[int]:
+    """Thread counts tried by `tune_num_threads`"""
+    return sorted({2**i for i in range(max_threads.bit_length())} | {max_threads})
+
+
+def iter_stages(pipeline):
+    """The pipeline and every pipeline or encoder it wraps (dedup and cascade stages, ...)"""
+    stack, seen = [pipeline], set()
+    while stack:
+        stage = stack.pop()
+        if id(stage) in seen:
+            continue
+        seen.add(id(stage))
+        yield stage
+        attributes = getattr(stage, "__dict__", {})
+        stack += [
+            attributes[name]
+            for name in ("pipeline", "first", "fallback", "encoder")
+            if name in attributes
+        ]
+
+
+def disable_caches(pipeline) -> None:
+    """Disable every cache the pipeline reaches, so that the models are measured
+
+    Persistent caches are shared by every process, so with them a pipeline would get the
+    hits of whichever pipeline encoded the same texts first.
+    """
+    for stage in iter_stages(pipeline):
+        attributes = getattr(stage, "__dict__", {})
+        if attributes.get("cache") is not None:
+            stage.cache = None  # SetFit embedding cache
+        if attributes.get("results") is not None:
+            stage.results = None  # predictions shared by deduplication stages
+        token_cache = attributes.get("token_cache")
+        if token_cache is not None:  # HF and ONNX token ids: tokenize on every call
+            from src.pipelines.transformers.tokens import TokenCache  # imports pyarrow
+
+            stage.token_cache = TokenCache(
+                token_cache.tokenizer, token_cache.max_length, capacity=0
+            )
+
+
+def score_pipeline(
+    category: str,
+    name: str,
+    texts: list[str],
+    titles: Optional[list[str]] = None,
+    profile: bool = False,
+) -> dict:
+    """Load a pipeline by name and run it on the texts (the body of a worker process)
+
+    Its caches are disabled (see `disable_caches`), so that concurrent workers encoding the
+    same texts do not time each other's cache hits.
+
+    Args:
+        profile (bool, optional): Profile the run (see `src.metrics.profile`). Defaults to
+            False.
+
+    Returns:
+        dict: The predictions ("preds"), the inference time ("time") and load time
+            ("load_time") in seconds, the pipeline's description ("pipeline"), the worker's
+            cores ("cores"), its peak RSS in MB ("peak_rss_mb") and a snapshot of its
+            stage timers and counters ("metrics")
+    """
+    from src.metrics import metrics
+    from src.metrics import profile as profile_block
+    from src.pipelines import get_pipeline, run_pipeline
+
+    start_time = time.perf_counter()
+    pipeline = get_pipeline(category, name)
+    load_time = time.perf_counter() - start_time
+    disable_caches(pipeline)
+
+    start_time = time.perf_counter()
+    with profile_block(f"{category}_{name}") if profile else contextlib.nullcontext():
+        preds = asyncio.run(run_pipeline(pipeline, texts, titles))
+    time_taken = time.perf_counter() - start_time
+
+    return {
+        "preds": preds,
+        "time": time_taken,
+        "load_time": load_time,
+        "pipeline": str(pipeline),
+        "cores": available_cores(),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "metrics": metrics.snapshot(),
+    }
+
+
+def pinned_executor(cores: list[int]) -> ProcessPoolExecutor:
+    """A single-process executor pinned to the given cores
+
+    Uses the "spawn" start method, since forking a process with live torch thread pools
+    can deadlock.
+    """
+    return ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=pin_to_cores,
+        initargs=(cores,),
+    )
@@ -1,30 +1,76 @@
 """SetFit pipeline"""
 
 
-from typing import Callable
+from typing import TYPE_CHECKING, Callable, Optional
 
-from src.config import LABEL_MAPPING
+import numpy as np
 
-from .loading import load_setfit_model
+from src.config import (
+    EMBEDDING_CACHE_CAPACITY,
+    EMBEDDING_CACHE_DIR,
+    LABEL_MAPPING,
+    USE_EMBEDDING_CACHE,
+)
+from src.metrics import metrics
 
+from .embedding_cache import EmbeddingCache
+from .loading import get_setfit_body_version, load_setfit_model
 
-def get_setfit_pipeline() -> dict[str, Callable]:
-    """Get the SetFit pipeline
+if TYPE_CHECKING:
+    from setfit import SetFitModel
 
-    Args:
-        model (SetFitModel): SetFit model
 
-    Returns:
-        Callable: SetFit pipeline
+class SetFitPipeline:
+    """SetFit pipeline as a callable, with an optional persistent embedding cache.
+
+    Texts whose embedding is cached skip the sentence-transformer body entirely; only the
+    remaining texts are encoded, and all embeddings go through the classification head.
     """
-    try:
-        model = load_setfit_model()
-    except FileNotFoundError:
-        raise FileNotFoundError(
-            "SetFit model not found. Please run `python scripts/train_setfit.py` to train the model."
-        )
 
-    def setfit_pipeline(texts: list[str]) -> list[str]:
+    def __init__(self, model: "SetFitModel", cache: Optional[EmbeddingCache] = None):
+        self.model = model
+        self.cache = cache
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        with metrics.stage("setfit", "embed"):  # tokenization and forward pass of the body
+            return self.model.model_body.encode(
+                texts,
+                normalize_embeddings=getattr(self.model, "normalize_embeddings", False),
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Sentence embeddings of shape (len(texts), dim), read from the cache where possible
+
+        Args:
+            texts (list[str]): list of texts
+
+        Returns:
+            np.ndarray: The embeddings
+        """
+        texts = list(texts)
+        if self.cache is None:
+            return self._encode(texts)
+
+        with metrics.stage("setfit", "cache_lookup"):
+            keys = self.cache.keys(texts)
+            cached = self.cache.get_many(keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        if missing:
+            # store as float16 first, so predictions don't depend on whether a text was cached
+            embeddings = self._encode(list(missing.values())).astype(np.float16)
+            self.cache.put_many(list(missing), embeddings)
+            cached.update(zip(missing, embeddings))
+        return np.stack([cached[key] for key in keys]).astype(np.float32)
+
+    def predict_proba(self, texts: list[str]) -> np.ndarray:
+        """Class probabilities of shape (len(texts), len(LABEL_MAPPING))"""
+        embeddings = self.encode(texts)
+        with metrics.stage("setfit", "head"):
+            return self.model.model_head.predict_proba(embeddings)
+
+    def __call__(self, texts: list[str]) -> list[str]:
         """SetFit pipeline as a callable function
 
         Args:
@@ -33,8 +79,39 @@ def get_setfit_pipeline() -> dict[str, Callable]:
         Returns:
             list[str]: list of labels
         """
-        preds = model.predict(texts)
-        # preds is a tensor of shape (len(texts), 1)
-        return [LABEL_MAPPING[pred.item()] for pred in preds]  # type: ignore
+        texts = list(texts)
+        if not texts:
+            return []
+        embeddings = self.encode(texts)
+        with metrics.stage("setfit", "head"):
+            preds = self.model.model_head.predict(embeddings)
+        return [LABEL_MAPPING[int(pred)] for pred in preds]
+
+
+def get_setfit_pipeline(names: Optional[list[str]] = None) -> dict[str, Callable]:
+    """Get the SetFit pipeline
+
+    Args:
+        names (list[str], optional): Only load these pipelines. Defaults to None (all).
+
+    Returns:
+        dict: {"setfit": SetFit pipeline}
+    """
+    if names is not None and "setfit" not in names:
+        return {}
+    try:
+        model = load_setfit_model()
+    except FileNotFoundError:
+        raise FileNotFoundError(
+            "SetFit model not found. Please run `python scripts/train_setfit.py` to train the model."
+        )
 
-    return {"setfit": setfit_pipeline}
+    cache = None
+    if USE_EMBEDDING_CACHE:
+        cache = EmbeddingCache(
+            EMBEDDING_CACHE_DIR,
+            model_version=get_setfit_body_version(),
+            dim=model.model_body.get_sentence_embedding_dimension(),
+            capacity=EMBEDDING_CACHE_CAPACITY,
+        )
+    return {"setfit": SetFitPipeline(model, cache)}
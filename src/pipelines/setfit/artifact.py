@@ -0,0 +1,411 @@
+"""Versioned, memory-mappable SetFit model artifacts, replacing the pickled `SetFitModel`.
+
+An artifact is a directory:
+
+    manifest.json       format and model versions, settings and the sha256 of every file
+    body/               config and tokenizer files of the transformer (no weights)
+    body.safetensors    transformer weights
+    head.safetensors    classification head (see `LinearHead.to_arrays`)
+
+Weights use the safetensors layout (a little-endian u64 header size, a JSON header, then the
+raw tensor bytes) and are mapped into memory copy-on-write rather than read, so every worker
+process which loads the same artifact shares the same physical weight pages. Nothing is
+unpickled, so loading an artifact cannot run code.
+
+The manifest's "body_version" only covers the body, so artifacts which differ in their head
+alone (see `save_head_artifact`) share cached embeddings.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import struct
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+from src.config import HF_MAX_BATCH_TOKENS, LABEL_MAPPING
+from src.pipelines.transformers.batching import make_buckets
+
+from .head import LinearHead
+
+if TYPE_CHECKING:
+    from setfit import SetFitModel
+
+ARTIFACT_FORMAT = "setfit-artifact"
+ARTIFACT_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+BODY_DIR_NAME = "body"
+BODY_WEIGHTS_NAME = "body.safetensors"
+HEAD_WEIGHTS_NAME = "head.safetensors"
+
+SAFETENSORS_DTYPES = {
+    "F64": np.float64,
+    "F32": np.float32,
+    "F16": np.float16,
+    "I64": np.int64,
+    "I32": np.int32,
+    "I16": np.int16,
+    "I8": np.int8,
+    "U8": np.uint8,
+    "BOOL": np.bool_,
+}
+
+
+def save_safetensors(
+    arrays: dict[str, np.ndarray], path: os.PathLike, metadata: Optional[dict] = None
+) -> None:
+    """Write arrays to a safetensors file
+
+    Args:
+        arrays (dict[str, np.ndarray]): Arrays by name
+        path (os.PathLike): Output path
+        metadata (dict, optional): String key-value pairs stored in the header
+    """
+    codes = {np.dtype(dtype): code for code, dtype in SAFETENSORS_DTYPES.items()}
+    header, chunks, offset = {}, [], 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        array = array.astype(array.dtype.newbyteorder("<"), copy=False)
+        if array.dtype not in codes:
+            raise ValueError(f"Unsupported dtype for {name}: {array.dtype}")
+        header[name] = {
+            "dtype": codes[array.dtype],
+            "shape": list(array.shape),
+            "data_offsets": [offset, offset + array.nbytes],
+        }
+        chunks.append(array.tobytes())
+        offset += array.nbytes
+    if metadata:
+        header["__metadata__"] = {key: str(value) for key, value in metadata.items()}
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    header_bytes += b" " * (-len(header_bytes) % 8)  # keep the tensor data 8-byte aligned
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for chunk in chunks:
+            f.write(chunk)
+
+
+def load_safetensors(path: os.PathLike, mmap: bool = True) -> dict[str, np.ndarray]:
+    """Read the arrays of a safetensors file
+
+    Args:
+        path (os.PathLike): Path to the file
+        mmap (bool, optional): Map the file copy-on-write instead of reading it, so that
+            processes share its pages until they write to them. Defaults to True.
+
+    Returns:
+        dict[str, np.ndarray]: Arrays by name
+    """
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    if not header:
+        return {}
+
+    data_offset = 8 + header_size
+    if mmap:
+        data = np.memmap(path, dtype=np.uint8, mode="c", offset=data_offset)
+    else:
+        data = np.fromfile(path, dtype=np.uint8, offset=data_offset)
+    arrays = {}
+    for name, info in header.items():
+        start, end = info["data_offsets"]
+        dtype = np.dtype(SAFETENSORS_DTYPES[info["dtype"]]).newbyteorder("<")
+        arrays[name] = data[start:end].view(dtype).reshape(info["shape"])
+    return arrays
+
+
+def file_sha256(path: os.PathLike) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def save_setfit_artifact(
+    model: "SetFitModel", output_dir: Path, name: str, extra: Optional[dict] = None
+) -> Path:
+    """Save a trained SetFit model as an artifact
+
+    The artifact is written next to `output_dir` first and moved into place once complete.
+
+    Args:
+        model (SetFitModel): Trained SetFit model
+        output_dir (Path): Artifact directory to create
+        name (str): Model name, e.g. "setfit_2023-02-12"; the version adds a content hash
+        extra (dict, optional): Additional manifest entries, e.g. evaluation metrics
+
+    Returns:
+        Path: The artifact directory
+    """
+    from sentence_transformers.models import Normalize, Pooling
+
+    body = model.model_body
+    transformer = body[0].auto_model
+    pooling = next(module for module in body if isinstance(module, Pooling))
+    if pooling.get_pooling_mode_str() not in ("mean", "cls"):
+        raise ValueError(f"Unsupported pooling mode: {pooling.get_pooling_mode_str()}")
+
+    tmp_dir = output_dir.with_name(output_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    (tmp_dir / BODY_DIR_NAME).mkdir(parents=True)
+    transformer.config.save_pretrained(tmp_dir / BODY_DIR_NAME)
+    body.tokenizer.save_pretrained(tmp_dir / BODY_DIR_NAME)
+    save_safetensors(
+        {key: value.detach().cpu().numpy() for key, value in transformer.state_dict().items()},
+        tmp_dir / BODY_WEIGHTS_NAME,
+    )
+    save_safetensors(
+        LinearHead.from_sklearn(model.model_head).to_arrays(), tmp_dir / HEAD_WEIGHTS_NAME
+    )
+    body_config = {
+        "pooling": pooling.get_pooling_mode_str(),
+        "normalize": any(isinstance(module, Normalize) for module in body),
+        "max_seq_length": body.get_max_seq_length(),
+        "dim": body.get_sentence_embedding_dimension(),
+    }
+    return _finish_artifact(tmp_dir, output_dir, name, body_config, extra)
+
+
+def save_head_artifact(
+    base_dir: Path, head: LinearHead, output_dir: Path, name: str, extra: Optional[dict] = None
+) -> Path:
+    """Save a copy of an artifact with a new head
+
+    The body files are hard-linked from the base artifact where possible, so the new
+    artifact takes no extra disk space and its weight pages are shared with the base.
+
+    Args:
+        base_dir (Path): The artifact whose body to reuse
+        head (LinearHead): The new head
+        output_dir (Path): Artifact directory to create
+        name (str): Model name; the version adds a content hash
+        extra (dict, optional): Additional manifest entries
+
+    Returns:
+        Path: The artifact directory
+    """
+    base_dir = Path(os.path.realpath(base_dir))
+    base_manifest = read_manifest(base_dir)
+    tmp_dir = output_dir.with_name(output_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    for file_name in base_manifest["files"]:
+        if file_name == HEAD_WEIGHTS_NAME:
+            continue
+        (tmp_dir / file_name).parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(base_dir / file_name, tmp_dir / file_name)
+        except OSError:  # e.g. across file systems
+            shutil.copy2(base_dir / file_name, tmp_dir / file_name)
+    save_safetensors(head.to_arrays(), tmp_dir / HEAD_WEIGHTS_NAME)
+    extra = {"parent": base_manifest["version"], **(extra or {})}
+    return _finish_artifact(tmp_dir, output_dir, name, base_manifest["body"], extra)
+
+
+def _finish_artifact(
+    tmp_dir: Path, output_dir: Path, name: str, body_config: dict, extra: Optional[dict]
+) -> Path:
+    """Write the manifest of a complete artifact and move it into place"""
+    files = {
+        path.relative_to(tmp_dir).as_posix(): file_sha256(path)
+        for path in sorted(tmp_dir.rglob("*"))
+        if path.is_file()
+    }
+    body_files = {key: value for key, value in files.items() if key != HEAD_WEIGHTS_NAME}
+    content_hash = hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()
+    body_hash = hashlib.sha256(json.dumps(body_files, sort_keys=True).encode()).hexdigest()
+    manifest = {
+        "format": ARTIFACT_FORMAT,
+        "format_version": ARTIFACT_FORMAT_VERSION,
+        "version": f"{name}-{content_hash[:12]}",
+        "body_version": f"body-{body_hash[:12]}",
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "body": body_config,
+        "labels": {str(key): value for key, value in LABEL_MAPPING.items()},
+        "files": files,
+        **(extra or {}),
+    }
+    with open(tmp_dir / MANIFEST_NAME, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(tmp_dir, output_dir)
+    return output_dir
+
+
+def update_symlink(link: Path, target: Path) -> None:
+    """Point a symlink at a new target, replacing any previous link atomically"""
+    tmp_link = link.with_name(link.name + ".tmp")
+    if tmp_link.is_symlink():
+        tmp_link.unlink()
+    os.symlink(target, tmp_link)
+    os.replace(tmp_link, link)
+
+
+def read_manifest(artifact_dir: Path) -> dict:
+    """Read and check the manifest of an artifact
+
+    Raises:
+        ValueError: If the directory holds no artifact of a supported format version
+    """
+    with open(artifact_dir / MANIFEST_NAME) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != ARTIFACT_FORMAT:
+        raise ValueError(f"{artifact_dir} is not a SetFit artifact")
+    if manifest.get("format_version", 0) > ARTIFACT_FORMAT_VERSION:
+        raise ValueError(
+            f"{artifact_dir} has format version {manifest['format_version']}, but only "
+            f"versions up to {ARTIFACT_FORMAT_VERSION} are supported"
+        )
+    return manifest
+
+
+def verify_artifact(artifact_dir: Path) -> None:
+    """Check every file of an artifact against the hashes in its manifest
+
+    Raises:
+        ValueError: If a file is missing or modified
+    """
+    for name, sha256 in read_manifest(artifact_dir)["files"].items():
+        path = artifact_dir / name
+        if not path.exists() or file_sha256(path) != sha256:
+            raise ValueError(f"{path} is missing or does not match the manifest")
+
+
+class MappedSentenceEncoder:
+    """The sentence-transformer body of an artifact (transformer, pooling and normalisation).
+
+    The transformer's parameters are views of the memory-mapped weight file; they are never
+    copied, as long as nothing writes to them (inference only).
+    """
+
+    def __init__(self, artifact_dir: Path, config: dict):
+        import torch
+        from transformers import AutoConfig, AutoModel, AutoTokenizer
+        from transformers.modeling_utils import no_init_weights
+
+        body_dir = artifact_dir / BODY_DIR_NAME
+        self.pooling = config["pooling"]
+        self.normalize = config["normalize"]
+        self.max_seq_length = config["max_seq_length"]
+        self.dim = config["dim"]
+        self.tokenizer = AutoTokenizer.from_pretrained(body_dir)
+        with no_init_weights():
+            self.model = AutoModel.from_config(AutoConfig.from_pretrained(body_dir))
+
+        weights = load_safetensors(artifact_dir / BODY_WEIGHTS_NAME)
+        missing = set(self.model.state_dict()) - set(weights)
+        if missing:
+            raise ValueError(f"{artifact_dir} is missing weights: {sorted(missing)}")
+        for key, array in weights.items():
+            module_name, _, attr = key.rpartition(".")
+            module = self.model.get_submodule(module_name)
+            tensor = torch.from_numpy(array)
+            if attr in module._parameters:
+                module._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+            else:
+                module._buffers[attr] = tensor
+        self.model.eval()
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def get_max_seq_length(self) -> int:
+        return self.max_seq_length
+
+    def encode(
+        self,
+        texts: list[str],
+        batch_size: int = 32,
+        normalize_embeddings: bool = False,
+        convert_to_numpy: bool = True,
+        show_progress_bar: bool = False,
+    ) -> np.ndarray:
+        """Sentence embeddings of shape (len(texts), dim), like `SentenceTransformer.encode`
+
+        Texts run in length-bucketed batches (see `make_buckets`). The `convert_to_numpy`
+        and `show_progress_bar` arguments exist for compatibility and are ignored.
+        """
+        import torch
+
+        texts = list(texts)
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if not texts:
+            return embeddings
+        lengths = [
+            len(ids)
+            for ids in self.tokenizer(texts, truncation=True, max_length=self.max_seq_length)[
+                "input_ids"
+            ]
+        ]
+        with torch.inference_mode():
+            for bucket in make_buckets(lengths, batch_size, HF_MAX_BATCH_TOKENS):
+                inputs = self.tokenizer(
+                    [texts[i] for i in bucket],
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_seq_length,
+                    return_tensors="pt",
+                )
+                hidden_states = self.model(**inputs).last_hidden_state
+                if self.pooling == "cls":
+                    pooled = hidden_states[:, 0]
+                else:  # mean over the non-padding tokens
+                    mask = inputs["attention_mask"].unsqueeze(-1).to(hidden_states.dtype)
+                    pooled = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                if self.normalize or normalize_embeddings:
+                    pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+                embeddings[bucket] = pooled.numpy()
+        return embeddings
+
+
+class MappedSetFitModel:
+    """Inference-only SetFit model loaded from an artifact, with a numpy `LinearHead` head.
+
+    Has the parts of the `SetFitModel` interface which the pipelines use.
+    """
+
+    normalize_embeddings = False  # the body applies the artifact's normalisation itself
+
+    def __init__(self, artifact_dir: Path, verify: bool = False):
+        if verify:
+            verify_artifact(artifact_dir)
+        self.artifact_dir = artifact_dir
+        self.manifest = read_manifest(artifact_dir)
+        self.version = self.manifest["version"]
+        self.body_version = self.manifest.get("body_version", self.version)
+        self.model_body = MappedSentenceEncoder(artifact_dir, self.manifest["body"])
+        self.model_head = LinearHead.from_arrays(
+            load_safetensors(artifact_dir / HEAD_WEIGHTS_NAME, mmap=False)
+        )
+
+    def __repr__(self) -> str:
+        return f"MappedSetFitModel({self.version})"
+
+    def predict(self, texts: list[str]) -> np.ndarray:
+        return self.model_head.predict(self.model_body.encode(texts))
+
+    def predict_proba(self, texts: list[str]) -> np.ndarray:
+        return self.model_head.predict_proba(self.model_body.encode(texts))
+
+
+def load_setfit_artifact(artifact_dir: Path, verify: bool = False) -> MappedSetFitModel:
+    """Load a SetFit artifact
+
+    Args:
+        artifact_dir (Path): The artifact directory (or a symlink to it)
+        verify (bool, optional): Check the file hashes first, which reads every file.
+            Defaults to False.
+
+    Returns:
+        MappedSetFitModel: The model, with memory-mapped weights
+    """
+    return MappedSetFitModel(Path(os.path.realpath(artifact_dir)), verify=verify)
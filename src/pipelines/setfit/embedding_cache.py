@@ -0,0 +1,167 @@
+"""Persistent, size-bounded cache of SetFit sentence embeddings."""
+
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+
+from src.metrics import metrics
+from src.pipelines.text import normalize_text, text_hash
+
+MATRIX_NAME = "embeddings.f16"
+INDEX_NAME = "index.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    slot INTEGER NOT NULL UNIQUE,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache with LRU eviction.
+
+    Embeddings live in a memory-mapped float16 matrix of `capacity` rows; a SQLite index maps
+    the hash of (model version, normalised text) to a row and tracks when it was last used.
+    Once the matrix is full, the least recently used rows are overwritten.
+    """
+
+    def __init__(self, cache_dir: os.PathLike, model_version: str, dim: int, capacity: int):
+        self.cache_dir = Path(cache_dir)
+        self.model_version = model_version
+        self.dim = dim
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.cache_dir / INDEX_NAME)
+        self.conn.executescript(SCHEMA)
+        matrix_path = self.cache_dir / MATRIX_NAME
+        meta = dict(self.conn.execute("SELECT key, value FROM meta").fetchall())
+        if meta != {"dim": str(dim), "capacity": str(capacity)} or not matrix_path.exists():
+            self._reset(matrix_path)
+        self.matrix = np.memmap(matrix_path, dtype=np.float16, mode="r+", shape=(capacity, dim))
+
+    def _reset(self, matrix_path: Path) -> None:
+        """Start from an empty cache with the current shape"""
+        np.memmap(matrix_path, dtype=np.float16, mode="w+", shape=(self.capacity, self.dim)).flush()
+        with self.conn:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.execute("DELETE FROM meta")
+            self.conn.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?)",
+                [("dim", str(self.dim)), ("capacity", str(self.capacity))],
+            )
+
+    def keys(self, texts: list[str]) -> list[str]:
+        """Cache keys of the texts for the current model version"""
+        return [text_hash(normalize_text(text), self.model_version) for text in texts]
+
+    def _slots(self, keys: list[str]) -> dict[str, int]:
+        """Slots of the keys found in the index"""
+        slots = {}
+        for start in range(0, len(keys), 500):  # stay below SQLite's variable limit
+            chunk = keys[start : start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            slots.update(
+                self.conn.execute(
+                    f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+            )
+        return slots
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        """Look up many keys at once and mark the hits as recently used
+
+        Args:
+            keys (list[str]): Cache keys (see `EmbeddingCache.keys`)
+
+        Returns:
+            dict[str, np.ndarray]: float16 embedding per key found in the cache
+        """
+        unique_keys = list(dict.fromkeys(keys))
+        if not unique_keys:
+            return {}
+        # Rows are copied under the same lock `put_many` writes them under, so another
+        # process cannot evict a slot and overwrite it between the lookup and the copy
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            slots = self._slots(unique_keys)
+            if slots:
+                self.conn.executemany(
+                    "UPDATE entries SET last_used = ? WHERE key = ?",
+                    [(time.time(), key) for key in slots],
+                )
+            embeddings = {key: np.array(self.matrix[slot]) for key, slot in slots.items()}
+        hits = sum(key in slots for key in keys)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        metrics.inc("cache_lookups_total", hits, cache="embeddings", result="hits")
+        metrics.inc("cache_lookups_total", len(keys) - hits, cache="embeddings", result="misses")
+        return embeddings
+
+    def put_many(self, keys: list[str], embeddings: np.ndarray) -> None:
+        """Store embeddings, evicting the least recently used ones if the cache is full
+
+        Slots are handed out in order until the matrix is full, then only reused by eviction,
+        so the used slots always are `0 .. MAX(slot)`. Keys which another process has cached
+        in the meantime are rewritten in place.
+
+        Args:
+            keys (list[str]): Cache keys
+            embeddings (np.ndarray): Embeddings of shape (len(keys), dim)
+        """
+        unique = dict(zip(keys, embeddings))  # a repeated key would leave an orphaned slot
+        keys = list(unique)[-self.capacity :]
+        if not keys:
+            return
+        embeddings = np.stack([unique[key] for key in keys])
+        with self.conn:  # allocating slots must be atomic across processes
+            self.conn.execute("BEGIN IMMEDIATE")
+            slots = self._slots(keys)
+            new_keys = [key for key in keys if key not in slots]
+            (next_slot,) = self.conn.execute(
+                "SELECT COALESCE(MAX(slot) + 1, 0) FROM entries"
+            ).fetchone()
+            free = list(range(next_slot, min(next_slot + len(new_keys), self.capacity)))
+            if len(free) < len(new_keys):
+                n_evicted = len(new_keys) - len(free)
+                evicted = [
+                    (key, slot)
+                    for key, slot in self.conn.execute(
+                        "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?",
+                        (n_evicted + len(slots),),
+                    )
+                    if key not in slots
+                ][:n_evicted]
+                self.conn.executemany(
+                    "DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted]
+                )
+                free += [slot for _, slot in evicted]
+            slots.update(zip(new_keys, free))
+            now = time.time()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                [(key, slots[key], now) for key in keys],
+            )
+            self.matrix[[slots[key] for key in keys]] = embeddings.astype(np.float16)
+            self.matrix.flush()
+
+    def stats(self) -> dict:
+        """Hit/miss counts of this process and the number of cached embeddings"""
+        (size,) = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "size": size,
+            "capacity": self.capacity,
+        }
@@ -0,0 +1,74 @@
+"""SetFit classification head as plain arrays, independent of the sklearn object."""
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from sklearn.linear_model import LogisticRegression
+
+
+class LinearHead:
+    """A fitted logistic regression head reduced to its weights.
+
+    Reproduces `LogisticRegression.predict`/`predict_proba` with numpy only, so the head can
+    be stored as plain arrays and applied to embeddings from any encoder backend.
+    """
+
+    def __init__(self, coef: np.ndarray, intercept: np.ndarray, classes: np.ndarray, ovr: bool):
+        self.coef = np.asarray(coef, dtype=np.float32)
+        self.intercept = np.asarray(intercept, dtype=np.float32)
+        self.classes = np.asarray(classes)
+        self.ovr = bool(ovr)  # one-vs-rest probabilities instead of a softmax
+
+    @classmethod
+    def from_sklearn(cls, head: "LogisticRegression") -> "LinearHead":
+        """Extract the weights of a fitted sklearn logistic regression
+
+        Args:
+            head (LogisticRegression): The fitted head of a SetFit model
+
+        Returns:
+            LinearHead: The same head as plain arrays
+        """
+        # Mirrors the check in `LogisticRegression.predict_proba`
+        ovr = head.multi_class in ["ovr", "warn"] or (
+            head.multi_class == "auto" and (head.classes_.size <= 2 or head.solver == "liblinear")
+        )
+        return cls(head.coef_, head.intercept_, head.classes_, ovr)
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        """Get the head as a dictionary of arrays (see `LinearHead.from_arrays`)"""
+        return {
+            "coef": self.coef,
+            "intercept": self.intercept,
+            "classes": self.classes,
+            "ovr": np.array([self.ovr]),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "LinearHead":
+        """Rebuild a head from the output of `LinearHead.to_arrays`"""
+        return cls(arrays["coef"], arrays["intercept"], arrays["classes"], arrays["ovr"][0])
+
+    def decision_function(self, embeddings: np.ndarray) -> np.ndarray:
+        return np.asarray(embeddings, dtype=np.float32) @ self.coef.T + self.intercept
+
+    def predict_proba(self, embeddings: np.ndarray) -> np.ndarray:
+        """Class probabilities of shape (len(embeddings), len(classes))"""
+        scores = self.decision_function(embeddings)
+        if scores.shape[1] == 1:  # binary
+            positive = 1 / (1 + np.exp(-scores[:, 0]))
+            return np.stack([1 - positive, positive], axis=1)
+        if self.ovr:
+            probs = 1 / (1 + np.exp(-scores))
+            return probs / probs.sum(axis=1, keepdims=True)
+        scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return scores / scores.sum(axis=1, keepdims=True)
+
+    def predict(self, embeddings: np.ndarray) -> np.ndarray:
+        """Predicted classes of shape (len(embeddings),)"""
+        scores = self.decision_function(embeddings)
+        if scores.shape[1] == 1:
+            return self.classes[(scores[:, 0] > 0).astype(int)]
+        return self.classes[scores.argmax(axis=1)]
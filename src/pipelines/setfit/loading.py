@@ -1,13 +1,21 @@
 import os
 import pickle
+from typing import TYPE_CHECKING, Union
 
-from setfit import SetFitModel
+from src.config import SETFIT_ARTIFACT_PATH, SETFIT_FULL_MODEL_PATH, SETFIT_MODEL_PATH
 
-from src.config import SETFIT_MODEL_PATH
+from .artifact import MappedSetFitModel, load_setfit_artifact, read_manifest
 
+if TYPE_CHECKING:
+    from setfit import SetFitModel
 
-def load_local_setfit_model() -> SetFitModel:
-    """Load the SetFit model
+SETFIT_HUB_MODEL_ID = "wescottsharples/setfit-23-02-12"
+
+
+def load_local_setfit_model() -> "SetFitModel":
+    """Load the SetFit model from the legacy pickle
+
+    NOTE: Unpickling can run arbitrary code, so only load pickles you created yourself
 
     Returns:
         SetFitModel: SetFit model
@@ -15,17 +23,63 @@ def load_local_setfit_model() -> SetFitModel:
     return pickle.load(open(SETFIT_MODEL_PATH, "rb"))
 
 
-def load_setfit_model() -> SetFitModel:
-    """Load the SetFit model
+def load_full_setfit_model() -> "SetFitModel":
+    """Load the trainable SetFit model, e.g. to export or push it
 
     Returns:
         SetFitModel: SetFit model
     """
+    from setfit import SetFitModel
+
     # if it exists locally, load it
-    print(f"Loading SetFit pipeline...")
+    if os.path.exists(SETFIT_FULL_MODEL_PATH):
+        return SetFitModel.from_pretrained(os.path.realpath(SETFIT_FULL_MODEL_PATH))
     if os.path.exists(SETFIT_MODEL_PATH):
         return load_local_setfit_model()
     # otherwise, download it from the HuggingFace Hub
-    else:
-        print("Downloading SetFit model from HuggingFace Hub...")
-        return SetFitModel.from_pretrained("wescottsharples/setfit-23-02-12")
+    print("Downloading SetFit model from HuggingFace Hub...")
+    return SetFitModel.from_pretrained(SETFIT_HUB_MODEL_ID)
+
+
+def load_setfit_model() -> Union["SetFitModel", MappedSetFitModel]:
+    """Load the SetFit model for inference
+
+    Prefers the memory-mapped artifact (see `src.pipelines.setfit.artifact`), and falls back
+    to `load_full_setfit_model`.
+
+    Returns:
+        SetFitModel | MappedSetFitModel: SetFit model
+    """
+    print(f"Loading SetFit pipeline...")
+    if os.path.exists(SETFIT_ARTIFACT_PATH):
+        return load_setfit_artifact(SETFIT_ARTIFACT_PATH)
+    print("No SetFit artifact found, run `python scripts/export_setfit_artifact.py` to create one")
+    return load_full_setfit_model()
+
+
+def get_setfit_body_version() -> str:
+    """Identify the sentence-transformer body of the SetFit model, e.g. to key embeddings by it
+
+    Returns:
+        str: The artifact's body version, or the model version (see `get_setfit_model_version`)
+    """
+    if os.path.exists(SETFIT_ARTIFACT_PATH):
+        manifest = read_manifest(SETFIT_ARTIFACT_PATH)
+        return manifest.get("body_version", manifest["version"])
+    return get_setfit_model_version()
+
+
+def get_setfit_model_version() -> str:
+    """Identify the SetFit model that `load_setfit_model` loads, e.g. to key caches by it
+
+    Returns:
+        str: The artifact version, the versioned file name and modification time of the
+            local model, or the Hub id
+    """
+    if os.path.exists(SETFIT_ARTIFACT_PATH):
+        return read_manifest(SETFIT_ARTIFACT_PATH)["version"]
+    for local_path in (SETFIT_FULL_MODEL_PATH, SETFIT_MODEL_PATH):
+        if os.path.exists(local_path):
+            path = os.path.realpath(local_path)  # resolve the versioned symlink
+            return f"{os.path.basename(path)}@{int(os.path.getmtime(path))}"
+    return SETFIT_HUB_MODEL_ID
@@ -0,0 +1,225 @@
+"""Contrastive pairs for SetFit training, materialised to disk and reused across runs.
+
+SetFit fine-tunes its body on sentence pairs: every anchor row is paired with a row of the
+same class (target 1) and a row of another class (target 0), `num_iterations` times over.
+Pairs are stored as row indices, keyed by a fingerprint of the dataset, the seed,
+`num_iterations` and the sampling mode, and the rows themselves are tokenized once per
+tokenizer. Later training runs and search trials load both instead of redoing them.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from src.config import SETFIT_PAIRS_CACHE_DIR
+from src.pipelines.text import text_hash
+from src.pipelines.transformers.batching import make_buckets
+from src.pipelines.transformers.tokens import pad_batch, tokenizer_fingerprint
+
+PAIRS_FORMAT_VERSION = 1
+BATCHES_PER_CHUNK = 50  # batches drawn from each shuffled chunk when bucketing by length
+
+
+def dataset_fingerprint(texts: list[str], labels: np.ndarray) -> str:
+    """Stable hash of a labelled dataset, including the order of its rows"""
+    digest = hashlib.sha256()
+    for text, label in zip(texts, labels):
+        digest.update(text_hash(text, str(label)).encode("ascii"))
+    return digest.hexdigest()[:16]
+
+
+def generate_pairs(
+    labels: np.ndarray, num_iterations: int, seed: int, stratified: bool = False
+) -> np.ndarray:
+    """Sample contrastive pairs
+
+    By default every row is an anchor once per iteration and its negative is drawn from all
+    rows of other classes, as in SetFit. With `stratified`, every class provides the same
+    number of anchors (drawn with replacement), and negatives are drawn from a uniformly
+    chosen other class, so that frequent classes do not dominate training.
+
+    Args:
+        labels (np.ndarray): Label of every row
+        num_iterations (int): Number of positive and negative pairs per anchor
+        seed (int): Random seed
+        stratified (bool, optional): Balance the classes. Defaults to False.
+
+    Returns:
+        np.ndarray: (anchor row, other row, target) of every pair, shape (n_pairs, 3)
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.asarray(labels)
+    classes = np.unique(labels)
+    if len(classes) < 2:
+        raise ValueError("Contrastive pairs need at least two classes")
+    rows = {c: np.flatnonzero(labels == c) for c in classes}
+    other_rows = {c: np.flatnonzero(labels != c) for c in classes}
+    anchors_per_class = max(1, round(len(labels) / len(classes)))
+
+    pairs = []
+    for _ in range(num_iterations):
+        if stratified:
+            anchors = np.concatenate([rng.choice(rows[c], anchors_per_class) for c in classes])
+        else:
+            anchors = np.arange(len(labels))
+        anchor_labels = labels[anchors]
+        positives = np.empty_like(anchors)
+        negatives = np.empty_like(anchors)
+        for c in classes:
+            mask = anchor_labels == c
+            positives[mask] = rng.choice(rows[c], mask.sum())
+            if not stratified:
+                negatives[mask] = rng.choice(other_rows[c], mask.sum())
+                continue
+            others = classes[classes != c]
+            negative_classes = rng.choice(others, mask.sum())
+            negatives_of_c = np.empty(mask.sum(), dtype=anchors.dtype)
+            for other in others:
+                other_mask = negative_classes == other
+                negatives_of_c[other_mask] = rng.choice(rows[other], other_mask.sum())
+            negatives[mask] = negatives_of_c
+        pairs.append(np.stack([anchors, positives, np.ones_like(anchors)], axis=1))
+        pairs.append(np.stack([anchors, negatives, np.zeros_like(anchors)], axis=1))
+    return np.concatenate(pairs).astype(np.int64)
+
+
+def tokenize_rows(texts: list[str], tokenizer, max_length: int) -> tuple[np.ndarray, np.ndarray]:
+    """Tokenize every row once, without padding
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The concatenated token ids, and the offsets of each
+            row's ids (row i is `ids[offsets[i]:offsets[i + 1]]`)
+    """
+    token_ids = tokenizer(list(texts), truncation=True, max_length=max_length)["input_ids"]
+    offsets = np.zeros(len(token_ids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(ids) for ids in token_ids])
+    return np.concatenate([np.asarray(ids, dtype=np.int32) for ids in token_ids]), offsets
+
+
+def _save_npz(path: Path, **arrays: np.ndarray) -> None:
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp.npz")  # workers may race
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+class PairSet:
+    """Contrastive pairs over tokenized rows, batched by length for training."""
+
+    def __init__(self, pairs: np.ndarray, token_ids: np.ndarray, offsets: np.ndarray):
+        self.pairs = pairs
+        self.token_ids = token_ids
+        self.offsets = offsets
+        row_lengths = np.diff(offsets)
+        self.lengths = np.maximum(row_lengths[pairs[:, 0]], row_lengths[pairs[:, 1]])
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def batches(self, batch_size: int, seed: int) -> list[list[int]]:
+        """Shuffled batches of pairs of similar length
+
+        Pairs are shuffled and cut into chunks of `BATCHES_PER_CHUNK` batches; each chunk is
+        bucketed by length (see `make_buckets`), and the batches are shuffled again. Batches
+        pad little, but their order and composition still change with the seed.
+
+        Returns:
+            list[list[int]]: Batches of pair indices
+        """
+        rng = np.random.default_rng(seed)
+        order = rng.permutation(len(self.pairs))
+        chunk_size = batch_size * BATCHES_PER_CHUNK
+        batches = []
+        for start in range(0, len(order), chunk_size):
+            chunk = order[start : start + chunk_size]
+            lengths = self.lengths[chunk].tolist()
+            for bucket in make_buckets(lengths, batch_size, batch_size * max(lengths)):
+                batches.append(chunk[bucket].tolist())
+        return [batches[i] for i in rng.permutation(len(batches))]
+
+    def collate(self, batch: list[int], tokenizer) -> tuple[dict, dict, "torch.Tensor"]:
+        """Padded features of both sides of the pairs, and their targets
+
+        Returns:
+            tuple[dict, dict, torch.Tensor]: Features of the anchors and of the other rows
+                (input_ids and attention_mask tensors), and float targets
+        """
+        import torch
+
+        features = []
+        for side in (0, 1):
+            rows = self.pairs[batch, side]
+            input_ids, attention_mask = pad_batch(
+                [self.token_ids[self.offsets[row] : self.offsets[row + 1]] for row in rows],
+                tokenizer.pad_token_id,
+            )
+            features.append(
+                {
+                    "input_ids": torch.from_numpy(input_ids),
+                    "attention_mask": torch.from_numpy(attention_mask),
+                }
+            )
+        targets = torch.tensor(self.pairs[batch, 2], dtype=torch.float)
+        return features[0], features[1], targets
+
+
+def get_pair_set(
+    texts: list[str],
+    labels: np.ndarray,
+    tokenizer,
+    max_length: int,
+    num_iterations: int,
+    seed: int,
+    stratified: bool = False,
+    cache_dir: Optional[Path] = None,
+) -> PairSet:
+    """Load the pairs and tokenized rows of a dataset from the cache, creating them if needed
+
+    Args:
+        texts (list[str]): Row texts
+        labels (np.ndarray): Row labels
+        tokenizer (PreTrainedTokenizer): Tokenizer of the body being trained
+        max_length (int): Maximum sequence length of the body
+        num_iterations (int): See `generate_pairs`
+        seed (int): See `generate_pairs`
+        stratified (bool, optional): See `generate_pairs`. Defaults to False.
+        cache_dir (Path, optional): Defaults to `SETFIT_PAIRS_CACHE_DIR`.
+
+    Returns:
+        PairSet: The pairs
+    """
+    labels = np.asarray(labels)
+    key = {
+        "version": PAIRS_FORMAT_VERSION,
+        "dataset": dataset_fingerprint(texts, labels),
+        "num_iterations": num_iterations,
+        "seed": seed,
+        "stratified": stratified,
+    }
+    key_hash = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+    pairs_dir = (cache_dir or SETFIT_PAIRS_CACHE_DIR) / key_hash
+    pairs_dir.mkdir(parents=True, exist_ok=True)
+
+    pairs_path = pairs_dir / "pairs.npz"
+    if pairs_path.exists():
+        with np.load(pairs_path) as arrays:
+            pairs = arrays["pairs"]
+    else:
+        print(f"Generating contrastive pairs ({num_iterations} iterations, seed {seed})...")
+        pairs = generate_pairs(labels, num_iterations, seed, stratified)
+        _save_npz(pairs_path, pairs=pairs)
+        with open(pairs_dir / "key.json", "w") as f:
+            json.dump(key, f)
+
+    tokens_path = pairs_dir / f"tokens_{tokenizer_fingerprint(tokenizer, max_length)}.npz"
+    if tokens_path.exists():
+        with np.load(tokens_path) as arrays:
+            token_ids, offsets = arrays["token_ids"], arrays["offsets"]
+    else:
+        print(f"Tokenizing {len(texts)} rows for {tokenizer.name_or_path}...")
+        token_ids, offsets = tokenize_rows(texts, tokenizer, max_length)
+        _save_npz(tokens_path, token_ids=token_ids, offsets=offsets)
+    return PairSet(pairs, token_ids, offsets)
@@ -0,0 +1,128 @@
+"""Head-only retraining of the SetFit model on frozen sentence embeddings.
+
+Refitting the logistic regression head takes seconds on CPU, against the half hour of a full
+contrastive fine-tune. It cannot help once the frozen body stops separating the classes of
+new data, so every retrain also measures drift and says when a full retrain is warranted.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from src.config import (
+    RANDOM_SEED,
+    SETFIT_DRIFT_MAX_ACCURACY_DROP,
+    SETFIT_DRIFT_MAX_CENTROID_SHIFT,
+)
+
+from .head import LinearHead
+
+
+def fit_head(embeddings: np.ndarray, labels: np.ndarray) -> LinearHead:
+    """Fit a new classification head (SetFit's default logistic regression)
+
+    Args:
+        embeddings (np.ndarray): Sentence embeddings of shape (n, dim)
+        labels (np.ndarray): Integer labels of shape (n,)
+
+    Returns:
+        LinearHead: The fitted head
+    """
+    from sklearn.linear_model import LogisticRegression
+
+    head = LogisticRegression(max_iter=1000, random_state=RANDOM_SEED)
+    head.fit(embeddings, labels)
+    return LinearHead.from_sklearn(head)
+
+
+def centroid_shift(reference: np.ndarray, current: np.ndarray) -> float:
+    """Cosine distance between the mean embeddings of two sets of rows"""
+    a, b = reference.mean(axis=0), current.mean(axis=0)
+    return float(1 - a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def label_shift(reference: np.ndarray, current: np.ndarray) -> float:
+    """Total variation distance between the label distributions of two sets of rows"""
+    classes = np.union1d(reference, current)
+    p = np.array([np.mean(reference == c) for c in classes])
+    q = np.array([np.mean(current == c) for c in classes])
+    return float(np.abs(p - q).sum() / 2)
+
+
+def accuracy(head: LinearHead, embeddings: np.ndarray, labels: np.ndarray) -> Optional[float]:
+    if len(labels) == 0:
+        return None
+    return float(np.mean(head.predict(embeddings) == labels))
+
+
+def drift_report(
+    head_before: LinearHead,
+    head_after: LinearHead,
+    old_train: tuple[np.ndarray, np.ndarray],
+    old_test: tuple[np.ndarray, np.ndarray],
+    new_train: tuple[np.ndarray, np.ndarray],
+    new_holdout: tuple[np.ndarray, np.ndarray],
+) -> dict:
+    """Compare the heads before and after a retrain, and measure the drift of the new rows
+
+    A full retrain is recommended when the refitted head does clearly worse on the new rows
+    than the current model does on its own test set, or when the new rows moved far from
+    the old ones in embedding space.
+
+    Args:
+        head_before (LinearHead): The current head
+        head_after (LinearHead): The refitted head
+        old_train, old_test, new_train, new_holdout (tuple[np.ndarray, np.ndarray]):
+            (embeddings, labels) of the old annotated rows and of the new rows
+
+    Returns:
+        dict: Row counts, drift measures, accuracies before and after, whether the new head
+            should be promoted, and whether (and why) a full retrain is recommended
+    """
+    new_embeddings = np.concatenate([new_train[0], new_holdout[0]])
+    new_labels = np.concatenate([new_train[1], new_holdout[1]])
+    report = {
+        "rows": {
+            "old_train": len(old_train[1]),
+            "old_test": len(old_test[1]),
+            "new_train": len(new_train[1]),
+            "new_holdout": len(new_holdout[1]),
+        },
+        "centroid_shift": centroid_shift(old_train[0], new_embeddings),
+        "label_shift": label_shift(old_train[1], new_labels),
+        "accuracy_before": {
+            "old_test": accuracy(head_before, *old_test),
+            "new_holdout": accuracy(head_before, *new_holdout),
+        },
+        "accuracy_after": {
+            "old_test": accuracy(head_after, *old_test),
+            "new_holdout": accuracy(head_after, *new_holdout),
+        },
+    }
+
+    holdout = (
+        np.concatenate([old_test[0], new_holdout[0]]),
+        np.concatenate([old_test[1], new_holdout[1]]),
+    )
+    report["promote"] = accuracy(head_after, *holdout) >= accuracy(head_before, *holdout)
+
+    reasons = []
+    reference_accuracy = report["accuracy_before"]["old_test"]
+    new_accuracy = report["accuracy_after"]["new_holdout"]
+    if (
+        reference_accuracy is not None
+        and new_accuracy is not None
+        and new_accuracy < reference_accuracy - SETFIT_DRIFT_MAX_ACCURACY_DROP
+    ):
+        reasons.append(
+            f"the refitted head scores {new_accuracy:.1%} on new rows, against "
+            f"{reference_accuracy:.1%} for the current model on its test set"
+        )
+    if report["centroid_shift"] > SETFIT_DRIFT_MAX_CENTROID_SHIFT:
+        reasons.append(
+            f"new rows moved {report['centroid_shift']:.3f} (cosine distance) from the "
+            "training rows in embedding space"
+        )
+    report["full_retrain_recommended"] = bool(reasons)
+    report["reasons"] = reasons
+    return report
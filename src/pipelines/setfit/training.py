@@ -1,7 +1,23 @@
+import math
+from typing import Callable, Optional
+
+import numpy as np
 from datasets import DatasetDict  # type: ignore
+from sentence_transformers import SentenceTransformer
 from sentence_transformers.losses import CosineSimilarityLoss
 from setfit import SetFitModel, SetFitTrainer
 
+from src.config import RANDOM_SEED
+
+from .pairs import PairSet, get_pair_set
+
+TRAINING_PARAMS = {
+    "learning_rate": 2.67e-5,
+    "num_epochs": 5,
+    "batch_size": 4,
+    "num_iterations": 10,
+}
+
 
 def model_init(model: str) -> SetFitModel:
     """Initialize a new SetFit model from our base model
@@ -21,7 +37,7 @@ def get_setfit_trainer(model: SetFitModel, dataset: dict) -> SetFitTrainer:
     Returns:
         SetFitTrainer: SetFit trainer
     """
-    # NOTE: See `scripts/search_setfit_hp.py` for hyperparameter search
+    # NOTE: See `scripts/hpsearch_setfit.py` for hyperparameter search
     return SetFitTrainer(
         model=model,
         train_dataset=dataset["train"],
@@ -29,21 +45,99 @@ def get_setfit_trainer(model: SetFitModel, dataset: dict) -> SetFitTrainer:
         column_mapping={"entry": "text", "label": "label"},
         metric="accuracy",  # if using "f1" may have to specify average="macro" if you get a warning
         loss_class=CosineSimilarityLoss,
-        learning_rate=2.67e-5,
-        num_epochs=5,
-        batch_size=4,
-        num_iterations=10,
+        **TRAINING_PARAMS,
+    )
+
+
+def train_body(
+    body: SentenceTransformer,
+    pair_set: PairSet,
+    num_epochs: int,
+    batch_size: int,
+    learning_rate: float,
+    seed: int = RANDOM_SEED,
+    warmup_proportion: float = 0.1,
+    on_epoch_end: Optional[Callable[[int], None]] = None,
+) -> None:
+    """Fine-tune the sentence-transformer body on contrastive pairs
+
+    The same optimisation as `SentenceTransformer.fit` (AdamW, linear warmup and decay,
+    gradient clipping, cosine similarity loss), but fed from the pre-tokenized pairs:
+    `fit` re-tokenizes both sides of every pair in every batch.
+
+    Args:
+        body (SentenceTransformer): Body to train, in place
+        pair_set (PairSet): Training pairs (see `get_pair_set`)
+        num_epochs (int): Passes over the pairs
+        batch_size (int): Pairs per batch
+        learning_rate (float): Peak learning rate
+        seed (int, optional): Seed of the batch order. Defaults to RANDOM_SEED.
+        warmup_proportion (float, optional): Fraction of steps of warmup. Defaults to 0.1.
+        on_epoch_end (Callable[[int], None], optional): Called with the epoch number after
+            every epoch, e.g. to evaluate and stop early by raising
+    """
+    import torch
+    from transformers import get_linear_schedule_with_warmup
+
+    from src.config import DEVICE
+
+    body.to(DEVICE)
+    loss_model = CosineSimilarityLoss(body)
+    no_decay = ("bias", "LayerNorm.bias", "LayerNorm.weight")
+    parameters = list(loss_model.named_parameters())
+    optimizer = torch.optim.AdamW(
+        [
+            {
+                "params": [p for n, p in parameters if not any(nd in n for nd in no_decay)],
+                "weight_decay": 0.01,
+            },
+            {
+                "params": [p for n, p in parameters if any(nd in n for nd in no_decay)],
+                "weight_decay": 0.0,
+            },
+        ],
+        lr=learning_rate,
     )
+    steps_per_epoch = math.ceil(len(pair_set) / batch_size)
+    total_steps = steps_per_epoch * num_epochs
+    scheduler = get_linear_schedule_with_warmup(
+        optimizer, math.ceil(total_steps * warmup_proportion), total_steps
+    )
+
+    for epoch in range(num_epochs):
+        loss_model.train()
+        for batch in pair_set.batches(batch_size, seed=seed + epoch):
+            features_a, features_b, targets = pair_set.collate(batch, body.tokenizer)
+            features = [
+                {key: value.to(DEVICE) for key, value in features_a.items()},
+                {key: value.to(DEVICE) for key, value in features_b.items()},
+            ]
+            loss = loss_model(features, targets.to(DEVICE))
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(loss_model.parameters(), 1.0)
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+        loss_model.eval()
+        if on_epoch_end is not None:
+            on_epoch_end(epoch)
 
 
-def train_setfit_model(dataset: DatasetDict) -> tuple[SetFitModel, SetFitTrainer]:
+def train_setfit_model(
+    dataset: DatasetDict, stratified: bool = False
+) -> tuple[SetFitModel, SetFitTrainer]:
     """Train the SetFit model
 
+    The contrastive pairs and their token ids come from the pair cache (see `get_pair_set`),
+    so only the first run on a dataset pays for generating and tokenizing them.
+
+    Args:
+        dataset (DatasetDict): Dataset with "train" and "test" splits
+        stratified (bool, optional): Sample class-balanced pairs (see `generate_pairs`).
+            Defaults to False.
+
     Returns:
-        dict: {
-            "model": model name,
-            "trainer": trainer,
-        }
+        tuple[SetFitModel, SetFitTrainer]: The trained model, and a trainer to evaluate it
     """
 
     if "train" not in dataset.keys() or "test" not in dataset.keys():
@@ -52,6 +146,22 @@ def train_setfit_model(dataset: DatasetDict) -> tuple[SetFitModel, SetFitTrainer
     # We need to start with a base model to fine-tune from the Sentence Transformers library
     BASE_MODEL = "sentence-transformers/all-MiniLM-L12-v1"
     model = model_init(BASE_MODEL)
-    trainer = get_setfit_trainer(model, dataset)
-    trainer.train()
-    return model, trainer
+    texts, labels = list(dataset["train"]["entry"]), np.array(dataset["train"]["label"])
+    pair_set = get_pair_set(
+        texts,
+        labels,
+        model.model_body.tokenizer,
+        model.model_body.max_seq_length,
+        num_iterations=TRAINING_PARAMS["num_iterations"],
+        seed=RANDOM_SEED,
+        stratified=stratified,
+    )
+    train_body(
+        model.model_body,
+        pair_set,
+        num_epochs=TRAINING_PARAMS["num_epochs"],
+        batch_size=TRAINING_PARAMS["batch_size"],
+        learning_rate=TRAINING_PARAMS["learning_rate"],
+    )
+    model.model_head.fit(model.model_body.encode(texts), labels)
+    return model, get_setfit_trainer(model, dataset)
@@ -0,0 +1,64 @@
+"""Text normalisation and hashing shared by the pipeline caches."""
+
+import hashlib
+import re
+import unicodedata
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+URL_PATTERN = re.compile(r"(https?://|www\.)\S+", re.IGNORECASE)
+
+
+def normalize_text(text: str) -> str:
+    """Normalise a text without changing what a model sees in it
+
+    Applies Unicode NFKC normalisation and collapses runs of whitespace, so that reposts
+    differing only in invisible characters map to the same text.
+
+    Example:
+        >>> normalize_text("  Great app!\\n\\n")
+        "Great app!"
+
+    Args:
+        text (str): The text
+
+    Returns:
+        str: The normalised text
+    """
+    return WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
+
+
+def canonicalize_text(text: str) -> str:
+    """Aggressively normalise a text for duplicate detection
+
+    On top of `normalize_text`, lowercases the text and replaces URLs with a placeholder,
+    so that e.g. templated reviews which only differ in a tracking link are duplicates.
+
+    Example:
+        >>> canonicalize_text("Great app! https://t.co/abc")
+        "great app! <url>"
+
+    Args:
+        text (str): The text
+
+    Returns:
+        str: The canonical form of the text
+    """
+    return normalize_text(URL_PATTERN.sub("<url>", text or "")).lower()
+
+
+def text_hash(text: str, *namespace: str) -> str:
+    """Stable (cross-process) hash of a text, optionally namespaced e.g. by model version
+
+    Args:
+        text (str): The text
+        *namespace (str): Extra key parts, hashed before the text
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in namespace:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
@@ -1,38 +1,65 @@
 """Module for retrieving HuggingFace transformer pipelines."""
 
 
-from transformers import TextClassificationPipeline, pipeline
+import os
+from typing import Optional
 
-from src.config import DEVICE, LABEL_MAPPING
+from src.config import DISTILLED_MODEL_PATH, HF_BATCH_SIZE, HF_MAX_BATCH_TOKENS, LABEL_MAPPING
 
+from .batching import BucketedPipeline
 
-def get_transformer_pipelines() -> dict:
+TRANSFORMER_MODELS = [
+    ("roberta_cardiffnlp", "cardiffnlp/twitter-roberta-base-sentiment-latest"),
+    ("bert_seethal", "Seethal/sentiment_analysis_generic_dataset"),
+    ("roberta_hartmann", "j-hartmann/sentiment-roberta-large-english-3-classes"),
+]  # NOTE: See `README.md` for details on the models
+if os.path.exists(DISTILLED_MODEL_PATH):
+    # student of roberta_hartmann, see `scripts/distill_roberta.py`
+    TRANSFORMER_MODELS.append(("roberta_hartmann_student", str(DISTILLED_MODEL_PATH)))
+
+
+def load_transformer_pipeline(model: str, device=None) -> BucketedPipeline:
+    """Load a HuggingFace sentiment analysis pipeline with length-bucketed batching
+
+    Args:
+        model (str): HuggingFace model name or local model directory
+        device (optional): Device to run on. Defaults to DEVICE.
+
+    Returns:
+        BucketedPipeline: The pipeline
+    """
+    from transformers import pipeline
+
+    if device is None:
+        from src.config import DEVICE
+
+        device = DEVICE
+    pipe = pipeline(
+        "sentiment-analysis",
+        model=model,
+        device=device,
+        max_length=512,
+        truncation=True,  # to avoid errors with long texts
+    )
+    pipe.model.config.id2label = LABEL_MAPPING  # get the pipeline to output strings instead of ints
+    return BucketedPipeline(pipe, batch_size=HF_BATCH_SIZE, max_batch_tokens=HF_MAX_BATCH_TOKENS)
+
+
+def get_transformer_pipelines(names: Optional[list[str]] = None) -> dict:
     """Get the pre-selected HuggingFace sentiment analysis pipelines.
 
+    Args:
+        names (list[str], optional): Only load these pipelines. Defaults to None (all).
+
     Returns:
         dict: dictionary of pipelines
     """
-
     pipelines = {}
 
-    models = [
-        ("roberta_cardiffnlp", "cardiffnlp/twitter-roberta-base-sentiment-latest"),
-        ("bert_seethal", "Seethal/sentiment_analysis_generic_dataset"),
-        ("roberta_hartmann", "j-hartmann/sentiment-roberta-large-english-3-classes"),
-    ]  # NOTE: See `README.md` for details on the models
-
-    for name, model in models:
+    for name, model in TRANSFORMER_MODELS:
+        if names is not None and name not in names:
+            continue
         print(f"Loading pipeline for {name}...")
-        pipe = pipeline(
-            "sentiment-analysis",
-            model=model,
-            device=DEVICE,
-            max_length=512,
-            truncation=True,  # to avoid errors with long texts
-        )
-        pipe.model.config.id2label = (
-            LABEL_MAPPING  # get the pipeline to output strings instead of ints
-        )
-        pipelines[name] = pipe
+        pipelines[name] = load_transformer_pipeline(model)
 
     return pipelines
@@ -0,0 +1,129 @@
+"""Length-bucketed, pre-tokenized batching for HuggingFace text classification pipelines."""
+
+import os
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from src.metrics import SIZE_BUCKETS, metrics
+
+if TYPE_CHECKING:
+    from transformers import TextClassificationPipeline
+
+
+def make_buckets(lengths: list[int], batch_size: int, max_batch_tokens: int) -> list[list[int]]:
+    """Group indices into batches of similar length
+
+    Indices are sorted by length and cut into consecutive batches of at most `batch_size`
+    items, with a batch also cut early once its padded size (items x longest item) would
+    exceed `max_batch_tokens`. Short texts are never padded up to a long neighbour's length,
+    and long texts run in smaller batches.
+
+    Example:
+        >>> make_buckets([5, 300, 7, 6], batch_size=2, max_batch_tokens=512)
+        [[0, 3], [2], [1]]
+
+    Args:
+        lengths (list[int]): Token length of every input
+        batch_size (int): Maximum number of items per batch
+        max_batch_tokens (int): Maximum padded tokens per batch
+
+    Returns:
+        list[list[int]]: Batches of indices into `lengths`
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    buckets, bucket = [], []
+    for i in order:
+        # sorted ascending, so the current item is the longest in the bucket
+        if bucket and (
+            len(bucket) == batch_size or (len(bucket) + 1) * lengths[i] > max_batch_tokens
+        ):
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(i)
+    if bucket:
+        buckets.append(bucket)
+    return buckets
+
+
+class BucketedPipeline:
+    """Runs a text classification pipeline's model over length-sorted buckets.
+
+    Behaves like the wrapped pipeline (attributes such as `model` and `tokenizer` are
+    forwarded, and outputs are {"label": ..., "score": ...} dicts in input order). Token ids
+    come from the tokenizer family's shared `TokenCache`, and padded batches go straight to
+    the model, so texts are tokenized once across pipelines and runs.
+    """
+
+    def __init__(
+        self,
+        pipe: "TextClassificationPipeline",
+        batch_size: int = 16,
+        max_batch_tokens: int = 8192,
+        max_length: int = 512,
+    ):
+        self.pipe = pipe
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_length = max_length
+        self.metrics_name = os.path.basename(str(pipe.model.name_or_path).rstrip("/"))
+
+        from .tokens import get_token_cache  # imports pyarrow
+
+        self.token_cache = get_token_cache(pipe.tokenizer, max_length)
+
+    def __getattr__(self, name: str):
+        if name == "pipe":  # not set yet, e.g. while unpickling
+            raise AttributeError(name)
+        return getattr(self.pipe, name)
+
+    def _postprocess(self, logits: np.ndarray) -> list[dict]:
+        """Top label and its score per row, as the pipeline's default postprocessing"""
+        if logits.shape[1] == 1:
+            scores = 1 / (1 + np.exp(-logits))
+        else:
+            exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+            scores = exp / exp.sum(axis=1, keepdims=True)
+        id2label = self.pipe.model.config.id2label
+        return [{"label": id2label[int(row.argmax())], "score": float(row.max())} for row in scores]
+
+    def __call__(self, texts: list[str]) -> list[dict]:
+        """Classify the texts
+
+        Args:
+            texts (list[str]): list of texts
+
+        Returns:
+            list[dict]: The pipeline outputs ({"label": ..., "score": ...}) in input order
+        """
+        import torch
+
+        from .tokens import pad_batch
+
+        texts = list(texts)
+        if not texts:
+            return []
+        with metrics.stage(self.metrics_name, "tokenize"):
+            token_ids = self.token_cache.encode(texts)
+        model = self.pipe.model
+        preds: list = [None] * len(texts)
+        with torch.inference_mode():
+            for bucket in make_buckets(
+                [len(ids) for ids in token_ids], self.batch_size, self.max_batch_tokens
+            ):
+                metrics.observe(
+                    "pipeline_batch_size", len(bucket), SIZE_BUCKETS, pipeline=self.metrics_name
+                )
+                with metrics.stage(self.metrics_name, "forward"):
+                    input_ids, attention_mask = pad_batch(
+                        [token_ids[i] for i in bucket], self.pipe.tokenizer.pad_token_id
+                    )
+                    logits = model(
+                        input_ids=torch.from_numpy(input_ids).to(model.device),
+                        attention_mask=torch.from_numpy(attention_mask).to(model.device),
+                    ).logits
+                    logits = logits.float().cpu().numpy()  # waits for the device
+                with metrics.stage(self.metrics_name, "postprocess"):
+                    for i, output in zip(bucket, self._postprocess(logits)):
+                        preds[i] = output
+        return preds
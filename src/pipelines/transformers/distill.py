@@ -0,0 +1,182 @@
+"""Knowledge distillation of a large HuggingFace classifier into a small student.
+
+The teachers (a HuggingFace model, optionally mixed with SetFit) label unlabelled feedback
+with soft class probabilities, and the student learns to match them (Hinton et al.'s KL
+loss at a temperature). The student is a shallow encoder of the same tokenizer family, so
+it runs several times faster on CPU.
+"""
+
+import math
+from typing import TYPE_CHECKING, Callable, Optional
+
+import numpy as np
+
+from src.config import HF_BATCH_SIZE, HF_MAX_BATCH_TOKENS, LABEL_MAPPING, RANDOM_SEED
+
+from .batching import make_buckets
+from .tokens import get_token_cache, pad_batch
+
+if TYPE_CHECKING:
+    from transformers import PreTrainedModel, PreTrainedTokenizer
+
+STUDENT_BASE_MODEL = "distilroberta-base"  # 6 layers, same tokenizer as the RoBERTa teachers
+MAX_LENGTH = 512
+
+
+def _encode(tokenizer: "PreTrainedTokenizer", bucket: list[int], token_ids: list) -> dict:
+    """Padded torch inputs of a bucket of pre-tokenized texts"""
+    import torch
+
+    input_ids, attention_mask = pad_batch([token_ids[i] for i in bucket], tokenizer.pad_token_id)
+    return {
+        "input_ids": torch.from_numpy(input_ids),
+        "attention_mask": torch.from_numpy(attention_mask),
+    }
+
+
+def predict_logits(
+    model: "PreTrainedModel",
+    tokenizer: "PreTrainedTokenizer",
+    texts: list[str],
+    batch_size: int = HF_BATCH_SIZE,
+    max_batch_tokens: int = HF_MAX_BATCH_TOKENS,
+) -> np.ndarray:
+    """Class logits of a sequence classification model, computed over length buckets
+
+    Returns:
+        np.ndarray: Logits of shape (len(texts), num_labels), in input order
+    """
+    import torch
+
+    token_ids = get_token_cache(tokenizer, MAX_LENGTH).encode(texts)
+    lengths = [len(ids) for ids in token_ids]
+    logits = np.zeros((len(texts), model.config.num_labels), dtype=np.float32)
+    model.eval()
+    with torch.inference_mode():
+        for bucket in make_buckets(lengths, batch_size, max_batch_tokens):
+            inputs = _encode(tokenizer, bucket, token_ids)
+            inputs = {name: tensor.to(model.device) for name, tensor in inputs.items()}
+            logits[bucket] = model(**inputs).logits.float().cpu().numpy()
+    return logits
+
+
+def soften(probabilities: np.ndarray, temperature: float) -> np.ndarray:
+    """Raise class probabilities to 1 / temperature and renormalise (softmax(logits / T))"""
+    log_p = np.log(np.clip(probabilities, 1e-12, 1.0)) / temperature
+    log_p -= log_p.max(axis=1, keepdims=True)
+    p = np.exp(log_p)
+    return p / p.sum(axis=1, keepdims=True)
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def mix_teachers(
+    teacher_probabilities: list[np.ndarray], weights: list[float], temperature: float
+) -> np.ndarray:
+    """Soft labels: weighted mean of the teachers' class probabilities at a temperature"""
+    mixed = sum(w * soften(p, temperature) for p, w in zip(teacher_probabilities, weights))
+    return mixed / sum(weights)
+
+
+def build_student(
+    base_model: str = STUDENT_BASE_MODEL, num_layers: Optional[int] = None
+) -> "PreTrainedModel":
+    """A fresh sequence classification student, keeping only its first `num_layers` layers
+
+    Args:
+        base_model (str, optional): Pretrained encoder. Defaults to STUDENT_BASE_MODEL.
+        num_layers (int, optional): Transformer layers to keep. Defaults to all.
+
+    Returns:
+        PreTrainedModel: The student, with our label mapping
+    """
+    from transformers import AutoModelForSequenceClassification
+
+    model = AutoModelForSequenceClassification.from_pretrained(
+        base_model,
+        num_labels=len(LABEL_MAPPING),
+        id2label=LABEL_MAPPING,
+        label2id={label: i for i, label in LABEL_MAPPING.items()},
+    )
+    if num_layers is not None and num_layers < model.config.num_hidden_layers:
+        encoder = model.base_model.encoder
+        encoder.layer = encoder.layer[:num_layers]
+        model.config.num_hidden_layers = num_layers
+    return model
+
+
+def train_student(
+    student: "PreTrainedModel",
+    tokenizer: "PreTrainedTokenizer",
+    texts: list[str],
+    soft_labels: np.ndarray,
+    temperature: float = 2.0,
+    num_epochs: int = 3,
+    batch_size: int = 16,
+    learning_rate: float = 5e-5,
+    warmup_proportion: float = 0.1,
+    seed: int = RANDOM_SEED,
+    on_epoch_end: Optional[Callable[[int, float], None]] = None,
+) -> None:
+    """Train the student to match the teachers' soft labels
+
+    Minimises T^2 * KL(teacher || softmax(student logits / T)), in length-bucketed batches
+    (shuffled every epoch) with AdamW and a linear warmup and decay schedule.
+
+    Args:
+        student (PreTrainedModel): Student to train, in place
+        tokenizer (PreTrainedTokenizer): The student's tokenizer
+        texts (list[str]): Unlabelled texts
+        soft_labels (np.ndarray): Teacher probabilities at `temperature`, (len(texts), C)
+        temperature (float, optional): Distillation temperature. Defaults to 2.0.
+        num_epochs (int, optional): Defaults to 3.
+        batch_size (int, optional): Defaults to 16.
+        learning_rate (float, optional): Defaults to 5e-5.
+        warmup_proportion (float, optional): Defaults to 0.1.
+        seed (int, optional): Seed of the batch order. Defaults to RANDOM_SEED.
+        on_epoch_end (Callable[[int, float], None], optional): Called with the epoch and its
+            mean loss after every epoch
+    """
+    import torch
+    import torch.nn.functional as F
+    from transformers import get_linear_schedule_with_warmup
+
+    from src.config import DEVICE
+
+    student.to(DEVICE)
+    rng = np.random.default_rng(seed)
+    token_ids = get_token_cache(tokenizer, MAX_LENGTH).encode(texts)
+    lengths = [len(ids) for ids in token_ids]
+    optimizer = torch.optim.AdamW(student.parameters(), lr=learning_rate, weight_decay=0.01)
+    steps_per_epoch = len(make_buckets(lengths, batch_size, HF_MAX_BATCH_TOKENS))
+    total_steps = steps_per_epoch * num_epochs
+    scheduler = get_linear_schedule_with_warmup(
+        optimizer, math.ceil(total_steps * warmup_proportion), total_steps
+    )
+    targets = torch.tensor(soft_labels, dtype=torch.float)
+
+    for epoch in range(num_epochs):
+        student.train()
+        buckets = make_buckets(lengths, batch_size, HF_MAX_BATCH_TOKENS)
+        total_loss = 0.0
+        for b in rng.permutation(len(buckets)):
+            bucket = buckets[b]
+            inputs = {
+                name: tensor.to(DEVICE)
+                for name, tensor in _encode(tokenizer, bucket, token_ids).items()
+            }
+            log_probs = F.log_softmax(student(**inputs).logits / temperature, dim=-1)
+            loss = F.kl_div(log_probs, targets[bucket].to(DEVICE), reduction="batchmean")
+            loss = loss * temperature**2
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(student.parameters(), 1.0)
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+            total_loss += loss.item()
+        student.eval()
+        if on_epoch_end is not None:
+            on_epoch_end(epoch, total_loss / max(len(buckets), 1))
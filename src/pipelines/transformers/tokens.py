@@ -0,0 +1,263 @@
+"""Tokenize-once cache of token ids, shared by every pipeline of a tokenizer family.
+
+Token ids depend on the tokenizer's vocabulary and rules and on the truncation length, not
+on the model, so e.g. both RoBERTa sentiment models (and their ONNX exports) share one cache.
+Entries are keyed by (tokenizer fingerprint, max_length) and the hash of the text. The most
+recently used `capacity` entries are kept in memory, and new entries are persisted as Arrow
+shards of int32 id lists which the next process memory-maps instead of tokenizing again.
+Shards hold at most `capacity` entries between them: the oldest shards are dropped beyond
+that, and the oldest half is merged into one shard once there are too many. Attention masks
+are not stored: before padding they are all ones, and `pad_batch` builds them with the padded
+ids.
+
+Persisting only pays off for texts which are tokenized again, e.g. by repeated evaluations;
+one-off corpus scoring turns it off with `set_token_cache_persistence(False)`.
+"""
+
+import contextlib
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+import pyarrow as pa
+
+from src.config import TOKEN_CACHE_CAPACITY, TOKEN_CACHE_DIR, USE_TOKEN_CACHE
+from src.metrics import metrics
+from src.pipelines.text import text_hash
+
+SHARD_SUFFIX = ".arrow"
+MAX_SHARDS = 16  # the oldest half of the shards is merged into one beyond this
+LOCK_NAME = ".lock"
+SCHEMA = pa.schema([("key", pa.string()), ("input_ids", pa.list_(pa.int32()))])
+
+
+def tokenizer_fingerprint(tokenizer, max_length: int) -> str:
+    """Hash of everything which determines the (truncated) token ids of a text
+
+    Fast tokenizers are fingerprinted by their full serialised definition (normaliser,
+    pre-tokenizer, vocabulary, merges, post-processor), without the padding and truncation
+    settings, so tokenizers of different checkpoints with the same definition match.
+    """
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        definition = json.loads(backend.to_str())
+        definition.pop("padding", None)
+        definition.pop("truncation", None)
+        parts = [json.dumps(definition, sort_keys=True)]
+    else:
+        parts = [type(tokenizer).__name__, json.dumps(tokenizer.get_vocab(), sort_keys=True)]
+    parts.append(str(max_length))
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def pad_batch(token_ids: list[np.ndarray], pad_token_id: int) -> tuple[np.ndarray, np.ndarray]:
+    """Right-pad token id sequences into a batch
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: int64 input ids and attention mask, (n, longest)
+    """
+    longest = max(len(ids) for ids in token_ids)
+    input_ids = np.full((len(token_ids), longest), pad_token_id, dtype=np.int64)
+    attention_mask = np.zeros((len(token_ids), longest), dtype=np.int64)
+    for row, ids in enumerate(token_ids):
+        input_ids[row, : len(ids)] = ids
+        attention_mask[row, : len(ids)] = 1
+    return input_ids, attention_mask
+
+
+def _shard_rows(path: str) -> int:
+    """Number of entries of a shard, read from its metadata"""
+    reader = pa.ipc.open_file(pa.memory_map(path))
+    return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+
+
+class TokenCache:
+    """Token ids of texts for one tokenizer and truncation length.
+
+    `encode` tokenizes only the texts it has not seen, in one batch, and returns int32 id
+    arrays; those read from disk are views into memory-mapped Arrow files. A capacity of 0
+    caches nothing, e.g. to measure tokenization.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        max_length: int,
+        cache_dir: Optional[os.PathLike] = None,
+        fingerprint: Optional[str] = None,
+        capacity: int = TOKEN_CACHE_CAPACITY,
+        persist: bool = True,
+    ):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.fingerprint = fingerprint or tokenizer_fingerprint(tokenizer, max_length)
+        self.cache_dir = Path(cache_dir) / self.fingerprint if cache_dir is not None else None
+        self.capacity = capacity
+        self.persist = persist
+        self.hits = 0
+        self.misses = 0
+        self._ids: OrderedDict[str, np.ndarray] = OrderedDict()  # least recently used first
+        if self.cache_dir is not None and capacity > 0:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            for path in reversed(self._shard_paths()):  # newest first
+                self._load_shard(path)
+                if len(self._ids) >= capacity:
+                    break
+
+    def _shard_paths(self) -> list[str]:
+        """Shard files, oldest first (names start with their creation time)"""
+        assert self.cache_dir is not None
+        return sorted(glob.glob(str(self.cache_dir / f"*{SHARD_SUFFIX}")))
+
+    @contextlib.contextmanager
+    def _lock(self) -> Iterator[None]:
+        """Exclusive lock on the shards, across processes"""
+        assert self.cache_dir is not None
+        with open(self.cache_dir / LOCK_NAME, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_shard(self, path: str) -> None:
+        """Add the entries of an older shard behind those already loaded"""
+        try:
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        except FileNotFoundError:  # merged or dropped by another process meanwhile
+            return
+        loaded = {}
+        for chunk_keys, chunk_ids in zip(
+            table.column("key").chunks, table.column("input_ids").chunks
+        ):
+            offsets = chunk_ids.offsets.to_numpy()
+            values = chunk_ids.values.to_numpy()  # zero-copy view of the mapped file
+            for i, key in enumerate(chunk_keys.to_pylist()):
+                if key not in self._ids:
+                    loaded[key] = values[offsets[i] : offsets[i + 1]]
+        room = self.capacity - len(self._ids)
+        # keep the newest entries of the shard, in front of (older than) those of newer shards
+        for key in reversed(list(loaded)[-room:] if room > 0 else []):
+            self._ids[key] = loaded[key]
+            self._ids.move_to_end(key, last=False)
+
+    def _write_table(self, table: pa.Table, name: str) -> None:
+        assert self.cache_dir is not None
+        path = self.cache_dir / f"{name}{SHARD_SUFFIX}"
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with pa.OSFile(str(tmp_path), "wb") as sink:
+            with pa.ipc.new_file(sink, SCHEMA) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+
+    def _write_shard(self, entries: dict[str, np.ndarray]) -> None:
+        """Persist new entries as a shard, then keep the shards within capacity and count
+
+        Other processes may still map the shards which are dropped or merged away, which
+        unlinking does not disturb.
+        """
+        table = pa.table(
+            [
+                pa.array(list(entries), pa.string()),
+                pa.array(list(entries.values()), SCHEMA[1].type),
+            ],
+            schema=SCHEMA,
+        )
+        with self._lock():
+            self._write_table(table, f"{time.time_ns()}-{os.getpid()}")
+            paths = self._shard_paths()
+            rows = [_shard_rows(path) for path in paths]
+            while len(paths) > 1 and sum(rows) > self.capacity:
+                os.remove(paths.pop(0))
+                rows.pop(0)
+            if len(paths) > MAX_SHARDS:
+                self._merge(paths[: len(paths) // 2])
+
+    def _merge(self, paths: list[str]) -> None:
+        """Merge shards into one which takes the place of the newest of them"""
+        table = pa.concat_tables(pa.ipc.open_file(pa.memory_map(p)).read_all() for p in paths)
+        latest = {key: i for i, key in enumerate(table.column("key").to_pylist())}
+        table = table.take(pa.array(sorted(latest.values()), pa.int64()))
+        newest = Path(paths[-1]).name.split("-")[0]
+        self._write_table(table, f"{newest}-{os.getpid()}-merged")
+        for path in paths:
+            os.remove(path)
+
+    def encode(self, texts: list[str]) -> list[np.ndarray]:
+        """Truncated token ids (with special tokens) of every text
+
+        Args:
+            texts (list[str]): list of texts
+
+        Returns:
+            list[np.ndarray]: int32 token ids per text, in input order
+        """
+        keys = [text_hash(text) for text in texts]
+        found = {}
+        for key in keys:
+            if key in self._ids:
+                self._ids.move_to_end(key)
+                found[key] = self._ids[key]
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        metrics.inc("cache_lookups_total", len(keys) - len(missing), cache="tokens", result="hits")
+        metrics.inc("cache_lookups_total", len(missing), cache="tokens", result="misses")
+        if missing:
+            encodings = self.tokenizer(
+                list(missing.values()), truncation=True, max_length=self.max_length
+            )
+            new = {
+                key: np.asarray(ids, dtype=np.int32)
+                for key, ids in zip(missing, encodings["input_ids"])
+            }
+            found.update(new)
+            if self.capacity > 0:
+                self._ids.update(new)
+                while len(self._ids) > self.capacity:
+                    self._ids.popitem(last=False)
+                if self.cache_dir is not None and self.persist:
+                    self._write_shard(dict(list(new.items())[-self.capacity :]))
+        return [found[key] for key in keys]
+
+    def stats(self) -> dict:
+        """Hit and miss counts of this process, and the number of texts cached in memory"""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._ids)}
+
+
+_token_caches: dict[str, TokenCache] = {}
+_persist = True
+
+
+def set_token_cache_persistence(enabled: bool) -> None:
+    """Whether the token caches of this process write new entries to disk
+
+    Corpus scoring tokenizes each text once, so persisting its entries would only push out
+    those of the texts which are evaluated repeatedly.
+    """
+    global _persist
+    _persist = enabled
+    for cache in _token_caches.values():
+        cache.persist = enabled
+
+
+def get_token_cache(tokenizer, max_length: int) -> TokenCache:
+    """The process-wide token cache of a tokenizer family
+
+    Pipelines whose tokenizers have the same fingerprint get the same cache. It persists to
+    `TOKEN_CACHE_DIR` unless `USE_TOKEN_CACHE` is off.
+    """
+    fingerprint = tokenizer_fingerprint(tokenizer, max_length)
+    if fingerprint not in _token_caches:
+        cache_dir = TOKEN_CACHE_DIR if USE_TOKEN_CACHE else None
+        _token_caches[fingerprint] = TokenCache(
+            tokenizer, max_length, cache_dir, fingerprint, persist=_persist
+        )
+    return _token_caches[fingerprint]
@@ -0,0 +1,3 @@
+"""Long-running inference service which keeps pipelines warm between requests."""
+
+from .batcher import LatencyStats, MicroBatcher
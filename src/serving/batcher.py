@@ -0,0 +1,143 @@
+"""Dynamic micro-batching of single-review requests in front of a pipeline."""
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import numpy as np
+
+from src.pipelines import run_pipeline
+
+
+class LatencyStats:
+    """Rolling latency and throughput statistics over the most recent requests."""
+
+    def __init__(self, window: int = 10_000):
+        self.latencies = deque(maxlen=window)  # seconds, per request
+        self.batch_sizes = deque(maxlen=window)
+        self.finished_at = deque(maxlen=window)  # timestamps, for throughput
+        self.total_requests = 0
+        self.total_errors = 0
+
+    def record_batch(self, latencies: list[float], failed: bool = False) -> None:
+        """Record the request latencies of one finished batch
+
+        Args:
+            latencies (list[float]): Time from enqueue to result of every request in the batch
+            failed (bool, optional): Whether the batch raised an error. Defaults to False.
+        """
+        now = time.perf_counter()
+        self.latencies.extend(latencies)
+        self.finished_at.extend([now] * len(latencies))
+        self.batch_sizes.append(len(latencies))
+        self.total_requests += len(latencies)
+        self.total_errors += len(latencies) if failed else 0
+
+    def summary(self) -> dict:
+        """Summarise the current window
+
+        Returns:
+            dict: Request counts, p50/p99 latency (ms), mean batch size and throughput (rows/s)
+        """
+        summary = {"requests": self.total_requests, "errors": self.total_errors}
+        if not self.latencies:
+            return summary
+        latencies_ms = np.array(self.latencies) * 1000
+        elapsed = self.finished_at[-1] - self.finished_at[0]
+        summary.update(
+            {
+                "p50_ms": float(np.percentile(latencies_ms, 50)),
+                "p99_ms": float(np.percentile(latencies_ms, 99)),
+                "mean_batch_size": float(np.mean(self.batch_sizes)),
+                "rows_per_sec": len(self.finished_at) / elapsed if elapsed > 0 else None,
+            }
+        )
+        return summary
+
+
+class MicroBatcher:
+    """Collects concurrent requests into batches for a single warm pipeline.
+
+    A background task takes the first waiting request, then keeps collecting until either
+    `max_batch_size` requests are in hand or `max_wait_ms` has passed, and runs the whole
+    batch through the pipeline at once. Requests arriving while a batch runs are queued up
+    for the next one, so batches grow with load.
+
+    Example:
+        >>> batcher = MicroBatcher(get_pipeline("setfit", "setfit"))
+        >>> await batcher.start()
+        >>> await batcher.predict("The app keeps crashing")
+        "NEGATIVE"
+    """
+
+    def __init__(self, pipeline: Callable, max_batch_size: int = 32, max_wait_ms: float = 10):
+        self.pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = LatencyStats()
+        # A single thread keeps synchronous models off the event loop without oversubscribing
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Start the background batching task"""
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background batching task"""
+        if self.worker is not None:
+            self.worker.cancel()
+        self.executor.shutdown(wait=False)
+
+    async def predict(self, text: str, title: Optional[str] = None) -> str:
+        """Classify a single review, batched together with any concurrent requests
+
+        Args:
+            text (str): The review text
+            title (str, optional): The review title. Defaults to None.
+
+        Returns:
+            str: The predicted sentiment
+        """
+        assert self.queue is not None, "MicroBatcher.start() must be awaited first"
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, title, future, time.perf_counter()))
+        return await future
+
+    async def _collect_batch(self) -> list[tuple]:
+        """Wait for the next request, then collect more until the batch is full or times out"""
+        assert self.queue is not None
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect_batch()
+            texts, titles, futures, enqueued_at = map(list, zip(*batch))
+            try:
+                preds = await run_pipeline(self.pipeline, texts, titles, executor=self.executor)
+            except Exception as e:  # fan the error out to every waiting request
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                failed = True
+            else:
+                for future, pred in zip(futures, preds):
+                    if not future.done():
+                        future.set_result(pred)
+                failed = False
+            now = time.perf_counter()
+            self.stats.record_batch([now - t for t in enqueued_at], failed=failed)
@@ -0,0 +1,85 @@
+"""Tests of the prediction write path, against SQLite instead of MySQL."""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+from src.data.sink import AsyncPredictionWriter, PredictionSink
+
+
+def read_predictions(path) -> list[tuple]:
+    conn = sqlite3.connect(path)
+    try:
+        query = "SELECT feedback_id, model_version, label, confidence FROM predictions"
+        return conn.execute(f"{query} ORDER BY feedback_id, model_version").fetchall()
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "db"
+
+
+@pytest.fixture
+def sink(path):
+    sink = PredictionSink.sqlite(path, table="predictions", chunk_size=2)
+    sink.create_table()
+    return sink
+
+
+def test_write_replaces_prediction_of_same_model_version(sink, path):
+    sink.write([(1, "setfit@a", "NEGATIVE", 0.25), (1, "setfit@b", "NEUTRAL", None)])
+    sink.write([(1, "setfit@a", "POSITIVE", 0.75)])
+
+    assert read_predictions(path) == [
+        (1, "setfit@a", "POSITIVE", 0.75),
+        (1, "setfit@b", "NEUTRAL", None),
+    ]
+
+
+def test_write_in_chunks(sink, path):
+    rows = [(i, "v", "POSITIVE", 0.5) for i in range(5)]
+
+    assert sink.write(rows) == 5
+    assert sink.stats() == {"rows": 5, "chunks": 3, "retries": 0}
+    assert len(read_predictions(path)) == 5
+
+
+def test_writer_calls_on_written_in_order_after_rows_are_written(sink, path):
+    written = []
+
+    def on_written(batch: int, n_rows: int):
+        return lambda: written.append((batch, n_rows, len(read_predictions(path))))
+
+    async def run():
+        async with AsyncPredictionWriter(sink, max_pending=3) as writer:
+            n_rows = 0
+            for batch, size in enumerate([3, 0, 1, 4]):
+                rows = [(n_rows + i, "v", "NEGATIVE", 0.5) for i in range(size)]
+                n_rows += size
+                await writer.put(rows, on_written(batch, n_rows))
+
+    asyncio.run(run())
+
+    assert [batch for batch, _, _ in written] == [0, 1, 2, 3]
+    for _, n_rows, n_written in written:
+        assert n_written >= n_rows
+    assert len(read_predictions(path)) == 8
+
+
+def test_writer_raises_write_error_instead_of_blocking(path):
+    sink = PredictionSink.sqlite(path, table="predictions", chunk_size=2)  # no table
+    written = []
+
+    async def run():
+        writer = AsyncPredictionWriter(sink, max_pending=2)
+        writer.start()
+        for i in range(100):
+            await writer.put([(i, "v", "POSITIVE", 0.5)], lambda: written.append(i))
+        await writer.close()
+
+    with pytest.raises(sqlite3.OperationalError, match="no such table"):
+        asyncio.run(asyncio.wait_for(run(), timeout=10))
+    assert written == []